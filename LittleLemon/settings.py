@@ -10,8 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -45,11 +48,14 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'LittleLemonAPI.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'LittleLemonAPI.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'LittleLemonAPI.middleware.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -76,15 +82,232 @@ WSGI_APPLICATION = 'LittleLemon.wsgi.application'
 
 
 # Database
-# https://docs.djangoproject.com/en/3.1/ref/settings/#databases
+# https://docs.djangoproject.com/en/5.2/ref/settings/#databases
+#
+# SQLite by default. For PostgreSQL (needs psycopg[pool]) set
+# LITTLELEMON_DB_ENGINE=postgresql and LITTLELEMON_DB_NAME, _USER, _PASSWORD,
+# _HOST and _PORT. Each worker process then takes connections from Django's
+# native pool:
+#   LITTLELEMON_DB_POOL_MIN_SIZE       connections kept open (2)
+#   LITTLELEMON_DB_POOL_MAX_SIZE       most connections per process (10)
+#   LITTLELEMON_DB_POOL_TIMEOUT        seconds a request waits for one (10)
+#   LITTLELEMON_DB_HEALTH_CHECKS       check a pooled connection before use (1)
+#   LITTLELEMON_DB_STATEMENT_TIMEOUT   ms before a query is cancelled (30000, 0 = off)
+#   LITTLELEMON_DB_LOCK_TIMEOUT        ms a query waits for a row lock (5000, 0 = off)
+# LITTLELEMON_DB_POOL=0 turns the pool off (e.g. behind PgBouncer); connections
+# are then kept for LITTLELEMON_DB_CONN_MAX_AGE seconds.
+#
+# SQLite waits up to LITTLELEMON_SQLITE_TIMEOUT seconds (20) for the write
+# lock. Transactions take it when they begin (IMMEDIATE), so concurrent
+# checkouts queue up instead of failing on a lock upgrade, and WAL lets
+# reads go on while one writes.
+
+def env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def env_bool(name, default):
+    return os.environ.get(name, str(int(default))).lower() in ('1', 'true', 'yes', 'on')
+
+
+DB_ENGINE = os.environ.get('LITTLELEMON_DB_ENGINE', 'sqlite')
+
+
+def database(alias=None):
+    """Settings of the default database, or of a location shard's (alias 'shard_<slug>')."""
+    if DB_ENGINE == 'postgresql':
+        name = os.environ.get('LITTLELEMON_DB_NAME', 'littlelemon')
+        pooled = env_bool('LITTLELEMON_DB_POOL', True)
+        options = {
+            'options': '-c statement_timeout=%d -c lock_timeout=%d' % (
+                env_int('LITTLELEMON_DB_STATEMENT_TIMEOUT', 30000), env_int('LITTLELEMON_DB_LOCK_TIMEOUT', 5000),
+            ),
+        }
+        if pooled:
+            options['pool'] = {
+                'min_size': env_int('LITTLELEMON_DB_POOL_MIN_SIZE', 2),
+                'max_size': env_int('LITTLELEMON_DB_POOL_MAX_SIZE', 10),
+                'timeout': env_int('LITTLELEMON_DB_POOL_TIMEOUT', 10),
+            }
+        return {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': f'{name}_{alias}' if alias else name,
+            'USER': os.environ.get('LITTLELEMON_DB_USER', ''),
+            'PASSWORD': os.environ.get('LITTLELEMON_DB_PASSWORD', ''),
+            'HOST': os.environ.get('LITTLELEMON_DB_HOST', ''),
+            'PORT': os.environ.get('LITTLELEMON_DB_PORT', ''),
+            # The pool keeps connections itself
+            'CONN_MAX_AGE': 0 if pooled else env_int('LITTLELEMON_DB_CONN_MAX_AGE', 60),
+            'CONN_HEALTH_CHECKS': env_bool('LITTLELEMON_DB_HEALTH_CHECKS', True),
+            'OPTIONS': options,
+        }
+    if DB_ENGINE == 'sqlite':
+        return {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': BASE_DIR / (f'db_{alias}.sqlite3' if alias else 'db.sqlite3'),
+            'OPTIONS': {
+                'timeout': env_int('LITTLELEMON_SQLITE_TIMEOUT', 20),
+                'transaction_mode': 'IMMEDIATE',
+                'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;',
+            },
+        }
+    raise ImproperlyConfigured(f"LITTLELEMON_DB_ENGINE must be 'sqlite' or 'postgresql', not {DB_ENGINE!r}")
+
 
 DATABASES = {
+    'default': database(),
+}
+
+# Location shards (LittleLemonAPI.routers.LocationShardRouter)
+# Orders and carts of each location slug listed in LITTLELEMON_SHARDS, e.g.
+# "downtown,uptown", are kept in their own database; all other locations, the
+# menu catalog and users use 'default'. Migrate every alias:
+#   python manage.py migrate --database=shard_downtown
+
+LOCATION_SHARDS = {}
+for slug in filter(None, os.environ.get('LITTLELEMON_SHARDS', '').split(',')):
+    alias = f'shard_{slug.strip()}'
+    DATABASES[alias] = database(alias)
+    LOCATION_SHARDS[slug.strip()] = alias
+
+DATABASE_ROUTERS = ['LittleLemonAPI.routers.LocationShardRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Use a shared backend (Redis, Memcached) when running several workers so
+# catalog invalidation reaches all of them.
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
 
+# Seconds a rendered catalog response (menu items, categories) stays cached
+CATALOG_CACHE_TIMEOUT = 300
+
+# Once outdated or expired, a catalog response is rebuilt by one request
+# while the others are served the old one for up to CATALOG_STALE_TIMEOUT
+# seconds. CATALOG_REFRESH_LOCK_TIMEOUT bounds how long a rebuild keeps
+# other processes waiting. Entries are rebuilt early at random, sooner the
+# slower they are to build; CATALOG_EARLY_REFRESH scales that (0 disables).
+CATALOG_STALE_TIMEOUT = 300
+CATALOG_REFRESH_LOCK_TIMEOUT = 10
+CATALOG_EARLY_REFRESH = 1.0
+
+# Upper bounds of the price bands counted in the menu-items/ facets: under 5,
+# 5 to 10, 10 to 20 and 20 or more
+MENU_PRICE_BUCKETS = [5, 10, 20]
+
+# Seconds a user's cart (lines and summary) stays cached; Cart writes clear it
+CART_CACHE_TIMEOUT = 300
+
+# menu-items/sync/ only returns changes at least this many seconds old. Set
+# a few seconds on databases with concurrent writers (PostgreSQL), where a
+# change can commit after one with a higher id and would otherwise be
+# skipped by clients that already synced past it.
+CATALOG_SYNC_SETTLE_SECONDS = 0
+
+
+# Response compression (LittleLemonAPI.middleware.CompressionMiddleware)
+# Encodings in preference order for cached catalog responses; 'br' needs
+# the brotli package and 'zstd' needs zstandard (or Python 3.14+), otherwise
+# they are skipped. Other JSON responses are gzipped with random padding
+# (BREACH); HTML is never compressed.
+
+COMPRESSION_ENCODINGS = ['br', 'zstd', 'gzip']
+COMPRESSION_MIN_SIZE = 1024
+
+
+# Menu autocomplete (GET /api/menu-items/autocomplete/), served from an index
+# each worker keeps in memory. A catalog change made by another worker is
+# picked up within VERSION_CHECK_INTERVAL seconds.
+
+AUTOCOMPLETE = {
+    'LIMIT': 8,
+    'MAX_LIMIT': 20,
+    'FUZZY_MIN_LENGTH': 4,  # words typed with a typo must be at least this long
+    'VERSION_CHECK_INTERVAL': 5,  # seconds
+}
+
+
+# Request metrics (LittleLemonAPI.middleware.MetricsMiddleware), served in
+# Prometheus format at /api/metrics/. Every worker process writes its counters
+# to DIR at most every FLUSH_INTERVAL seconds; the endpoint sums them.
+
+METRICS = {
+    'DIR': BASE_DIR / 'metrics',
+    'FLUSH_INTERVAL': 10,  # seconds
+    'BUCKETS': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),  # latency, seconds
+}
+
+# Per-request profiling (LittleLemonAPI.middleware.ProfilingMiddleware)
+# A superuser adds ?_profile or an `X-Profile` header to a request to have it
+# profiled; captures are written to DIR and only the newest KEEP are kept.
+
+PROFILER = {
+    'DIR': BASE_DIR / 'profiles',
+    'KEEP': 50,
+    'TOP_FUNCTIONS': 30,  # stored in each capture's summary
+    'TOP_QUERIES': 20,    # slowest SQL statements stored with it
+}
+
+# Background tasks (LittleLemonAPI.background)
+# Post-checkout work runs on a bounded thread pool after the order commits.
+# With DURABLE, tasks are stored in the database and run by
+# `python manage.py run_task_worker` instead. EAGER runs them in the
+# request thread (useful in tests).
+
+BACKGROUND_TASKS = {
+    'WORKERS': 4,
+    'QUEUE_SIZE': 100,
+    'DURABLE': False,
+    'EAGER': False,
+    'MAX_ATTEMPTS': 5,
+    'RETRY_BACKOFF': 2.0,  # seconds, doubled on every retry
+}
+
+
+# Recommendations (python manage.py build_recommendations)
+# Items kept per menu item and returned at most by the recommendation endpoints
+
+RECOMMENDATION_TOP_K = 10
+# Seconds before the previous build's watermark that a build reads again, for
+# orders whose checkout committed late; longer than any checkout transaction
+RECOMMENDATION_OVERLAP = 600
+
+
+# Demand forecasts (LittleLemonAPI.forecasting, GET /api/forecasts/)
+# WEEKS of order history are smoothed with factor ALPHA (higher follows
+# recent weeks more closely); results are cached for CACHE_TIMEOUT seconds
+# or until `python manage.py build_forecasts` refreshes them. One request
+# rebuilds missing forecasts while the others wait up to LOCK_TIMEOUT seconds.
+
+FORECASTS = {
+    'WEEKS': 52,
+    'ALPHA': 0.3,
+    'CACHE_TIMEOUT': 3600,
+    'CHUNK_SIZE': 20000,
+    'LOCK_TIMEOUT': 60,
+}
+
+
+# Retention (python manage.py purge_retention, LittleLemonAPI.retention)
+# Days after which abandoned carts (no line changed), tokens neither used nor
+# logged in with, and expired sessions are deleted; None keeps them. Rows are
+# deleted BATCH_SIZE at a time, PAUSE seconds apart. A token's last use is
+# written at most every TOKEN_USE_INTERVAL seconds.
+
+RETENTION = {
+    'CARTS': 30,
+    'TOKENS': 90,
+    'SESSIONS': 0,
+    'BATCH_SIZE': 500,
+    'PAUSE': 0.1,  # seconds
+    'TOKEN_USE_INTERVAL': 3600,  # seconds
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
@@ -142,7 +365,8 @@ REST_FRAMEWORK = {
         'rest_framework.throttling.UserRateThrottle',
     ],
     'DEFAULT_AUTHENTICATION_CLASSES':[
-        'rest_framework.authentication.TokenAuthentication',
+        # TokenAuthentication that records token use for the retention policy
+        'LittleLemonAPI.authentication.TrackedTokenAuthentication',
         "rest_framework.authentication.SessionAuthentication",
     ],
     "DEFAULT_PERMISSION_CLASSES": [
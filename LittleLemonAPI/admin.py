@@ -1,6 +1,168 @@
+from django import forms
 from django.contrib import admin
-from .models import Category, MenuItem, Cart, Order, OrderItem, Rating
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max
+from django.forms.models import BaseModelFormSet
+from django.utils.functional import cached_property
 
+from .models import Category, MenuItem, Cart, Order, OrderItem, Rating, Location
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that uses the table's row estimate instead of an exact
+    COUNT(*) when the changelist is unfiltered and the table is large.
+    """
+    exact_count_limit = 10000
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, 'query', None)
+        if query is not None and not query.where:
+            estimate = estimate_row_count(self.object_list)
+            if estimate is not None and estimate > self.exact_count_limit:
+                return estimate
+        return super().count
+
+
+def estimate_row_count(queryset):
+    model = queryset.model
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                           [model._meta.db_table])
+            row = cursor.fetchone()
+        return row[0] if row and row[0] >= 0 else None
+    # Elsewhere the highest primary key is an index lookup and close enough
+    # for append-mostly tables.
+    return model._default_manager.using(queryset.db).aggregate(estimate=Max('pk'))['estimate']
+
+
+class UsernameAutocompleteFilter(admin.SimpleListFilter):
+    """
+    Filter by a user foreign key through a text box that suggests usernames
+    from the admin autocomplete endpoint, instead of listing every user.
+    """
+    template = 'admin/LittleLemonAPI/autocomplete_filter.html'
+    field_name = None
+
+    def __init__(self, request, params, model, model_admin):
+        self.app_label = model._meta.app_label
+        self.model_name = model._meta.model_name
+        super().__init__(request, params, model, model_admin)
+
+    def lookups(self, request, model_admin):
+        # Must be non-empty for the filter to be rendered
+        return [('', '')]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(**{self.parameter_name: self.value()})
+        return queryset
+
+    def choices(self, changelist):
+        all_choice = next(super().choices(changelist))
+        all_choice['query_parts'] = [
+            (key, value)
+            for key, values in changelist.get_filters_params().items()
+            if key != self.parameter_name
+            for value in (values if isinstance(values, list) else [values])
+        ]
+        yield all_choice
+
+
+def username_filter(field_name, title):
+    return type(f'{field_name.title()}UsernameFilter', (UsernameAutocompleteFilter,), {
+        'field_name': field_name,
+        'title': title,
+        'parameter_name': f'{field_name}__username',
+    })
+
+
+class PrefetchedModelChoiceField(forms.ModelChoiceField):
+    """
+    ModelChoiceField backed by a list fetched once. list_editable builds one
+    form per row, and a plain ModelChoiceField would query its choices to
+    render and validate every one of them.
+    """
+
+    def __init__(self, queryset, **kwargs):
+        super().__init__(queryset, **kwargs)
+        self.objects = {obj.pk: obj for obj in queryset}
+        self.choices = [('', self.empty_label)] + [(pk, str(obj)) for pk, obj in self.objects.items()]
+
+    def __deepcopy__(self, memo):
+        result = super().__deepcopy__(memo)
+        result.objects = self.objects
+        return result
+
+    def include(self, obj):
+        """Offer obj in this form's copy of the field, e.g. the current value."""
+        if obj is not None and obj.pk not in self.objects:
+            self.objects = {**self.objects, obj.pk: obj}
+            self.choices = [*self.choices, (obj.pk, str(obj))]
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        try:
+            return self.objects[int(value)]
+        except (KeyError, TypeError, ValueError):
+            raise ValidationError(self.error_messages['invalid_choice'], code='invalid_choice')
+
+
+class OrderAdminForm(forms.ModelForm):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        field = self.fields.get('delivery_crew')
+        if isinstance(field, PrefetchedModelChoiceField) and self.instance.delivery_crew_id:
+            # Keep an assignee who has since left the crew selectable
+            field.include(self.instance.delivery_crew)
+
+    def _get_validation_exclusions(self):
+        exclude = super()._get_validation_exclusions()
+        if isinstance(self.fields.get('delivery_crew'), PrefetchedModelChoiceField):
+            # Already resolved against the prefetched users; skip the
+            # per-row existence query of ForeignKey.validate()
+            exclude.add('delivery_crew')
+        return exclude
+
+
+class PrefetchedRowsFormSet(BaseModelFormSet):
+    """
+    Changelist formset that resolves each row's hidden pk from the rows it
+    already loaded in one query, instead of one SELECT per row.
+    """
+
+    def add_fields(self, form, index):
+        super().add_fields(form, index)
+        pk_field = form.fields[self._pk_field.name]
+        model_pk = self.model._meta.pk
+
+        def to_python(value):
+            if value in pk_field.empty_values:
+                return None
+            obj = self._existing_object(model_pk.to_python(value))
+            if obj is None:
+                raise ValidationError(pk_field.error_messages['invalid_choice'], code='invalid_choice')
+            return obj
+
+        pk_field.to_python = to_python
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+@admin.register(Location)
+class LocationAdmin(admin.ModelAdmin):
+    list_display = ['name', 'slug']
+    prepopulated_fields = {'slug': ('name',)}
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
@@ -11,27 +173,68 @@ class CategoryAdmin(admin.ModelAdmin):
 class MenuItemAdmin(admin.ModelAdmin):
     list_display = ['title', 'price', 'category', 'featured', 'item_of_the_day', 'inventory']
     list_filter = ['category', 'featured', 'item_of_the_day']
+    list_select_related = ['category']
     search_fields = ['title', 'description']
     list_editable = ['price', 'featured', 'item_of_the_day', 'inventory']
+    filter_horizontal = ['locations']
 
 @admin.register(Cart)
-class CartAdmin(admin.ModelAdmin):
+class CartAdmin(LargeTableAdmin):
     list_display = ['user', 'menuitem', 'quantity', 'unit_price', 'price']
-    list_filter = ['user']
+    list_filter = [username_filter('user', 'user')]
+    list_select_related = ['user', 'menuitem']
+    autocomplete_fields = ['user', 'menuitem']
 
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(LargeTableAdmin):
     list_display = ['id', 'user', 'delivery_crew', 'status', 'total', 'date']
-    list_filter = ['status', 'date', 'delivery_crew']
+    list_filter = ['status', 'date', username_filter('delivery_crew', 'delivery crew')]
+    list_select_related = ['user', 'delivery_crew']
     search_fields = ['user__username']
     list_editable = ['status', 'delivery_crew']
+    autocomplete_fields = ['user']
+    form = OrderAdminForm
+
+    def get_queryset(self, request):
+        # Also used to load the rows of a list_editable POST
+        return super().get_queryset(request).select_related('user', 'delivery_crew')
+
+    def get_changelist_form(self, request, **kwargs):
+        kwargs.setdefault('form', OrderAdminForm)
+        return super().get_changelist_form(request, **kwargs)
+
+    def get_changelist_formset(self, request, **kwargs):
+        kwargs.setdefault('formset', PrefetchedRowsFormSet)
+        return super().get_changelist_formset(request, **kwargs)
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == 'delivery_crew':
+            # Only crew members can be assigned; the form class is built once
+            # per request, so this is one query for the whole changelist.
+            return PrefetchedModelChoiceField(
+                User.objects.filter(groups__name='Delivery crew').order_by('username'),
+                required=False,
+            )
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+    def save_model(self, request, obj, form, change):
+        if change and form.changed_data:
+            # Write only the columns edited in the row
+            obj.save(update_fields=[*form.changed_data, 'updated_at'])
+        else:
+            super().save_model(request, obj, form, change)
 
 @admin.register(OrderItem)
-class OrderItemAdmin(admin.ModelAdmin):
+class OrderItemAdmin(LargeTableAdmin):
     list_display = ['order', 'menuitem', 'quantity', 'unit_price', 'price']
     list_filter = ['order__status']
-    
+    list_select_related = ['order__user', 'menuitem']
+    raw_id_fields = ['order']
+    autocomplete_fields = ['menuitem']
+
 @admin.register(Rating)
-class RatingAdmin(admin.ModelAdmin):
+class RatingAdmin(LargeTableAdmin):
     list_display = ['user', 'menuitem', 'rating', 'created_at']
-    list_filter = ['rating', 'created_at']
+    list_filter = ['rating', 'created_at', username_filter('user', 'user')]
+    list_select_related = ['user', 'menuitem']
+    autocomplete_fields = ['user', 'menuitem']
@@ -0,0 +1,21 @@
+from django.core.cache import cache
+from django.utils import timezone
+from rest_framework.authentication import TokenAuthentication
+
+from . import retention
+from .models import TokenUse
+
+
+def record_token_use(token):
+    """Stamp the token's last use, at most once per TOKEN_USE_INTERVAL seconds (a cache.add per request)"""
+    if cache.add('token-used:%s' % token.user_id, 1, retention.get_setting('TOKEN_USE_INTERVAL')):
+        TokenUse.objects.update_or_create(token=token, defaults={'last_used': timezone.now()})
+
+
+class TrackedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication that records when each token was last used (see retention.stale_tokens)"""
+
+    def authenticate_credentials(self, key):
+        user, token = super().authenticate_credentials(key)
+        record_token_use(token)
+        return user, token
@@ -0,0 +1,227 @@
+"""
+Search-as-you-type over menu item titles and category names, answered
+from memory without touching the database.
+
+Each worker builds an index on first use:
+
+- the distinct words of every title (accents and case folded), sorted,
+  so the words starting with what was typed are one bisect away;
+- for typos, the first characters of every word and their single-
+  character deletions, each mapped to the words they came from. Two
+  strings one edit apart (a missing, extra, wrong or swapped letter)
+  always share a deletion, so a query only probes itself and its own
+  deletions and checks the few words found.
+
+Every typed word must match a word of the title (the last one usually
+only partly typed). Results are ranked by typos, then titles starting
+with the query, categories before items, and shorter titles.
+
+Catalog signals mark this worker's index stale; other workers notice
+the catalog version change within VERSION_CHECK_INTERVAL seconds. The
+next lookup rebuilds the index while concurrent ones keep using the
+old one.
+"""
+import heapq
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db import transaction
+
+from .cache import get_catalog_version
+
+DEFAULTS = {
+    'LIMIT': 8,
+    'MAX_LIMIT': 20,
+    'FUZZY_MIN_LENGTH': 4,  # shorter words must be typed without typos
+    'VERSION_CHECK_INTERVAL': 5,  # seconds
+}
+
+# Typos are looked for in the first characters of a word only
+FUZZY_PREFIX = 10
+
+WORD = re.compile(r'\w+')
+
+CATEGORY = 'category'
+MENU_ITEM = 'menu_item'
+
+
+def get_setting(name):
+    return getattr(settings, 'AUTOCOMPLETE', {}).get(name, DEFAULTS[name])
+
+
+def normalize(text):
+    """Lower case without accents: 'Crème Brûlée' -> 'creme brulee'"""
+    decomposed = unicodedata.normalize('NFKD', text)
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).casefold()
+
+
+def deletions(word):
+    return {word[:index] + word[index + 1:] for index in range(len(word))}
+
+
+def edit_distance(a, b):
+    """Optimal string alignment distance (a swap of neighbours counts as one edit)"""
+    previous, current = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        before, previous, current = previous, current, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (a[i - 1] != b[j - 1]),
+            )
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before[j - 2] + 1)
+    return current[-1]
+
+
+def prefix_distance(typed, word):
+    """Edits between what was typed and the closest start of word"""
+    if word.startswith(typed):
+        return 0
+    return min((
+        edit_distance(typed, word[:length])
+        for length in (len(typed) - 1, len(typed), len(typed) + 1)
+        if 0 < length <= len(word)
+    ), default=len(typed))
+
+
+class Index:
+    def __init__(self, entries, location_slugs, version):
+        """entries: [(type, id, title, extra fields, location slugs or empty for everywhere)]"""
+        self.version = version
+        self.location_slugs = frozenset(location_slugs)
+        # Numbered in the order ties are broken in: categories first, then shorter titles
+        entries = sorted(entries, key=lambda entry: (entry[0] != CATEGORY, len(entry[2]), entry[2]))
+        self.entries = []
+        word_entries = {}
+        for number, (kind, pk, title, extra, locations) in enumerate(entries):
+            normalized = normalize(title)
+            self.entries.append((kind, pk, title, extra, frozenset(locations), normalized))
+            for word in WORD.findall(normalized):
+                word_entries.setdefault(word, set()).add(number)
+        self.words = sorted(word_entries)
+        self.word_entries = {word: tuple(numbers) for word, numbers in word_entries.items()}
+
+        min_length = get_setting('FUZZY_MIN_LENGTH')
+        self.fuzzy_min_length = min_length
+        self.typos = {}
+        for word in self.words:
+            for length in range(max(min_length - 1, 1), min(len(word), FUZZY_PREFIX) + 1):
+                start = word[:length]
+                keys = {start} | deletions(start) if length >= min_length else {start}
+                for key in keys:
+                    self.typos.setdefault(key, set()).add(word)
+
+    def match_word(self, typed, enough=None):
+        """
+        {entry number: edits} of the entries with a word starting (about)
+        like typed; typos are not looked for once `enough` entries match exactly.
+        """
+        matches = {}
+        words = {}
+        position = bisect_left(self.words, typed)
+        while position < len(self.words) and self.words[position].startswith(typed):
+            words[self.words[position]] = 0
+            position += 1
+        exact = sum(len(self.word_entries[word]) for word in words) if enough else 0
+        if len(typed) >= self.fuzzy_min_length and not (enough and exact >= enough):
+            probe = typed[:FUZZY_PREFIX]
+            for key in {probe} | deletions(probe):
+                for word in self.typos.get(key, ()):
+                    if word not in words and prefix_distance(typed, word) <= 1:
+                        words[word] = 1
+        for word, edits in words.items():
+            for number in self.word_entries[word]:
+                if edits < matches.get(number, 2):
+                    matches[number] = edits
+        return matches
+
+    def search(self, query, limit, location=None):
+        query = normalize(query).strip()
+        typed = WORD.findall(query)
+        if not typed:
+            return []
+        # A single word matching `limit` entries exactly needs no typo search:
+        # those would rank after them anyway
+        enough = limit if len(typed) == 1 and location is None else None
+        scores = None
+        for word in typed:
+            matches = self.match_word(word, enough)
+            if scores is None:
+                scores = matches
+            else:
+                scores = {number: edits + matches[number] for number, edits in scores.items() if number in matches}
+            if not scores:
+                return []
+
+        entries = self.entries
+        ranked = heapq.nsmallest(limit, (
+            (edits, not entries[number][5].startswith(query), number)
+            for number, edits in scores.items()
+            if location is None or not entries[number][4] or location in entries[number][4]
+        ))
+        results = []
+        for edits, later, number in ranked:
+            kind, pk, title, extra, locations, normalized = entries[number]
+            results.append({'type': kind, 'id': pk, 'title': title, **extra})
+        return results
+
+
+def build_index():
+    from .models import Category, Location, MenuItem
+
+    version = get_catalog_version()
+    item_locations = {}
+    for menuitem_id, slug in MenuItem.locations.through.objects.values_list('menuitem_id', 'location__slug'):
+        item_locations.setdefault(menuitem_id, set()).add(slug)
+    entries = [
+        (CATEGORY, pk, title, {'slug': slug}, ())
+        for pk, title, slug in Category.objects.values_list('id', 'title', 'slug')
+    ]
+    entries += [
+        (MENU_ITEM, pk, title, {'category': category_id}, item_locations.get(pk, ()))
+        for pk, title, category_id in MenuItem.objects.values_list('id', 'title', 'category_id')
+    ]
+    return Index(entries, Location.objects.values_list('slug', flat=True), version)
+
+
+_index = None
+_stale = False
+_next_check = 0.0
+_lock = threading.Lock()
+
+
+def get_index():
+    """This worker's index, rebuilt first if the catalog changed"""
+    global _index, _stale, _next_check
+    now = time.monotonic()
+    if _index is not None and not _stale and now < _next_check:
+        return _index
+    if _index is not None and not _stale:
+        _next_check = now + get_setting('VERSION_CHECK_INTERVAL')
+        if get_catalog_version() == _index.version:
+            return _index
+    # Only one thread rebuilds; the others keep answering from the old index
+    if not _lock.acquire(blocking=_index is None):
+        return _index
+    try:
+        if _index is None or _stale or get_catalog_version() != _index.version:
+            _stale = False
+            _index = build_index()
+            _next_check = time.monotonic() + get_setting('VERSION_CHECK_INTERVAL')
+        return _index
+    finally:
+        _lock.release()
+
+
+def invalidate():
+    """Rebuild this worker's index on the next lookup (after the current transaction commits)"""
+    def mark_stale():
+        global _stale
+        _stale = True
+    transaction.on_commit(mark_stale)
@@ -0,0 +1,218 @@
+"""
+In-process background tasks.
+
+Functions decorated with @task get a .delay(*args, **kwargs) method. The call
+is dispatched once the surrounding transaction commits, either to a bounded
+thread pool in this process or, when durable, to the BackgroundTask table
+that the run_task_worker command drains. Failed tasks are retried with
+exponential backoff.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, router, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'WORKERS': 4,
+    'QUEUE_SIZE': 100,
+    'DURABLE': False,
+    'EAGER': False,
+    'MAX_ATTEMPTS': 5,
+    'RETRY_BACKOFF': 2.0,
+}
+
+registry = {}
+
+
+def get_setting(name):
+    return getattr(settings, 'BACKGROUND_TASKS', {}).get(name, DEFAULTS[name])
+
+
+def task(func=None, *, name=None, max_attempts=None):
+    """Register func as a background task."""
+    def decorator(func):
+        func.task_name = name or f'{func.__module__}.{func.__qualname__}'
+        func.max_attempts = max_attempts or get_setting('MAX_ATTEMPTS')
+        func.delay = lambda *args, **kwargs: enqueue(func.task_name, *args, **kwargs)
+        registry[func.task_name] = func
+        return func
+    return decorator(func) if func else decorator
+
+
+def enqueue(name, *args, durable=None, commit_using=DEFAULT_DB_ALIAS, **kwargs):
+    """
+    Schedule a registered task to run after the current transaction on
+    commit_using commits (pass the shard alias for work on a shard).
+    Durable tasks are written to the database inside that transaction when
+    BackgroundTask lives on the same database, otherwise once it commits,
+    so they exist exactly when the data they refer to does.
+    """
+    if name not in registry:
+        raise KeyError(f'Unknown background task {name!r}')
+    if durable is None:
+        durable = get_setting('DURABLE')
+
+    if durable:
+        from .models import BackgroundTask
+
+        def store():
+            BackgroundTask.objects.create(
+                name=name, args=list(args), kwargs=kwargs, max_attempts=registry[name].max_attempts,
+            )
+            metrics.incr('enqueued')
+
+        if router.db_for_write(BackgroundTask) == commit_using:
+            store()
+        else:
+            transaction.on_commit(store, using=commit_using)
+        return
+
+    enqueued_at = time.monotonic()
+    transaction.on_commit(lambda: get_executor().submit(name, args, kwargs, enqueued_at), using=commit_using)
+
+
+def backoff_delay(attempt):
+    """Seconds to wait before retry number `attempt` (1-based)."""
+    return get_setting('RETRY_BACKOFF') * 2 ** (attempt - 1)
+
+
+class TaskMetrics:
+    """Thread-safe counters and latency totals for the tasks of this process."""
+
+    counters = ('enqueued', 'started', 'succeeded', 'failed', 'retried', 'ran_inline')
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = dict.fromkeys(self.counters, 0)
+        self.queue_depth = 0
+        self.wait_seconds = 0.0
+        self.run_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def incr(self, counter, amount=1):
+        with self.lock:
+            self.values[counter] += amount
+
+    def queued(self, amount):
+        with self.lock:
+            self.queue_depth += amount
+
+    def observe(self, wait, run):
+        with self.lock:
+            self.wait_seconds += wait
+            self.run_seconds += run
+            self.max_wait_seconds = max(self.max_wait_seconds, wait)
+
+    def snapshot(self):
+        with self.lock:
+            started = self.values['started'] or 1
+            return {
+                **self.values,
+                'queue_depth': self.queue_depth,
+                'avg_wait_ms': round(self.wait_seconds / started * 1000, 3),
+                'max_wait_ms': round(self.max_wait_seconds * 1000, 3),
+                'avg_run_ms': round(self.run_seconds / started * 1000, 3),
+            }
+
+
+metrics = TaskMetrics()
+
+
+class TaskExecutor:
+    """
+    Thread pool with a bounded queue. When the queue is full the task runs
+    in the calling thread instead of being dropped.
+    """
+
+    def __init__(self, workers, queue_size):
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='littlelemon-task')
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+
+    def submit(self, name, args, kwargs, enqueued_at, attempt=1):
+        metrics.incr('enqueued')
+        if get_setting('EAGER') or not self.slots.acquire(blocking=False):
+            metrics.incr('ran_inline')
+            self.run(name, args, kwargs, enqueued_at, attempt, release=False)
+            return
+        metrics.queued(1)
+        self.pool.submit(self.run, name, args, kwargs, enqueued_at, attempt)
+
+    def run(self, name, args, kwargs, enqueued_at, attempt, release=True):
+        if release:
+            metrics.queued(-1)
+        started = time.monotonic()
+        metrics.incr('started')
+        func = registry[name]
+        try:
+            func(*args, **kwargs)
+        except Exception:
+            if attempt < func.max_attempts:
+                delay = backoff_delay(attempt)
+                logger.warning('Task %s failed (attempt %s), retrying in %ss', name, attempt, delay,
+                               exc_info=True)
+                metrics.incr('retried')
+                timer = threading.Timer(delay, self.submit, (name, args, kwargs, time.monotonic(), attempt + 1))
+                timer.daemon = True
+                timer.start()
+            else:
+                logger.exception('Task %s failed after %s attempts', name, attempt)
+                metrics.incr('failed')
+        else:
+            metrics.incr('succeeded')
+        finally:
+            metrics.observe(started - enqueued_at, time.monotonic() - started)
+            if release:
+                self.slots.release()
+                # Pool threads keep their own database connection
+                close_old_connections()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = TaskExecutor(get_setting('WORKERS'), get_setting('QUEUE_SIZE'))
+    return _executor
+
+
+def run_durable_task(record):
+    """Run one claimed BackgroundTask row and record the outcome."""
+    func = registry.get(record.name)
+    started = timezone.now()
+    wait = (started - record.run_at).total_seconds()
+    metrics.incr('started')
+    try:
+        if func is None:
+            raise KeyError(f'Unknown background task {record.name!r}')
+        func(*record.args, **record.kwargs)
+    except Exception as exc:
+        record.last_error = repr(exc)
+        if func is not None and record.attempts < record.max_attempts:
+            record.status = record.PENDING
+            record.run_at = timezone.now() + timedelta(seconds=backoff_delay(record.attempts))
+            metrics.incr('retried')
+            logger.warning('Task %s #%s failed (attempt %s)', record.name, record.pk, record.attempts,
+                           exc_info=True)
+        else:
+            record.status = record.FAILED
+            record.finished_at = timezone.now()
+            metrics.incr('failed')
+            logger.exception('Task %s #%s failed after %s attempts', record.name, record.pk, record.attempts)
+    else:
+        record.status = record.DONE
+        record.finished_at = timezone.now()
+        metrics.incr('succeeded')
+    metrics.observe(wait, (timezone.now() - started).total_seconds())
+    record.save(update_fields=['status', 'run_at', 'finished_at', 'last_error'])
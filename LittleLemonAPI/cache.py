@@ -0,0 +1,237 @@
+import hashlib
+import math
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+from rest_framework.response import Response
+
+from . import compression, metrics
+
+CATALOG_VERSION_KEY = 'catalog:version'
+
+
+def get_catalog_version():
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        version = time.time_ns()
+        cache.add(CATALOG_VERSION_KEY, version, timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY, version)
+    return version
+
+
+def bump_catalog_version():
+    """Invalidate every cached catalog response (called on menu/category writes)."""
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.set(CATALOG_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def catalog_cache_key(request, prefix='catalog'):
+    # No catalog version: entries carry theirs, so an outdated one can be served while it is rebuilt.
+    # The location comes from ?location= (part of the path) or else the
+    # X-Location header (see sharding.get_request_location).
+    location = '' if 'location' in request.query_params else request.META.get('HTTP_X_LOCATION', '')
+    path = '%s|%s|%s' % (request.accepted_renderer.format, request.get_full_path(), location)
+    return '%s:%s' % (prefix, hashlib.md5(path.encode()).hexdigest())
+
+
+def cached_catalog_fragments(builders, variant=''):
+    """
+    Serialized catalog data by name, read with one cache round trip.
+    Missing entries are built by builders[name]() and stored together
+    until the catalog changes.
+    """
+    version = get_catalog_version()
+    keys = {name: 'catalog-fragment:%s:%s:%s' % (version, name, variant) for name in builders}
+    found = cache.get_many(keys.values())
+    fragments, missing = {}, {}
+    for name, key in keys.items():
+        metrics.cache_lookup('catalog_fragment', key in found)
+        if key in found:
+            fragments[name] = found[key]
+        else:
+            fragments[name] = missing[key] = builders[name]()
+    if missing:
+        cache.set_many(missing, getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300))
+    return fragments
+
+
+def cart_snapshot_key(user_id, using):
+    # Lines embed menu item titles and prices, so a catalog change retires every snapshot
+    return 'cart:%s:%s:%s' % (get_catalog_version(), using, user_id)
+
+
+def get_cart_snapshot(user_id, using):
+    snapshot = cache.get(cart_snapshot_key(user_id, using))
+    metrics.cache_lookup('cart', snapshot is not None)
+    return snapshot
+
+
+def set_cart_snapshot(user_id, using, snapshot):
+    cache.set(cart_snapshot_key(user_id, using), snapshot, getattr(settings, 'CART_CACHE_TIMEOUT', 300))
+
+
+def clear_cart_snapshot(user_id, using):
+    """Drop a user's cached cart once the current transaction on `using` commits."""
+    transaction.on_commit(lambda: cache.delete(cart_snapshot_key(user_id, using)), using=using)
+
+
+class SingleFlight:
+    """
+    At most one computation per key at a time in this process: the first
+    caller leads, later ones get an Event set when the leader lands.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = {}
+
+    def lead(self, key):
+        """(True, event) for the caller that should compute, (False, event) for the others"""
+        with self.lock:
+            event = self.flights.get(key)
+            if event is not None:
+                return False, event
+            event = self.flights[key] = threading.Event()
+            return True, event
+
+    def land(self, key):
+        with self.lock:
+            event = self.flights.pop(key, None)
+        if event is not None:
+            event.set()
+
+
+catalog_flights = SingleFlight()
+
+
+def needs_refresh(entry, version):
+    """
+    Outdated (catalog changed), expired, or picked for early refresh: the
+    closer to expiry and the slower to rebuild, the likelier a request
+    rebuilds it ahead of time (probabilistic early expiration), so entries
+    are seldom found expired by a crowd.
+    """
+    if entry['version'] != version:
+        return True
+    remaining = entry['expires'] - time.time()
+    beta = getattr(settings, 'CATALOG_EARLY_REFRESH', 1.0)
+    return remaining <= 0 or entry['delta'] * beta * -math.log(1.0 - random.random()) >= remaining
+
+
+def wait_for_entry(key, timeout):
+    """Poll the cache for an entry another process is building"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        time.sleep(0.02)
+        entry = cache.get(key)
+        if entry is not None:
+            return entry
+    return None
+
+
+class CachedCatalogMixin:
+    """
+    Cache rendered JSON bodies of public catalog GETs, together with a
+    precompressed copy per encoding, until the catalog changes.
+
+    When an entry is outdated or expired, one request rebuilds it: one per
+    process (SingleFlight) and, through a short lock in the cache, one
+    across processes. Meanwhile the others are served the old body for up
+    to CATALOG_STALE_TIMEOUT seconds, or wait for the new one when there
+    is none.
+
+    Only the JSON renderer is cached: the browsable API page embeds the
+    current user.
+    """
+
+    catalog_cache_timeout = None
+    # Off only to compare with (see bench_stampede)
+    single_flight = True
+
+    def get(self, request, *args, **kwargs):
+        self._catalog_cache_key = self._catalog_flight = None
+        if request.accepted_renderer.format != 'json':
+            return super().get(request, *args, **kwargs)
+
+        key = catalog_cache_key(request)
+        version = get_catalog_version()
+        entry = cache.get(key)
+        if entry is not None and not needs_refresh(entry, version):
+            return self.cached_response(entry, version)
+
+        if self.single_flight:
+            lock_timeout = getattr(settings, 'CATALOG_REFRESH_LOCK_TIMEOUT', 10)
+            leader, landed = catalog_flights.lead(key)
+            if not leader:
+                # Being rebuilt in this process
+                if entry is None and landed.wait(lock_timeout):
+                    entry = cache.get(key)
+                if entry is not None:
+                    return self.cached_response(entry, version)
+            elif cache.add('%s:lock' % key, 1, lock_timeout):
+                self._catalog_flight = key
+            else:
+                # Being rebuilt by another process
+                if entry is None:
+                    entry = wait_for_entry(key, lock_timeout)
+                catalog_flights.land(key)
+                if entry is not None:
+                    return self.cached_response(entry, version)
+
+        metrics.cache_lookup('catalog', False)
+        self._catalog_cache_key = key
+        self._catalog_version = version
+        self._catalog_started = time.perf_counter()
+        try:
+            return super().get(request, *args, **kwargs)
+        except BaseException:
+            # DRF re-raises unexpected errors without finalize_response
+            self.land_catalog_flight()
+            raise
+
+    def land_catalog_flight(self):
+        flight, self._catalog_flight = getattr(self, '_catalog_flight', None), None
+        if flight:
+            cache.delete('%s:lock' % flight)
+            catalog_flights.land(flight)
+
+    def cached_response(self, entry, version):
+        metrics.cache_lookup('catalog', True)
+        response = HttpResponse(entry['content'], content_type=entry['content_type'])
+        response.precompressed = entry['encoded']
+        # Built before the last catalog change: the body does not match the
+        # current validators (see ConditionalGetMixin)
+        response.stale = entry['version'] != version
+        patch_vary_headers(response, ['X-Location'])
+        return response
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        try:
+            response = super().finalize_response(request, response, *args, **kwargs)
+            key = getattr(self, '_catalog_cache_key', None)
+            if key and isinstance(response, Response) and response.status_code == 200:
+                response.render()
+                timeout = self.catalog_cache_timeout or getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300)
+                entry = {
+                    'content': response.content,
+                    'content_type': response['Content-Type'],
+                    'encoded': compression.precompress(response.content),
+                    'version': self._catalog_version,
+                    'expires': time.time() + timeout,
+                    # Rebuild time, for the early refresh
+                    'delta': time.perf_counter() - self._catalog_started,
+                }
+                cache.set(key, entry, timeout + getattr(settings, 'CATALOG_STALE_TIMEOUT', 300))
+                response.precompressed = entry['encoded']
+                patch_vary_headers(response, ['X-Location'])
+            return response
+        finally:
+            self.land_catalog_flight()
@@ -0,0 +1,63 @@
+"""
+Change tracking for the menu catalog, so clients can sync deltas.
+
+Every save or delete of a MenuItem or Category appends a CatalogChange in
+the same transaction; its id is the cursor clients pass back as ?since=.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Exists, Max, OuterRef
+from django.utils import timezone
+
+from .models import CatalogChange, Category, MenuItem
+
+KINDS = {
+    MenuItem: CatalogChange.MENU_ITEM,
+    Category: CatalogChange.CATEGORY,
+}
+
+
+def record_changes(model, object_ids, deleted=False):
+    """Log changed (or deleted) rows; needed after QuerySet.update(), which sends no signals."""
+    CatalogChange.objects.bulk_create(
+        [CatalogChange(kind=KINDS[model], object_id=object_id, deleted=deleted) for object_id in object_ids]
+    )
+
+
+def changes_since(cursor, limit):
+    """
+    (changes, more) after a cursor, oldest first: the latest
+    (kind, object_id, deleted) of every object changed in the window.
+    An unchanged catalog costs this one primary key range query.
+    """
+    changes = CatalogChange.objects.filter(pk__gt=cursor)
+    settle = getattr(settings, 'CATALOG_SYNC_SETTLE_SECONDS', 0)
+    if settle:
+        changes = changes.filter(created_at__lte=timezone.now() - timedelta(seconds=settle))
+    rows = list(changes.order_by('pk').values_list('pk', 'kind', 'object_id', 'deleted')[:limit + 1])
+    return rows[:limit], len(rows) > limit
+
+
+def needs_reset(cursor):
+    """Tombstones this client has not seen were purged: it has to sync from scratch."""
+    return cursor > 0 and CatalogChange.objects.filter(kind=CatalogChange.RESET, object_id__gt=cursor).exists()
+
+
+def compact(tombstone_days):
+    """
+    Drop changes superseded by a later change of the same object, and
+    tombstones older than tombstone_days. Clients whose cursor is older
+    than the newest purged tombstone are told to reset.
+    """
+    later = CatalogChange.objects.filter(kind=OuterRef('kind'), object_id=OuterRef('object_id'), pk__gt=OuterRef('pk'))
+    superseded, _ = CatalogChange.objects.exclude(kind=CatalogChange.RESET).filter(Exists(later)).delete()
+
+    old_tombstones = CatalogChange.objects.filter(deleted=True, created_at__lt=timezone.now() - timedelta(days=tombstone_days))
+    horizon = old_tombstones.aggregate(horizon=Max('pk'))['horizon']
+    purged = 0
+    if horizon is not None:
+        purged, _ = old_tombstones.filter(pk__lte=horizon).delete()
+        CatalogChange.objects.filter(kind=CatalogChange.RESET).delete()
+        CatalogChange.objects.create(kind=CatalogChange.RESET, object_id=horizon)
+    return superseded, purged
@@ -0,0 +1,97 @@
+import gzip
+
+from django.conf import settings
+from django.utils.text import compress_string
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from compression import zstd
+except ImportError:
+    try:
+        import zstandard as zstd
+    except ImportError:
+        zstd = None
+
+
+def _gzip(data, level):
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def _brotli(data, level):
+    return brotli.compress(data, quality=level)
+
+
+def _zstd(data, level):
+    return zstd.compress(data, level=level)
+
+
+# encoding -> (compress function, level for per-request use, level for cached bodies)
+CODECS = {'gzip': (_gzip, 6, 9)}
+if brotli is not None:
+    CODECS['br'] = (_brotli, 4, 9)
+if zstd is not None:
+    CODECS['zstd'] = (_zstd, 3, 12)
+
+
+def available_encodings():
+    """Encodings enabled in settings whose library is installed, in preference order."""
+    preferred = getattr(settings, 'COMPRESSION_ENCODINGS', ['br', 'zstd', 'gzip'])
+    return [encoding for encoding in preferred if encoding in CODECS]
+
+
+def min_size():
+    return getattr(settings, 'COMPRESSION_MIN_SIZE', 1024)
+
+
+def compress(data, encoding, static=False):
+    """
+    Compress data with the given encoding. Cached bodies are compressed once,
+    so static=True trades CPU for the smallest output.
+    """
+    func, level, static_level = CODECS[encoding]
+    return func(data, static_level if static else level)
+
+
+def compress_padded(data):
+    """
+    gzip with up to 100 random bytes in the header, as GZipMiddleware does,
+    so the length of a body mixing secrets with request input does not give
+    them away (BREACH).
+    """
+    return compress_string(data, max_random_bytes=100)
+
+
+def precompress(data):
+    """Every available encoding of data, for storing next to a cached body."""
+    if len(data) < min_size():
+        return {}
+    return {encoding: compress(data, encoding, static=True) for encoding in available_encodings()}
+
+
+def negotiate(accept_encoding, encodings=None):
+    """Pick the best of encodings (default: every available one) for an Accept-Encoding header, or None."""
+    if not accept_encoding:
+        return None
+
+    accepted = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+
+    best, best_q = None, 0.0
+    for encoding in encodings or available_encodings():
+        q = accepted.get(encoding, accepted.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
@@ -0,0 +1,106 @@
+import hashlib
+from functools import partial
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+
+class ConditionalGetMixin:
+    """
+    Answers GET/HEAD with 304 Not Modified when the client's validators still
+    match, using only the cheap query from get_validator_queryset(); the
+    object is never fetched or serialized on that path.
+
+    Subclasses implement get_validators() returning (version, last_modified)
+    or None when the resource does not exist.
+
+    A response marked stale (an outdated cache entry served while it is
+    rebuilt, see CachedCatalogMixin) gets no validators: they describe the
+    current data, not that body.
+    """
+
+    def get_validators(self):
+        raise NotImplementedError
+
+    def get_etag(self, version):
+        # Representation depends on the negotiated renderer and query string
+        # (pagination, filters), so both are part of the validator.
+        key = '%s|%s|%s|%s' % (
+            self.__class__.__name__,
+            version,
+            getattr(self.request.accepted_renderer, 'format', ''),
+            self.request.META.get('QUERY_STRING', ''),
+        )
+        return quote_etag(hashlib.md5(key.encode()).hexdigest())
+
+    def get(self, request, *args, **kwargs):
+        validators = self.get_validators()
+        if validators is None:
+            return super().get(request, *args, **kwargs)
+
+        version, last_modified = validators
+        etag = self.get_etag(version)
+        last_modified = int(last_modified.timestamp()) if last_modified else None
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is not None:
+            return response
+
+        response = super().get(request, *args, **kwargs)
+        if response.status_code == 200 and not getattr(response, 'stale', False):
+            response['ETag'] = etag
+            if last_modified:
+                response['Last-Modified'] = http_date(last_modified)
+        return response
+
+
+class ConditionalRetrieveMixin(ConditionalGetMixin):
+    """
+    Validators for a single object, read from its updated_at column. The
+    row is loaded with only those columns (plus permission_fields, read by
+    object permissions) and checked with check_object_permissions, so a
+    304 is never sent to a user the full GET would refuse.
+    """
+
+    validator_fields = ('updated_at',)
+    permission_fields = ()
+
+    def get_validators(self):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.get_queryset().filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]}).order_by()
+        related = {field.rsplit('__', 1)[0] for field in self.validator_fields if '__' in field}
+        if related:
+            queryset = queryset.select_related(*related)
+        obj = queryset.only(*self.validator_fields, *related, *self.permission_fields).first()
+        if obj is None:
+            return None
+        self.check_object_permissions(self.request, obj)
+
+        values = [value for value in map(partial(resolve_field, obj), self.validator_fields) if value is not None]
+        last_modified = max(values)
+        version = '-'.join(str(value.timestamp()) for value in values)
+        return version, last_modified
+
+
+def resolve_field(obj, path):
+    """obj.category.updated_at for 'category__updated_at' (None past a null relation)"""
+    for name in path.split('__'):
+        if obj is None:
+            return None
+        obj = getattr(obj, name)
+    return obj
+
+
+class ConditionalListMixin(ConditionalGetMixin):
+    """
+    Validators for a whole list: row count plus newest updated_at. A delete
+    does not move the newest timestamp, so lists only send an ETag and no
+    Last-Modified.
+    """
+
+    def get_validators(self):
+        stats = self.get_queryset().aggregate(count=Count('pk'), last_modified=Max('updated_at'))
+        last_modified = stats['last_modified']
+        version = '%s-%s' % (stats['count'], last_modified.timestamp() if last_modified else 0)
+        return version, None
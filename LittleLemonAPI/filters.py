@@ -0,0 +1,117 @@
+import django_filters
+from django import forms
+from django.contrib.auth.models import User
+from django.db.models import Q
+from django.db.models.functions import Lower
+from rest_framework.exceptions import ValidationError
+
+from .models import MenuItem, Order
+from .permissions import order_scope
+
+# Filter combinations OrderFilter accepts, each served by an index on
+# Order (see Order.Meta.indexes and explain_endpoints). A delivery crew
+# member's orders always include 'delivery_crew' and a customer's include
+# 'customer' (see permissions.order_scope).
+ORDER_FILTER_INDEXES = {
+    frozenset(): 'order_date_idx',
+    frozenset({'date'}): 'order_date_idx',
+    frozenset({'status'}): 'order_status_date_idx',
+    frozenset({'status', 'date'}): 'order_status_date_idx',
+    frozenset({'delivery_crew'}): 'order_crew_date_idx',
+    frozenset({'delivery_crew', 'date'}): 'order_crew_date_idx',
+    frozenset({'delivery_crew', 'status'}): 'order_crew_status_date_idx',
+    frozenset({'delivery_crew', 'status', 'date'}): 'order_crew_status_date_idx',
+    frozenset({'customer'}): 'order_user_date_idx',
+    frozenset({'customer', 'date'}): 'order_user_date_idx',
+    frozenset({'customer', 'status'}): 'order_user_status_date_idx',
+    frozenset({'customer', 'status', 'date'}): 'order_user_status_date_idx',
+    # Ordered by total, largest first, rather than by date
+    frozenset({'total'}): 'order_total_idx',
+}
+
+# Role scopes (permissions.order_scope) and the dimension they fix
+SCOPE_DIMENSIONS = {
+    'delivery_crew': 'delivery_crew',
+    'user': 'customer',
+}
+
+
+class OrderFilter(django_filters.FilterSet):
+    """
+    ?status=, ?date_after=&date_before= (YYYY-MM-DD, inclusive),
+    ?delivery_crew=<user id>, ?customer=<user id>, ?total_min=&total_max=
+    """
+    status = django_filters.ChoiceFilter(choices=Order.STATUS_CHOICES)
+    date = django_filters.DateFromToRangeFilter()
+    delivery_crew = django_filters.NumberFilter(field_name='delivery_crew_id')
+    customer = django_filters.NumberFilter(field_name='user_id')
+    total = django_filters.RangeFilter()
+
+    class Meta:
+        model = Order
+        fields = ['status', 'date', 'delivery_crew', 'customer', 'total']
+
+    def used_dimensions(self):
+        dimensions = {
+            name for name, value in self.form.cleaned_data.items()
+            if value not in (None, '') and not (isinstance(value, slice) and value.start is None and value.stop is None)
+        }
+        if self.request is not None:
+            dimensions.update(SCOPE_DIMENSIONS[key] for key in order_scope(self.request.user))
+        return frozenset(dimensions)
+
+    def filter_queryset(self, queryset):
+        dimensions = self.used_dimensions()
+        if dimensions not in ORDER_FILTER_INDEXES:
+            supported = sorted('+'.join(sorted(combination)) for combination in ORDER_FILTER_INDEXES if combination)
+            raise ValidationError({
+                'filters': f"Unsupported filter combination: {'+'.join(sorted(dimensions))}. "
+                           f"Supported: {', '.join(supported)}"
+            })
+        queryset = super().filter_queryset(queryset)
+        if 'total' in dimensions:
+            queryset = queryset.order_by('-total', '-id')
+        return queryset
+
+
+def prefix_range(field, prefix):
+    """field starts with prefix, as a range an index on field can serve (unlike LIKE 'prefix%')"""
+    return Q(**{f'{field}__gte': prefix, f'{field}__lt': prefix + '\uffff'})
+
+
+class UserFilter(django_filters.FilterSet):
+    """
+    ?username= (exact), ?email= (exact, in any case), ?search= (start of
+    the username, or of the email in any case). Served by the username
+    index and auth_user_email_lower_idx (migration 0010).
+    """
+    username = django_filters.CharFilter()
+    email = django_filters.CharFilter(method='filter_email')
+    search = django_filters.CharFilter(method='filter_search')
+
+    class Meta:
+        model = User
+        fields = ['username']
+
+    def filter_email(self, queryset, name, value):
+        return queryset.alias(email_lower=Lower('email')).filter(email_lower=value.lower())
+
+    def filter_search(self, queryset, name, value):
+        return queryset.alias(email_lower=Lower('email')).filter(
+            prefix_range('username', value) | prefix_range('email_lower', value.lower())
+        )
+
+
+class IdFilter(django_filters.NumberFilter):
+    """A primary key: whole numbers only (NumberFilter accepts decimals)"""
+    field_class = forms.IntegerField
+
+
+class ForecastFilter(django_filters.FilterSet):
+    """?category=<category id>, ?menuitem=<menu item id>"""
+    category = IdFilter(field_name='category_id')
+    menuitem = IdFilter(field_name='pk')
+
+    class Meta:
+        model = MenuItem
+        fields = ['category', 'menuitem']
@@ -0,0 +1,171 @@
+"""
+Demand forecasts per menu item and hour of the week, for prep planning.
+
+Order lines are summed per item and hour by the database and streamed
+in chunks into NumPy arrays. Every (item, weekday, hour) cell is
+forecast by exponential smoothing over the weekly history of that cell,
+written as one weighted sum
+
+    forecast = sum(alpha * (1 - alpha) ** age_in_weeks * quantity) / (1 - (1 - alpha) ** weeks)
+
+so all items are fitted together with np.add.at. The divisor corrects
+for history shorter than the window (e.g. new items). Memory is one
+items x 168 array plus one chunk.
+"""
+import time
+from datetime import datetime, timedelta
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Sum
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from . import metrics
+from .cache import SingleFlight, wait_for_entry
+from .models import MenuItem, OrderItem
+from .sharding import shard_aliases
+
+DEFAULTS = {
+    'WEEKS': 52,
+    'ALPHA': 0.3,
+    'CACHE_TIMEOUT': 3600,
+    'CHUNK_SIZE': 20000,
+    'LOCK_TIMEOUT': 60,
+}
+
+FORECASTS_CACHE_KEY = 'forecasts'
+FORECASTS_LOCK_KEY = 'forecasts:lock'
+HOURS_PER_WEEK = 7 * 24
+
+
+def get_setting(name):
+    return getattr(settings, 'FORECASTS', {}).get(name, DEFAULTS[name])
+
+
+def demand_chunks(using, since, chunk_size):
+    """(menuitem ids, local hours since 1970-01-01, quantities) arrays of hourly demand, a chunk at a time."""
+    import numpy as np
+
+    rows = (
+        OrderItem.objects.using(using)
+        .filter(order__date__gte=since)
+        # One TruncHour rather than TruncDate + ExtractHour: on SQLite each
+        # is a Python function call per order line.
+        .values('menuitem_id', hour=TruncHour('order__date'))
+        .annotate(total=Sum('quantity'))
+        .order_by()
+        .values_list('menuitem_id', 'hour', 'total')
+        .iterator(chunk_size=chunk_size)
+    )
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        items, hours, quantities = zip(*chunk)
+        yield (
+            np.array(items, dtype=np.int64),
+            # Local wall-clock hours (TruncHour returns them in the current time zone)
+            np.array([hour.replace(tzinfo=None) for hour in hours], dtype='datetime64[h]').astype(np.int64),
+            np.array(quantities, dtype=np.float64),
+        )
+
+
+def fit(weeks=None, alpha=None, today=None):
+    """Forecast the demand of every menu item for each of the 168 hours of a week."""
+    import numpy as np
+
+    weeks = weeks or get_setting('WEEKS')
+    alpha = alpha or get_setting('ALPHA')
+    chunk_size = get_setting('CHUNK_SIZE')
+    today = today or timezone.localdate()
+    today_number = int(np.datetime64(today, 'D').astype(np.int64))
+    # Week 0 is the seven days up to and including today
+    since = timezone.make_aware(datetime.combine(today - timedelta(days=7 * weeks - 1), datetime.min.time()))
+
+    menu_ids = np.array(MenuItem.objects.order_by('pk').values_list('pk', flat=True), dtype=np.int64)
+    demand = np.zeros((len(menu_ids), HOURS_PER_WEEK))
+    history = np.zeros(len(menu_ids), dtype=np.int64)
+    decay = 1.0 - alpha
+    rows = 0
+
+    for alias in shard_aliases():
+        for items, hours, quantities in demand_chunks(alias, since, chunk_size):
+            rows += len(items)
+            position = np.searchsorted(menu_ids, items).clip(max=max(len(menu_ids) - 1, 0))
+            # Lines of menu items deleted since are dropped
+            known = menu_ids[position] == items if len(menu_ids) else np.zeros(len(items), dtype=bool)
+            position, hours, quantities = position[known], hours[known], quantities[known]
+            days = hours // 24
+            age = (today_number - days) // 7
+            weekday = (days + 3) % 7  # 1970-01-01 was a Thursday; Monday is 0
+            np.add.at(demand, (position, weekday * 24 + hours % 24), quantities * decay ** age)
+            np.maximum.at(history, position, age + 1)
+
+    observed = np.minimum(history, weeks)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        demand *= np.where(observed > 0, alpha / (1.0 - decay ** observed), 0.0)[:, None]
+
+    return {
+        'menu_ids': menu_ids,
+        'hourly': demand,
+        'built_at': timezone.now(),
+        'weeks': weeks,
+        'alpha': alpha,
+        'rows': rows,
+    }
+
+
+def build(**kwargs):
+    """Fit the forecasts and cache them for FORECASTS['CACHE_TIMEOUT'] seconds."""
+    started = time.perf_counter()
+    forecast = fit(**kwargs)
+    forecast['seconds'] = time.perf_counter() - started
+    cache.set(FORECASTS_CACHE_KEY, forecast, timeout=get_setting('CACHE_TIMEOUT'))
+    return forecast
+
+
+forecast_flights = SingleFlight()
+
+
+def get_forecast():
+    """
+    The cached forecasts, built when missing by one request: one per
+    process (SingleFlight) and, through a lock in the cache, one across
+    processes. The others wait up to FORECASTS['LOCK_TIMEOUT'] seconds
+    for it, then build their own.
+    """
+    forecast = cache.get(FORECASTS_CACHE_KEY)
+    metrics.cache_lookup('forecasts', forecast is not None)
+    if forecast is not None:
+        return forecast
+
+    timeout = get_setting('LOCK_TIMEOUT')
+    leader, landed = forecast_flights.lead(FORECASTS_CACHE_KEY)
+    if not leader:
+        # Being built in this process
+        landed.wait(timeout)
+        forecast = cache.get(FORECASTS_CACHE_KEY)
+    elif cache.add(FORECASTS_LOCK_KEY, 1, timeout):
+        try:
+            return build()
+        finally:
+            cache.delete(FORECASTS_LOCK_KEY)
+            forecast_flights.land(FORECASTS_CACHE_KEY)
+    else:
+        # Being built by another process
+        try:
+            forecast = wait_for_entry(FORECASTS_CACHE_KEY, timeout)
+        finally:
+            forecast_flights.land(FORECASTS_CACHE_KEY)
+    return forecast if forecast is not None else build()
+
+
+def upcoming(forecast, hours, start=None):
+    """items x hours slice of the weekly forecast, starting at the hour of `start` (default now)."""
+    import numpy as np
+
+    start = timezone.localtime(start)
+    slot = start.weekday() * 24 + start.hour
+    return forecast['hourly'][:, (slot + np.arange(hours)) % HOURS_PER_WEEK]
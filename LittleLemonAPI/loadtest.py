@@ -0,0 +1,482 @@
+"""
+Load testing (python manage.py loadtest).
+
+Simulated users of every role hit the API over HTTP from many threads:
+
+- anonymous: menu browsing with filters, search, ordering and paging
+- customer: cart and checkout with token auth
+- crew: polling their orders and moving them to delivered
+- manager: polling pending orders and assigning them to the crew
+
+By default the project is served in-process by Django's threaded WSGI
+server against the configured database. Every request can be recorded
+to a JSON lines log and replayed later with the same timing, so two
+runs (e.g. before and after a change) see the same traffic.
+"""
+import http.client
+import json
+import logging
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from decimal import Decimal
+from urllib.parse import urlencode, urlsplit
+
+from django.contrib.auth.models import Group, User
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.signals import got_request_exception
+from django.core.wsgi import get_wsgi_application
+from django.db import OperationalError
+from rest_framework.authtoken.models import Token
+
+from .models import Cart, Category, MenuItem, Order
+from .sharding import shard_aliases
+
+ROLES = ('anonymous', 'customer', 'crew', 'manager')
+DEFAULT_MIX = {'anonymous': 50, 'customer': 30, 'crew': 15, 'manager': 5}
+USER_PREFIX = 'loadtest-'
+SEARCH_TERMS = ('pasta', 'salad', 'lemon', 'cake', 'soup', 'fish', 'bread', 'zzz')
+
+LOCK_TIMEOUT_HEADER = 'X-Loadtest-Error'
+LOCK_ERRORS = re.compile(
+    r'database is locked|database table is locked|lock timeout|lock wait timeout|deadlock|could not obtain lock',
+    re.IGNORECASE,
+)
+
+
+def parse_mix(value):
+    """'anonymous=50,customer=30' -> {'anonymous': 50, 'customer': 30}"""
+    mix = {}
+    for part in filter(None, (part.strip() for part in value.split(','))):
+        role, _, weight = part.partition('=')
+        if role not in ROLES:
+            raise ValueError(f'Unknown role {role!r}, expected one of {", ".join(ROLES)}')
+        mix[role] = float(weight or 1)
+    if not sum(mix.values()):
+        raise ValueError('The mix needs at least one role with a positive weight')
+    return mix
+
+
+def assign_roles(mix, workers):
+    """
+    Split `workers` over the roles in proportion to the mix (largest
+    remainder), with at least one worker per role when there are enough.
+    """
+    total = sum(mix.values())
+    shares = {role: workers * weight / total for role, weight in mix.items() if weight > 0}
+    counts = {role: int(share) for role, share in shares.items()}
+    for role in sorted(shares, key=lambda role: shares[role] - counts[role], reverse=True)[:workers - sum(counts.values())]:
+        counts[role] += 1
+    if workers >= len(counts):
+        for role in [role for role, count in counts.items() if not count]:
+            counts[max(counts, key=counts.get)] -= 1
+            counts[role] = 1
+    return [role for role in ROLES for _ in range(counts.get(role, 0))]
+
+
+def route_of(method, path):
+    """'PATCH /api/orders/12/status/?x=1' -> 'PATCH /api/orders/{id}/status/'"""
+    return '%s %s' % (method, re.sub(r'/\d+(?=/|$)', '/{id}', urlsplit(path).path))
+
+
+# Test data
+
+class Fixture:
+    """Load-test users (with tokens) and the menu they order from."""
+
+    def __init__(self):
+        self.tokens = {}
+        self.user_ids = {}
+        self.menu_ids = []
+        self.category_ids = []
+
+    @classmethod
+    def seed(cls, usernames):
+        """Create (or reuse) the given loadtest-<role>-<n> users, plus a menu if there is none."""
+        fixture = cls()
+        groups = {
+            'manager': Group.objects.get_or_create(name='Manager')[0],
+            'crew': Group.objects.get_or_create(name='Delivery crew')[0],
+        }
+        for username in sorted(usernames):
+            user, created = User.objects.get_or_create(username=username)
+            role = role_of(username)
+            if created and role in groups:
+                user.groups.add(groups[role])
+            fixture.tokens[username] = Token.objects.get_or_create(user=user)[0].key
+            fixture.user_ids[username] = user.pk
+
+        if not MenuItem.objects.exists():
+            category = Category.objects.create(slug='loadtest', title='Load test')
+            MenuItem.objects.bulk_create([
+                MenuItem(title=f'{SEARCH_TERMS[number % 7].title()} {number}', price=Decimal('5.00') + number,
+                         category=category, featured=number % 5 == 0, inventory=10 ** 6)
+                for number in range(30)
+            ])
+        fixture.menu_ids = list(MenuItem.objects.values_list('pk', flat=True))
+        fixture.category_ids = list(Category.objects.values_list('pk', flat=True))
+        return fixture
+
+    def users(self, role):
+        return [username for username in self.tokens if role_of(username) == role]
+
+    @staticmethod
+    def cleanup():
+        """Delete the load-test users with their carts and orders, and the load-test menu."""
+        users = list(User.objects.filter(username__startswith=USER_PREFIX).values_list('pk', flat=True))
+        for alias in shard_aliases():
+            Cart.objects.using(alias).filter(user__in=users).delete()
+            Order.objects.using(alias).filter(user__in=users).delete()
+        User.objects.filter(pk__in=users).delete()
+        MenuItem.objects.filter(category__slug='loadtest').delete()
+        Category.objects.filter(slug='loadtest').delete()
+        return len(users)
+
+
+def usernames_for(roles):
+    """One user per worker and role: loadtest-customer-0, loadtest-customer-1, ..."""
+    seen = Counter()
+    names = []
+    for role in roles:
+        names.append(f'{USER_PREFIX}{role}-{seen[role]}' if role != 'anonymous' else None)
+        seen[role] += 1
+    return names
+
+
+def role_of(username):
+    return username[len(USER_PREFIX):].rsplit('-', 1)[0] if username else 'anonymous'
+
+
+# Results
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+class Results:
+    """Thread-safe latencies and outcomes per route."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timings = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self.lock_timeouts = Counter()
+        self.started = time.monotonic()
+        self.finished = None
+
+    def add(self, route, seconds, status, lock_timeout=False):
+        with self.lock:
+            self.timings[route].append(seconds)
+            self.statuses[route][status] += 1
+            if lock_timeout:
+                self.lock_timeouts[route] += 1
+
+    def finish(self):
+        self.finished = time.monotonic()
+
+    def summary(self):
+        duration = (self.finished or time.monotonic()) - self.started
+        routes = {}
+        with self.lock:
+            for route in sorted(self.timings):
+                timings = sorted(self.timings[route])
+                statuses = self.statuses[route]
+                # Status 0: no response (connection refused, reset or timed out)
+                errors = sum(count for status, count in statuses.items() if status == 0 or status >= 500)
+                routes[route] = {
+                    'requests': len(timings),
+                    'rps': round(len(timings) / duration, 2),
+                    'p50_ms': round(percentile(timings, 0.50) * 1000, 2),
+                    'p90_ms': round(percentile(timings, 0.90) * 1000, 2),
+                    'p99_ms': round(percentile(timings, 0.99) * 1000, 2),
+                    'max_ms': round(timings[-1] * 1000, 2),
+                    'error_rate': round(errors / len(timings), 4),
+                    'lock_timeout_rate': round(self.lock_timeouts[route] / len(timings), 4),
+                    'throttled': statuses.get(429, 0),
+                    'statuses': {str(status): count for status, count in sorted(statuses.items())},
+                }
+        requests = sum(route['requests'] for route in routes.values())
+        return {
+            'duration_s': round(duration, 2),
+            'requests': requests,
+            'rps': round(requests / duration, 2) if duration else 0.0,
+            'routes': routes,
+        }
+
+
+def format_summary(summary, baseline=None):
+    lines = [
+        f"{summary['requests']} requests in {summary['duration_s']}s: {summary['rps']} req/s",
+        f"{'route':<40}{'reqs':>7}{'req/s':>8}{'p50':>8}{'p90':>8}{'p99':>8}{'max':>9}{'err%':>7}{'lock%':>7}{'429':>5}",
+    ]
+    for route, row in summary['routes'].items():
+        lines.append(
+            f"{route:<40}{row['requests']:>7}{row['rps']:>8}{row['p50_ms']:>8}{row['p90_ms']:>8}{row['p99_ms']:>8}"
+            f"{row['max_ms']:>9}{row['error_rate'] * 100:>7.2f}{row['lock_timeout_rate'] * 100:>7.2f}{row['throttled']:>5}"
+        )
+        before = (baseline or {}).get('routes', {}).get(route)
+        if before:
+            lines.append(
+                f"{'  vs baseline':<40}{'':>7}{row['rps'] - before['rps']:>+8.1f}{row['p50_ms'] - before['p50_ms']:>+8.1f}"
+                f"{row['p90_ms'] - before['p90_ms']:>+8.1f}{row['p99_ms'] - before['p99_ms']:>+8.1f}"
+            )
+    if baseline:
+        lines.append(f"throughput vs baseline: {summary['rps'] - baseline['rps']:+.2f} req/s")
+    return '\n'.join(lines)
+
+
+# HTTP
+
+class Recorder:
+    """Appends every request sent to a JSON lines log (see replay())."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+
+    def write(self, worker, user, method, path, body, route):
+        entry = {
+            'at': round(time.monotonic() - self.started, 6), 'worker': worker, 'user': user,
+            'method': method, 'path': path, 'body': body, 'route': route,
+        }
+        with self.lock:
+            self.stream.write(json.dumps(entry) + '\n')
+
+
+class Session:
+    """The HTTP client of one worker, signed in as `user` (None for anonymous)."""
+
+    def __init__(self, base_url, results, worker, user=None, token=None, recorder=None, timeout=30):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.results = results
+        self.worker = worker
+        self.user = user
+        self.token = token
+        self.recorder = recorder
+        self.timeout = timeout
+
+    def request(self, method, path, body=None, route=None, query=None):
+        if query:
+            path = '%s?%s' % (path, urlencode(query))
+        route = route or route_of(method, path)
+        if self.recorder is not None:
+            self.recorder.write(self.worker, self.user, method, path, body, route)
+
+        # A client address per worker, so workers are throttled as separate clients
+        headers = {'Accept': 'application/json', 'Connection': 'close',
+                   'X-Forwarded-For': '10.%d.%d.%d' % (self.worker >> 16 & 255, self.worker >> 8 & 255, self.worker & 255)}
+        if self.token:
+            headers['Authorization'] = f'Token {self.token}'
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+
+        started = time.perf_counter()
+        connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            connection.request(method, path, payload, headers)
+            response = connection.getresponse()
+            content = response.read()
+            status, lock_timeout = response.status, response.getheader(LOCK_TIMEOUT_HEADER) == 'lock-timeout'
+        except (OSError, http.client.HTTPException):
+            status, lock_timeout, content = 0, False, b''
+        finally:
+            connection.close()
+        self.results.add(route, time.perf_counter() - started, status, lock_timeout)
+
+        if status and content and status < 300:
+            try:
+                return status, json.loads(content)
+            except ValueError:
+                pass
+        return status, None
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+
+# Scenarios: one visit of a simulated user, a few requests long
+
+def results_of(data):
+    return (data or {}).get('results', []) if isinstance(data, dict) else (data or [])
+
+
+def browse_menu(session, fixture, rng):
+    for _ in range(rng.randint(2, 4)):
+        choice = rng.random()
+        if choice < 0.3:
+            session.get('/api/menu-items/', query={'search': rng.choice(SEARCH_TERMS)},
+                        route='GET /api/menu-items/?search')
+        elif choice < 0.55 and fixture.category_ids:
+            session.get('/api/menu-items/', query={'category': rng.choice(fixture.category_ids), 'ordering': 'price'},
+                        route='GET /api/menu-items/?category')
+        elif choice < 0.7:
+            session.get('/api/menu-items/', query={'page': rng.randint(1, 3)}, route='GET /api/menu-items/?page')
+        elif choice < 0.9 and fixture.menu_ids:
+            session.get(f'/api/menu-items/{rng.choice(fixture.menu_ids)}/')
+        else:
+            session.get('/api/categories/')
+
+
+def shop_and_checkout(session, fixture, rng):
+    session.get('/api/menu-items/', query={'page': 1}, route='GET /api/menu-items/?page')
+    for menuitem in rng.sample(fixture.menu_ids, min(len(fixture.menu_ids), rng.randint(1, 3))):
+        session.request('POST', '/api/cart/', {'menuitem': menuitem, 'quantity': rng.randint(1, 3)})
+    session.get('/api/cart/')
+    if rng.random() < 0.8:
+        session.request('POST', '/api/orders/', {})
+    else:
+        session.request('DELETE', '/api/cart/clear/')
+    session.get('/api/orders/')
+
+
+def deliver(session, fixture, rng):
+    for current, following in (('preparing', 'out_for_delivery'), ('out_for_delivery', 'delivered')):
+        status, data = session.get('/api/orders/', query={'status': current}, route=f'GET /api/orders/?status={current}')
+        for order in results_of(data)[:2]:
+            session.request('PATCH', f"/api/orders/{order['id']}/status/", {'status': following})
+
+
+def dispatch(session, fixture, rng):
+    crew = [fixture.user_ids[username] for username in fixture.users('crew')]
+    status, data = session.get('/api/orders/', query={'status': 'pending'}, route='GET /api/orders/?status=pending')
+    for order in results_of(data)[:3]:
+        if crew:
+            session.request('PATCH', f"/api/orders/{order['id']}/assign-delivery/",
+                            {'delivery_crew_id': rng.choice(crew)})
+
+
+SCENARIOS = {
+    'anonymous': browse_menu,
+    'customer': shop_and_checkout,
+    'crew': deliver,
+    'manager': dispatch,
+}
+
+
+def run(base_url, fixture, roles, duration, think=0.0, recorder=None, seed=None):
+    """Run one worker thread per entry of `roles` for `duration` seconds."""
+    results = Results()
+    deadline = time.monotonic() + duration
+    usernames = usernames_for(roles)
+
+    def work(worker, role, username):
+        rng = random.Random(None if seed is None else seed * 1000 + worker)
+        session = Session(base_url, results, worker, username, fixture.tokens.get(username), recorder)
+        while time.monotonic() < deadline:
+            SCENARIOS[role](session, fixture, rng)
+            if think:
+                time.sleep(rng.expovariate(1 / think))
+
+    threads = [
+        threading.Thread(target=work, args=(worker, role, username), name=f'loadtest-{worker}', daemon=True)
+        for worker, (role, username) in enumerate(zip(roles, usernames))
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.finish()
+    return results
+
+
+def read_log(stream):
+    return [json.loads(line) for line in stream if line.strip()]
+
+
+def replay(base_url, fixture, entries, speed=1.0):
+    """
+    Send the requests of a recorded log from the same workers at the same
+    offsets (divided by `speed`). Ids in paths are replayed as recorded, so
+    start from the same database state as the recording.
+    """
+    results = Results()
+    by_worker = defaultdict(list)
+    for entry in entries:
+        by_worker[entry['worker']].append(entry)
+    started = time.monotonic()
+
+    def work(worker, worker_entries):
+        user = worker_entries[0]['user']
+        session = Session(base_url, results, worker, user, fixture.tokens.get(user))
+        for entry in worker_entries:
+            delay = started + entry['at'] / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            session.request(entry['method'], entry['path'], entry['body'], route=entry['route'])
+
+    threads = [
+        threading.Thread(target=work, args=(worker, worker_entries), name=f'loadtest-{worker}', daemon=True)
+        for worker, worker_entries in by_worker.items()
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results.finish()
+    return results
+
+
+# In-process server
+
+@contextmanager
+def quiet_logger(name):
+    """Silence a logger (e.g. django.request's 500 tracebacks) for the duration of a run."""
+    logger = logging.getLogger(name)
+    level = logger.level
+    logger.setLevel(logging.CRITICAL)
+    try:
+        yield
+    finally:
+        logger.setLevel(level)
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def mark_lock_timeouts(application):
+    """
+    WSGI wrapper adding `X-Loadtest-Error: lock-timeout` to 500 responses
+    caused by a lock timeout or deadlock, so clients can tell them apart.
+    """
+    def receiver(sender, request=None, **kwargs):
+        error = sys.exc_info()[1]
+        if request is not None and isinstance(error, OperationalError) and LOCK_ERRORS.search(str(error)):
+            request.META['loadtest.lock_timeout'] = True
+
+    got_request_exception.connect(receiver, weak=False, dispatch_uid='loadtest-lock-timeouts')
+
+    def wrapped(environ, start_response):
+        def marking_start_response(status, headers, *args):
+            if environ.get('loadtest.lock_timeout'):
+                headers = [*headers, (LOCK_TIMEOUT_HEADER, 'lock-timeout')]
+            return start_response(status, headers, *args)
+        return application(environ, marking_start_response)
+
+    return wrapped
+
+
+@contextmanager
+def serve(host='127.0.0.1', port=0):
+    """Serve the project from a background thread; yields the base URL."""
+    server = ThreadedWSGIServer((host, port), QuietRequestHandler, allow_reuse_address=True)
+    server.set_app(mark_lock_timeouts(get_wsgi_application()))
+    thread = threading.Thread(target=server.serve_forever, name='loadtest-server', daemon=True)
+    thread.start()
+    try:
+        yield 'http://%s:%s' % server.server_address[:2]
+    finally:
+        server.shutdown()
+        server.server_close()
+        got_request_exception.disconnect(dispatch_uid='loadtest-lock-timeouts')
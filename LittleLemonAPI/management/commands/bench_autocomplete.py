@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from LittleLemonAPI import autocomplete
+from LittleLemonAPI.models import MenuItem
+
+
+class Command(BaseCommand):
+    help = 'Time menu autocomplete lookups on the current catalog against the LIKE search of menu-items/?search='
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queries', default='l,le,lem,lemon,lmeon,lemon ca',
+                            help='Comma-separated queries, as typed')
+        parser.add_argument('--iterations', type=int, default=1000, help='Lookups per query')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        index = autocomplete.build_index()
+        self.stdout.write(f'index of {len(index.entries)} titles, {len(index.words)} words built in '
+                          f'{(time.perf_counter() - started) * 1000:.1f} ms')
+        limit = autocomplete.get_setting('LIMIT')
+        self.stdout.write(f"{'query':<14}{'results':>8}{'index us':>10}{'LIKE us':>10}")
+        for query in options['queries'].split(','):
+            results = index.search(query, limit)
+            indexed = self.time_calls(lambda: index.search(query, limit), options['iterations'])
+            like = Q(title__icontains=query) | Q(description__icontains=query)
+            searched = self.time_calls(lambda: list(MenuItem.objects.filter(like)[:limit]), options['iterations'] // 10 or 1)
+            self.stdout.write(f'{query:<14}{len(results):>8}{indexed:>10.1f}{searched:>10.1f}')
+
+    def time_calls(self, call, iterations):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            call()
+        return (time.perf_counter() - started) / iterations * 1e6
@@ -0,0 +1,92 @@
+import statistics
+import time
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from LittleLemonAPI.cache import bump_catalog_version
+from LittleLemonAPI.models import Cart, Category, MenuItem, Order, OrderItem
+
+# The calls a client makes on launch without /api/bootstrap/
+SEQUENTIAL = [
+    '/api/',
+    '/api/categories/',
+    '/api/menu-items/',
+    '/api/menu-items/?featured=true',
+    '/api/cart/',
+    '/api/orders/',
+]
+
+
+class Command(BaseCommand):
+    help = 'Compare GET /api/bootstrap/ with the sequential launch calls it replaces'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--items', type=int, default=60, help='Menu items in the sample catalog')
+        parser.add_argument('--orders', type=int, default=20, help='Orders of the sample customer')
+
+    def handle(self, *args, **options):
+        # Sample data only exists for the duration of the run
+        with transaction.atomic(), override_settings(ALLOWED_HOSTS=['testserver']):
+            token = self.create_sample_data(options['items'], options['orders'])
+            client = APIClient()
+            client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+            results = {
+                'sequential': self.measure(client, SEQUENTIAL, options['iterations']),
+                'bootstrap': self.measure(client, ['/api/bootstrap/'], options['iterations']),
+            }
+            transaction.set_rollback(True)
+        bump_catalog_version()
+
+        self.stdout.write(f"{'':<12}{'requests':>10}{'queries':>10}{'p50 ms':>10}{'mean ms':>10}{'bytes':>10}")
+        for name, (requests, queries, timings, size) in results.items():
+            self.stdout.write(
+                f'{name:<12}{requests:>10}{queries:>10}{statistics.median(timings):>10.2f}'
+                f'{statistics.mean(timings):>10.2f}{size:>10}'
+            )
+
+    def measure(self, client, paths, iterations):
+        # The first round fills the catalog cache for both variants
+        for path in paths:
+            client.get(path)
+        timings = []
+        with CaptureQueriesContext(connections['default']) as queries:
+            for _ in range(iterations):
+                started = time.perf_counter()
+                size = 0
+                for path in paths:
+                    response = client.get(path)
+                    assert response.status_code == 200, (path, response.status_code)
+                    size += len(response.content)
+                timings.append((time.perf_counter() - started) * 1000)
+        return len(paths), len(queries) // iterations, timings, size
+
+    def create_sample_data(self, items, orders):
+        customer = User.objects.create(username='bench-bootstrap-customer')
+        category = Category.objects.create(slug='bench-bootstrap', title='Bench')
+        menu = MenuItem.objects.bulk_create([
+            MenuItem(
+                title=f'Bench item {number}', price=Decimal('9.50'), category=category,
+                featured=number % 10 == 0, item_of_the_day=number == 1,
+            )
+            for number in range(items)
+        ])
+        for menuitem in menu[:3]:
+            Cart.objects.create(user=customer, menuitem=menuitem, quantity=2, unit_price=menuitem.price,
+                                price=menuitem.price * 2)
+        for number in range(orders):
+            order = Order.objects.create(user=customer, total=Decimal('19.00'))
+            OrderItem.objects.bulk_create([
+                OrderItem(order=order, menuitem=menuitem, quantity=1, unit_price=menuitem.price, price=menuitem.price)
+                for menuitem in menu[number % items:number % items + 2]
+            ])
+        # bulk_create() does not send the signals that invalidate the catalog
+        bump_catalog_version()
+        return Token.objects.create(user=customer)
@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+
+from LittleLemonAPI import loadtest
+
+CHECKOUT = 'POST /api/orders/'
+
+
+class Command(BaseCommand):
+    help = 'Checkout throughput at increasing numbers of concurrent customers, on the configured database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', default='1,2,4,8,16', help='Comma-separated worker counts to run')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds per worker count')
+
+    def handle(self, *args, **options):
+        counts = [int(count) for count in options['workers'].split(',')]
+        fixture = loadtest.Fixture.seed(filter(None, loadtest.usernames_for(['customer'] * max(counts))))
+        pool = settings.DATABASES['default'].get('OPTIONS', {}).get('pool')
+        self.stdout.write(f'{connection.vendor} database, pool: {pool or "off"}')
+        self.stdout.write(f"{'workers':>8}{'checkouts/s':>13}{'requests/s':>12}{'p50 ms':>9}{'p99 ms':>9}{'err%':>7}{'lock%':>7}")
+
+        hosts = override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, '127.0.0.1'])
+        with hosts, loadtest.quiet_logger('django.request'), loadtest.serve() as base_url:
+            for count in counts:
+                summary = loadtest.run(base_url, fixture, ['customer'] * count, options['duration']).summary()
+                checkout = summary['routes'].get(CHECKOUT, {})
+                self.stdout.write(
+                    f"{count:>8}{checkout.get('rps', 0):>13}{summary['rps']:>12}{checkout.get('p50_ms', 0):>9}"
+                    f"{checkout.get('p99_ms', 0):>9}{checkout.get('error_rate', 0) * 100:>7.2f}"
+                    f"{checkout.get('lock_timeout_rate', 0) * 100:>7.2f}"
+                )
@@ -0,0 +1,71 @@
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from LittleLemonAPI import compression
+from LittleLemonAPI.models import Category, MenuItem
+from LittleLemonAPI.serializers import MenuItemSerializer
+
+
+class Command(BaseCommand):
+    help = 'Benchmark bytes on the wire and CPU per response for each compression encoding'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=100, help='Menu items per page (default: 100)')
+        parser.add_argument('--iterations', type=int, default=200)
+
+    def handle(self, *args, **options):
+        body = self.build_page(options['items'])
+        iterations = options['iterations']
+
+        self.stdout.write(f'Payload: {options["items"]} menu items, {len(body)} bytes uncompressed\n')
+        self.stdout.write(f'{"encoding":<10}{"mode":<14}{"bytes":>10}{"ratio":>8}{"CPU/resp":>14}')
+        self.stdout.write(f'{"identity":<10}{"-":<14}{len(body):>10}{1:>8.2f}{"0 us":>14}')
+
+        for encoding in compression.available_encodings():
+            for static in (False, True):
+                start = time.process_time()
+                for _ in range(iterations):
+                    content = compression.compress(body, encoding, static=static)
+                cpu = (time.process_time() - start) / iterations
+                mode = 'precompressed' if static else 'per-request'
+                self.stdout.write(
+                    f'{encoding:<10}{mode:<14}{len(content):>10}'
+                    f'{len(body) / len(content):>8.2f}{cpu * 1e6:>11.0f} us'
+                )
+
+        # A cached response only costs a dict lookup per request; the
+        # precompressed rows above are paid once per cache fill.
+        encoded = compression.precompress(body)
+        start = time.process_time()
+        for _ in range(iterations):
+            for encoding in encoded:
+                encoded.get(encoding)
+        cpu = (time.process_time() - start) / max(iterations * len(encoded), 1)
+        self.stdout.write(f'\nServing a cached precompressed body: {cpu * 1e6:.2f} us/response')
+
+    def build_page(self, count):
+        categories = [Category(id=i, title=title, slug=title.lower())
+                      for i, title in enumerate(['Appetizers', 'Main Courses', 'Desserts', 'Drinks'], 1)]
+        items = [
+            MenuItem(
+                id=i,
+                title=f'Menu item {i}',
+                price=Decimal('9.99') + i,
+                featured=i % 5 == 0,
+                category=categories[i % len(categories)],
+                description=f'Seasonal dish number {i} made with fresh Mediterranean ingredients',
+                inventory=i % 40,
+                item_of_the_day=i == 1,
+            )
+            for i in range(1, count + 1)
+        ]
+        data = {
+            'count': count,
+            'next': None,
+            'previous': None,
+            'results': MenuItemSerializer(items, many=True).data,
+        }
+        return JSONRenderer().render(data)
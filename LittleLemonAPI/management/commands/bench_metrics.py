@@ -0,0 +1,123 @@
+import json
+import statistics
+import tempfile
+import time
+from decimal import Decimal
+from unittest import mock
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.http import HttpResponse
+from django.test import Client, RequestFactory
+from django.test.utils import override_settings
+from django.urls import resolve
+from rest_framework.views import APIView
+
+from LittleLemonAPI import metrics
+from LittleLemonAPI.cache import bump_catalog_version
+from LittleLemonAPI.middleware import MetricsMiddleware
+from LittleLemonAPI.models import Category, MenuItem
+
+
+class Command(BaseCommand):
+    help = 'Measure the per-request cost of MetricsMiddleware and of rendering /api/metrics/'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20000, help='Calls for the middleware-only timing')
+        parser.add_argument('--requests', type=int, default=500, help='Requests for the end-to-end timing')
+        parser.add_argument('--workers', type=int, default=8, help='Worker files to aggregate when rendering')
+
+    def handle(self, *args, **options):
+        # Counters and files of the run are thrown away afterwards
+        live = metrics.metrics
+        metrics.metrics = metrics.RequestMetrics(metrics.get_setting('BUCKETS'))
+        try:
+            with tempfile.TemporaryDirectory() as directory, \
+                    override_settings(METRICS={**getattr(settings, 'METRICS', {}), 'DIR': directory}):
+                self.middleware_only(options['iterations'])
+                self.end_to_end(options['requests'])
+                metrics.metrics_dir().mkdir(parents=True, exist_ok=True)
+                self.rendering(options['workers'])
+        finally:
+            metrics.metrics = live
+
+    def middleware_only(self, iterations):
+        request = RequestFactory().get('/api/menu-items/')
+        request.resolver_match = resolve('/api/menu-items/')
+        response = HttpResponse()
+
+        def view(request):
+            return response
+
+        middleware = MetricsMiddleware(view)
+        bare = self.time_calls(view, request, iterations)
+        measured = self.time_calls(middleware, request, iterations)
+        self.stdout.write(
+            f'middleware only: {bare:.2f} us bare, {measured:.2f} us with metrics, '
+            f'{measured - bare:.2f} us per request'
+        )
+
+    def time_calls(self, handler, request, iterations):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            handler(request)
+        return (time.perf_counter() - started) / iterations * 1e6
+
+    def end_to_end(self, requests):
+        # Thousands of anonymous requests would be throttled (429) and time the
+        # throttle instead. Views read throttle_classes from APIView, set when
+        # it was imported, so overriding REST_FRAMEWORK alone does not reach them.
+        throttling = override_settings(REST_FRAMEWORK={
+            **settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_CLASSES': [],
+        })
+        with transaction.atomic(), override_settings(ALLOWED_HOSTS=['testserver']), throttling, \
+                mock.patch.object(APIView, 'throttle_classes', []):
+            category = Category.objects.create(slug='bench-metrics', title='Bench')
+            MenuItem.objects.bulk_create([
+                MenuItem(title=f'Bench item {number}', price=Decimal('9.50'), category=category)
+                for number in range(20)
+            ])
+            bump_catalog_version()
+            without = [name for name in settings.MIDDLEWARE if not name.endswith('.MetricsMiddleware')]
+            results = {'without': [], 'with': []}
+            # Alternated in rounds, so drift (caches warming up, CPU frequency) hits both alike
+            rounds = 5
+            for _ in range(rounds):
+                for name, middleware in (('without', without), ('with', ['LittleLemonAPI.middleware.MetricsMiddleware', *without])):
+                    with override_settings(MIDDLEWARE=middleware):
+                        results[name] += self.time_requests(Client(), '/api/menu-items/?page=2', max(requests // rounds, 1))
+            transaction.set_rollback(True)
+        bump_catalog_version()
+
+        self.stdout.write(f"{'GET /api/menu-items/':<22}{'p50 us':>10}{'mean us':>10}")
+        for name, timings in results.items():
+            self.stdout.write(f'{name + " metrics":<22}{statistics.median(timings):>10.1f}{statistics.mean(timings):>10.1f}')
+
+    def time_requests(self, client, path, requests):
+        # Warm up (fills the catalog cache)
+        for _ in range(20):
+            client.get(path)
+        timings = []
+        for _ in range(requests):
+            started = time.perf_counter()
+            response = client.get(path)
+            timings.append((time.perf_counter() - started) * 1e6)
+            if response.status_code != 200:
+                raise CommandError(f'GET {path} answered {response.status_code}: timings would not be comparable')
+        return timings
+
+    def rendering(self, workers):
+        # Every worker has seen every view
+        for match in ('api_root', 'menu-items', 'categories', 'cart', 'orders', 'order_detail', 'bootstrap'):
+            for status in (200, 400, 404):
+                metrics.metrics.observe(match, 'GET', status, 0.02, 3)
+        snapshot = json.dumps(metrics.metrics.snapshot())
+        for worker in range(workers):
+            (metrics.metrics_dir() / f'bench-{worker}.json').write_text(snapshot)
+
+        started = time.perf_counter()
+        body = metrics.render_prometheus()
+        elapsed = (time.perf_counter() - started) * 1000
+        self.stdout.write(f'render /api/metrics/ over {workers + 1} processes: {elapsed:.2f} ms, '
+                          f'{len(body.splitlines())} lines')
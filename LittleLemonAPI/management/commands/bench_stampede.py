@@ -0,0 +1,76 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from LittleLemonAPI import loadtest, metrics
+from LittleLemonAPI.cache import CachedCatalogMixin, bump_catalog_version
+
+PATHS = ['/api/menu-items/', '/api/menu-items/?page=2', '/api/categories/']
+VIEWS = ['menu_items', 'categories']
+
+
+class Command(BaseCommand):
+    help = ('Hit the cached catalog endpoints with concurrent clients while the catalog keeps changing, '
+            'with and without single-flight rebuilding, and count the database queries they cause')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=50, help='Concurrent clients')
+        parser.add_argument('--duration', type=float, default=10, help='Seconds per run')
+        parser.add_argument('--interval', type=float, default=1, help='Seconds between catalog changes')
+
+    def handle(self, *args, **options):
+        loadtest.Fixture.seed([])
+        self.stdout.write(f"{options['workers']} clients, a catalog change every {options['interval']}s")
+        self.stdout.write(f"{'single flight':<15}{'requests':>9}{'changes':>9}{'queries':>9}"
+                          f"{'rebuilds':>10}{'per change':>12}{'p50 ms':>9}{'p99 ms':>9}")
+
+        hosts = override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, '127.0.0.1'])
+        live = metrics.metrics
+        try:
+            with hosts, loadtest.quiet_logger('django.request'), loadtest.serve() as base_url:
+                for single_flight in (False, True):
+                    CachedCatalogMixin.single_flight = single_flight
+                    self.run(base_url, single_flight, options)
+        finally:
+            CachedCatalogMixin.single_flight = True
+            metrics.metrics = live
+
+    def run(self, base_url, single_flight, options):
+        # Queries and catalog cache misses are counted by the metrics middleware
+        metrics.metrics = metrics.RequestMetrics(metrics.get_setting('BUCKETS'))
+        bump_catalog_version()
+        results = loadtest.Results()
+        deadline = time.monotonic() + options['duration']
+
+        def client(worker):
+            session = loadtest.Session(base_url, results, worker)
+            number = worker
+            while time.monotonic() < deadline:
+                session.get(PATHS[number % len(PATHS)])
+                number += 1
+
+        threads = [threading.Thread(target=client, args=(worker,), daemon=True) for worker in range(options['workers'])]
+        for thread in threads:
+            thread.start()
+        changes = 0
+        while time.monotonic() + options['interval'] < deadline:
+            time.sleep(options['interval'])
+            bump_catalog_version()
+            changes += 1
+        for thread in threads:
+            thread.join()
+        results.finish()
+
+        summary = results.summary()
+        with metrics.metrics.lock:
+            queries = sum(entry[2] for (view, method), entry in metrics.metrics.latency.items() if view in VIEWS)
+            rebuilds = metrics.metrics.cache.get(('catalog', 'miss'), 0)
+        timings = sorted(seconds for route in results.timings.values() for seconds in route)
+        self.stdout.write(
+            f"{'on' if single_flight else 'off':<15}{summary['requests']:>9}{changes:>9}{queries:>9}{rebuilds:>10}"
+            f"{rebuilds / max(changes, 1):>12.1f}{loadtest.percentile(timings, 0.5) * 1000:>9.1f}"
+            f"{loadtest.percentile(timings, 0.99) * 1000:>9.1f}"
+        )
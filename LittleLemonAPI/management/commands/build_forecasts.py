@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from LittleLemonAPI import forecasting
+
+
+class Command(BaseCommand):
+    help = 'Fit per-item, per-hour demand forecasts from order history and cache them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--weeks', type=int, default=None, help='Weeks of history (default: FORECASTS["WEEKS"])')
+        parser.add_argument('--alpha', type=float, default=None, help='Smoothing factor (default: FORECASTS["ALPHA"])')
+
+    def handle(self, *args, **options):
+        forecast = forecasting.build(weeks=options['weeks'], alpha=options['alpha'])
+        self.stdout.write(
+            f"Fitted {len(forecast['menu_ids'])} item(s) from {forecast['rows']} hourly row(s) "
+            f"over {forecast['weeks']} week(s) in {forecast['seconds']:.2f}s"
+        )
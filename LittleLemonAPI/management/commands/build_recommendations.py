@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from LittleLemonAPI import recommendations
+
+
+class Command(BaseCommand):
+    help = 'Count menu items ordered together and store the top-K neighbours of every item'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='Recount every order instead of only those placed since the last run')
+        parser.add_argument('--top-k', type=int, default=None,
+                            help='Neighbours kept per item (default: RECOMMENDATION_TOP_K)')
+        parser.add_argument('--min-count', type=int, default=1,
+                            help='Orders two items must share before they are recommended together')
+        parser.add_argument('--chunk-size', type=int, default=10000)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        result = recommendations.build(
+            full=options['full'],
+            k=options['top_k'],
+            min_count=options['min_count'],
+            chunk_size=options['chunk_size'],
+        )
+        self.stdout.write(
+            f"Read {result['orders']} order(s), updated {result['pairs_changed']} pair count(s), "
+            f"stored {result['recommendations']} recommendation(s) "
+            f"in {time.perf_counter() - started:.2f}s"
+        )
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from LittleLemonAPI import catalog_sync
+
+
+class Command(BaseCommand):
+    help = 'Drop superseded catalog changes and purge old tombstones from the menu sync log'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tombstone-days', type=int, default=30,
+                            help='Keep deletions this long; clients that have not synced since must resync fully')
+
+    def handle(self, *args, **options):
+        superseded, purged = catalog_sync.compact(options['tombstone_days'])
+        self.stdout.write(f'Removed {superseded} superseded change(s) and {purged} tombstone(s)')
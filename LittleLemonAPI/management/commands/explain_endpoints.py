@@ -0,0 +1,214 @@
+import json
+import re
+from pathlib import Path
+
+from django.apps import apps
+from django.contrib.auth.models import Group, User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from rest_framework.test import APIRequestFactory
+
+from LittleLemonAPI import views
+from LittleLemonAPI.models import Category, MenuItem, Order, OrderItem
+
+BASELINE_PATH = Path(__file__).resolve().parents[2] / 'query_plan_baseline.json'
+
+# (name, view class, role, query params, url kwargs); a param may be a
+# function of the role users
+# The querysets are built by the views themselves, so a change to
+# get_queryset() or the filter backends is picked up automatically.
+ENDPOINTS = [
+    ('categories', views.CategoryListCreateView, 'anonymous', {}, {}),
+    ('menu-items', views.MenuItemListCreateView, 'anonymous', {}, {}),
+    ('menu-items?category', views.MenuItemListCreateView, 'anonymous', {'category': 1}, {}),
+    ('menu-items?featured', views.MenuItemListCreateView, 'anonymous', {'featured': 'true'}, {}),
+    ('menu-items?ordering=price', views.MenuItemListCreateView, 'anonymous', {'ordering': 'price'}, {}),
+    ('menu-items?search', views.MenuItemListCreateView, 'anonymous', {'search': 'lemon'}, {}),
+    ('menu-item-detail', views.MenuItemDetailView, 'anonymous', {}, {'pk': 1}),
+    ('cart', views.CartView, 'customer', {}, {}),
+    ('orders[manager]', views.OrderListCreateView, 'manager', {}, {}),
+    ('orders[delivery_crew]', views.OrderListCreateView, 'delivery_crew', {}, {}),
+    ('orders[customer]', views.OrderListCreateView, 'customer', {}, {}),
+    # Every filter combination of filters.OrderFilter, per role that can use it
+    ('orders?status[manager]', views.OrderListCreateView, 'manager', {'status': 'pending'}, {}),
+    ('orders?date[manager]', views.OrderListCreateView, 'manager', {'date_after': '2024-01-01', 'date_before': '2024-01-31'}, {}),
+    ('orders?status&date[manager]', views.OrderListCreateView, 'manager',
+     {'status': 'pending', 'date_after': '2024-01-01', 'date_before': '2024-01-31'}, {}),
+    ('orders?delivery_crew[manager]', views.OrderListCreateView, 'manager',
+     {'delivery_crew': lambda users: users['delivery_crew'].pk}, {}),
+    ('orders?delivery_crew&status&date[manager]', views.OrderListCreateView, 'manager',
+     {'delivery_crew': lambda users: users['delivery_crew'].pk, 'status': 'out_for_delivery',
+      'date_after': '2024-01-01', 'date_before': '2024-01-01'}, {}),
+    ('orders?customer&status[manager]', views.OrderListCreateView, 'manager',
+     {'customer': lambda users: users['customer'].pk, 'status': 'delivered'}, {}),
+    ('orders?customer&date[manager]', views.OrderListCreateView, 'manager',
+     {'customer': lambda users: users['customer'].pk, 'date_after': '2024-01-01'}, {}),
+    ('orders?total[manager]', views.OrderListCreateView, 'manager', {'total_min': 50}, {}),
+    ('orders?status[delivery_crew]', views.OrderListCreateView, 'delivery_crew', {'status': 'out_for_delivery'}, {}),
+    ('orders?status&date[delivery_crew]', views.OrderListCreateView, 'delivery_crew',
+     {'status': 'out_for_delivery', 'date_after': '2024-01-01', 'date_before': '2024-01-01'}, {}),
+    ('orders?status[customer]', views.OrderListCreateView, 'customer', {'status': 'delivered'}, {}),
+    ('orders?date[customer]', views.OrderListCreateView, 'customer', {'date_after': '2024-01-01'}, {}),
+    ('order-detail[manager]', views.OrderDetailView, 'manager', {}, {'pk': 1}),
+    ('order-detail[delivery_crew]', views.OrderDetailView, 'delivery_crew', {}, {'pk': 1}),
+    ('order-detail[customer]', views.OrderDetailView, 'customer', {}, {'pk': 1}),
+    ('delivery-crew-users', views.DeliveryCrewListView, 'manager', {}, {}),
+    ('delivery-crew-users?username', views.DeliveryCrewListView, 'manager', {'username': 'explain-crew'}, {}),
+    ('delivery-crew-users?email', views.DeliveryCrewListView, 'manager', {'email': 'Crew@Example.com'}, {}),
+    ('delivery-crew-users?search', views.DeliveryCrewListView, 'manager', {'search': 'expl'}, {}),
+    ('managers', views.ManagerGroupView, 'manager', {}, {}),
+]
+
+# Queries issued by the serializers for each row rather than by the view
+RELATED = [
+    ('order-items', lambda: OrderItem.objects.filter(order_id=1).select_related('menuitem')),
+    # Facet counts read every matching item; the response is cached with the catalog
+    ('menu-item-facets', lambda: views.menu_facet_counts(MenuItem.objects.all(), [5, 10, 20])),
+]
+
+# A bare "SCAN t" reads the whole table. "SCAN t USING INDEX i" walks an
+# index in order: fine when nothing is filtered (it stops at the LIMIT, or
+# a count has to read every row anyway), a full index scan when rows are
+# filtered on columns the index does not constrain.
+# Scanning a partial index only reads the rows it was built for.
+SQLITE_SCAN = re.compile(r'\bSCAN (?:TABLE )?(\w+)(.*)')
+SQLITE_INDEX = re.compile(r'USING (?:COVERING )?INDEX (\w+)')
+POSTGRES_SCAN = re.compile(r'Seq Scan on (\S+)')
+
+
+def partial_indexes():
+    return {index.name for model in apps.get_models() for index in model._meta.indexes if index.condition is not None}
+
+
+class Command(BaseCommand):
+    help = ('Run EXPLAIN on the queryset behind each endpoint for a user of each role '
+            'and report full table scans and sorts that need a temporary B-tree')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Exit with an error if a finding is not in the baseline (for CI)')
+        parser.add_argument('--write-baseline', action='store_true',
+                            help=f'Accept the current findings into {BASELINE_PATH.name}')
+        parser.add_argument('--verbose-plans', action='store_true', help='Print every plan')
+
+    def handle(self, *args, **options):
+        # Representative users and groups only exist for the duration of the
+        # run; everything is rolled back afterwards.
+        with transaction.atomic():
+            users = self.create_role_users()
+            plans = dict(self.explain_endpoints(users))
+            transaction.set_rollback(True)
+
+        findings = []
+        for name, (plan, filtered) in plans.items():
+            if options['verbose_plans']:
+                self.stdout.write(f'--- {name}\n{plan}')
+            for finding in self.analyze(plan, filtered):
+                findings.append(f'{name}: {finding}')
+
+        for finding in findings:
+            self.stdout.write(self.style.WARNING(finding))
+        self.stdout.write(f'{len(plans)} querysets explained, {len(findings)} findings')
+
+        # The baseline maps each accepted finding to the reason it is accepted
+        baseline = json.loads(BASELINE_PATH.read_text()) if BASELINE_PATH.exists() else {}
+        if options['write_baseline']:
+            accepted = {finding: baseline.get(finding, '') for finding in sorted(findings)}
+            BASELINE_PATH.write_text(json.dumps(accepted, indent=4) + '\n')
+            self.stdout.write(self.style.SUCCESS(f'Baseline written to {BASELINE_PATH}'))
+            unjustified = [finding for finding, reason in accepted.items() if not reason]
+            if unjustified:
+                self.stdout.write(self.style.WARNING(
+                    'Give the reason each of these is acceptable in the baseline:\n' + '\n'.join(unjustified)
+                ))
+        elif options['check']:
+            new = [finding for finding in findings if finding not in baseline]
+            if new:
+                raise CommandError('New full scans or sorts:\n' + '\n'.join(new))
+            unjustified = [finding for finding in findings if not baseline[finding]]
+            if unjustified:
+                raise CommandError('Baselined without a reason:\n' + '\n'.join(unjustified))
+            self.stdout.write(self.style.SUCCESS('No new full scans'))
+
+    def create_role_users(self):
+        manager_group, _ = Group.objects.get_or_create(name='Manager')
+        delivery_group, _ = Group.objects.get_or_create(name='Delivery crew')
+
+        manager = User.objects.create(username='explain-manager')
+        manager.groups.add(manager_group)
+        crew = User.objects.create(username='explain-crew')
+        crew.groups.add(delivery_group)
+        customer = User.objects.create(username='explain-customer')
+
+        category = Category.objects.create(slug='explain-category', title='Explain')
+        MenuItem.objects.create(title='Explain', price=1, category=category)
+        Order.objects.create(user=customer, delivery_crew=crew)
+
+        return {
+            'anonymous': None,
+            'manager': manager,
+            'delivery_crew': crew,
+            'customer': customer,
+        }
+
+    def explain_endpoints(self, users):
+        factory = APIRequestFactory()
+        for name, view_class, role, params, kwargs in ENDPOINTS:
+            params = {key: value(users) if callable(value) else value for key, value in params.items()}
+            http_request = factory.get('/', params)
+            view = view_class()
+            view.setup(http_request, **kwargs)
+            view.format_kwarg = None
+            view.request = view.initialize_request(http_request, **kwargs)
+            if users[role] is not None:
+                view.request.user = users[role]
+
+            queryset = view.filter_queryset(view.get_queryset())
+            filtered = bool(queryset.query.where)
+            if kwargs:
+                # get_object() uses QuerySet.get(), which drops the ordering
+                yield name, (queryset.filter(**kwargs).order_by().explain(), True)
+                continue
+            if view.paginator is not None:
+                # The paginator counts the rows before reading a page
+                yield f'{name} (count)', (self.explain_count(queryset), filtered)
+                queryset = queryset[:view.paginator.page_size or 10]
+            yield name, (queryset.explain(), filtered)
+
+        for name, build in RELATED:
+            queryset = build()
+            yield name, (queryset.explain(), bool(queryset.query.where))
+
+    def explain_count(self, queryset):
+        """Plan of queryset.count(), which has no explain() of its own"""
+        statements = []
+
+        def capture(execute, sql, params, many, context):
+            statements.append((sql, params))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(capture):
+            queryset.count()
+        sql, params = statements[-1]
+        with connection.cursor() as cursor:
+            cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}', params)
+            return '\n'.join(' '.join(map(str, row)) for row in cursor.fetchall())
+
+    def analyze(self, plan, filtered):
+        if connection.vendor == 'postgresql':
+            for table in POSTGRES_SCAN.findall(plan):
+                yield f'full scan of {table}'
+            if re.search(r'\bSort\b', plan):
+                yield 'sort'
+            return
+
+        for line in plan.splitlines():
+            match = SQLITE_SCAN.search(line)
+            if match and 'USING' not in match.group(2):
+                yield f'full scan of {match.group(1)}'
+            elif match and filtered and 'INDEX' in match.group(2):
+                index = SQLITE_INDEX.search(match.group(2))
+                if not index or index.group(1) not in partial_indexes():
+                    yield f'full index scan of {match.group(1)}'
+            if 'USE TEMP B-TREE' in line:
+                yield 'temp b-tree for ' + line.split('USE TEMP B-TREE FOR ', 1)[-1].strip()
@@ -0,0 +1,78 @@
+import json
+from contextlib import nullcontext
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from LittleLemonAPI import loadtest
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive the API with concurrent anonymous, customer, delivery crew and manager users and report '
+        'throughput, latency percentiles, error and lock-timeout rates per route'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', help='Test a running server instead of serving the project in-process '
+                                          '(it must use the same database)')
+        parser.add_argument('--workers', type=int, default=20, help='Concurrent simulated users')
+        parser.add_argument('--duration', type=float, default=30, help='Seconds to run')
+        parser.add_argument('--mix', default=','.join(f'{role}={weight}' for role, weight in loadtest.DEFAULT_MIX.items()),
+                            help='Role weights, e.g. anonymous=50,customer=30,crew=15,manager=5')
+        parser.add_argument('--think', type=float, default=0.0, help='Mean pause between visits, in seconds')
+        parser.add_argument('--seed', type=int, help='Random seed, for repeatable request sequences')
+        parser.add_argument('--record', help='Write every request sent to this JSON lines log')
+        parser.add_argument('--replay', help='Send the requests of a recorded log instead of the mix')
+        parser.add_argument('--speed', type=float, default=1.0, help='Replay speed factor (2 = twice as fast)')
+        parser.add_argument('--output', help='Write the results as JSON (for --compare)')
+        parser.add_argument('--compare', help='Results JSON of an earlier run to compare with')
+        parser.add_argument('--cleanup', action='store_true', help='Delete the load-test users, their carts and orders, and exit')
+
+    def handle(self, *args, **options):
+        if options['cleanup']:
+            self.stdout.write(f'Deleted {loadtest.Fixture.cleanup()} load-test users')
+            return
+
+        entries = None
+        if options['replay']:
+            with open(options['replay']) as stream:
+                entries = loadtest.read_log(stream)
+            if not entries:
+                raise CommandError(f"{options['replay']} has no requests")
+            usernames = {entry['user'] for entry in entries if entry['user']}
+        else:
+            try:
+                roles = loadtest.assign_roles(loadtest.parse_mix(options['mix']), options['workers'])
+            except ValueError as error:
+                raise CommandError(error)
+            usernames = set(filter(None, loadtest.usernames_for(roles)))
+        fixture = loadtest.Fixture.seed(usernames)
+
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as stream:
+                baseline = json.load(stream)
+
+        server = nullcontext(options['url'].rstrip('/')) if options['url'] else loadtest.serve()
+        hosts = override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, '127.0.0.1'])
+        record = open(options['record'], 'w') if options['record'] else nullcontext()
+        # Failed requests are counted in the report; their tracebacks only with -v 2
+        quiet = loadtest.quiet_logger('django.request') if options['verbosity'] < 2 else nullcontext()
+        with hosts, server as base_url, record as log, quiet:
+            if entries is not None:
+                self.stdout.write(f'Replaying {len(entries)} requests against {base_url}')
+                results = loadtest.replay(base_url, fixture, entries, options['speed'])
+            else:
+                self.stdout.write(f"Running {len(roles)} workers for {options['duration']}s against {base_url}")
+                results = loadtest.run(
+                    base_url, fixture, roles, options['duration'], options['think'],
+                    recorder=loadtest.Recorder(log) if log else None, seed=options['seed'],
+                )
+
+        summary = results.summary()
+        self.stdout.write(loadtest.format_summary(summary, baseline))
+        if options['output']:
+            with open(options['output'], 'w') as stream:
+                json.dump(summary, stream, indent=2)
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from LittleLemonAPI import retention
+from LittleLemonAPI.background import enqueue
+from LittleLemonAPI.tasks import purge_retention
+
+
+class Command(BaseCommand):
+    help = 'Delete abandoned carts, stale auth tokens and expired sessions in batches (settings.RETENTION)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--policy', action='append', choices=retention.POLICIES,
+                            help='Only apply this policy (repeatable); all by default')
+        parser.add_argument('--batch-size', type=int, help='Rows per delete (default RETENTION["BATCH_SIZE"])')
+        parser.add_argument('--pause', type=float, help='Seconds between batches (default RETENTION["PAUSE"])')
+        parser.add_argument('--dry-run', action='store_true', help='Count the rows that would be deleted')
+        parser.add_argument('--enqueue', action='store_true',
+                            help='Store a purge_retention task for run_task_worker instead of running now')
+
+    def handle(self, *args, **options):
+        policies = options['policy'] or list(retention.POLICIES)
+        if options['batch_size'] is not None and options['batch_size'] < 1:
+            raise CommandError('--batch-size must be at least 1')
+        if options['enqueue']:
+            enqueue(purge_retention.task_name, policies, durable=True)
+            self.stdout.write(f"Enqueued retention for {', '.join(policies)}")
+            return
+
+        report = retention.purge(policies, options['batch_size'], options['pause'], options['dry_run'])
+        self.stdout.write(f"{'policy':<10}{'database':<18}{'rows':>9}{'batches':>9}{'seconds':>9}")
+        for entry in report:
+            self.stdout.write(
+                f"{entry['policy']:<10}{entry['database']:<18}{entry['rows']:>9}{entry['batches']:>9}{entry['seconds']:>9}"
+            )
+        total = sum(entry['rows'] for entry in report)
+        self.stdout.write(f"{'Would delete' if options['dry_run'] else 'Deleted'} {total} row(s) "
+                          f"in {sum(entry['seconds'] for entry in report):.3f}s")
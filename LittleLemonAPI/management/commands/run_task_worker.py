@@ -0,0 +1,57 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import F
+from django.utils import timezone
+
+from LittleLemonAPI import tasks  # noqa: F401  (registers the tasks)
+from LittleLemonAPI.background import run_durable_task
+from LittleLemonAPI.models import BackgroundTask
+
+
+class Command(BaseCommand):
+    help = 'Run background tasks stored in the database (BACKGROUND_TASKS["DURABLE"])'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Drain due tasks once and exit')
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--sleep', type=float, default=1.0, help='Seconds between polls when idle')
+        parser.add_argument('--stale-after', type=int, default=600,
+                            help='Requeue tasks left running this many seconds by a dead worker')
+
+    def handle(self, *args, **options):
+        while True:
+            self.requeue_stale(options['stale_after'])
+            processed = self.run_due(options['batch_size'])
+            if processed:
+                self.stdout.write(f'Processed {processed} task(s)')
+            if options['once']:
+                break
+            if not processed:
+                time.sleep(options['sleep'])
+
+    def run_due(self, batch_size):
+        now = timezone.now()
+        due = list(
+            BackgroundTask.objects
+            .filter(status=BackgroundTask.PENDING, run_at__lte=now)
+            .order_by('run_at')
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        processed = 0
+        for pk in due:
+            # Conditional update, so that two workers never run the same task
+            claimed = BackgroundTask.objects.filter(pk=pk, status=BackgroundTask.PENDING).update(
+                status=BackgroundTask.RUNNING, started_at=timezone.now(), attempts=F('attempts') + 1,
+            )
+            if claimed:
+                run_durable_task(BackgroundTask.objects.get(pk=pk))
+                processed += 1
+        return processed
+
+    def requeue_stale(self, stale_after):
+        cutoff = timezone.now() - timedelta(seconds=stale_after)
+        BackgroundTask.objects.filter(status=BackgroundTask.RUNNING, started_at__lt=cutoff).update(
+            status=BackgroundTask.PENDING, run_at=timezone.now(),
+        )
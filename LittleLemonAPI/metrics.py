@@ -0,0 +1,309 @@
+"""
+Request metrics: per-view latency histograms, status codes, database
+queries and cache hit rates, exposed in Prometheus text format at
+/api/metrics/.
+
+Each worker process counts into its own RequestMetrics (a dict update
+under a lock per request) and writes a snapshot to
+METRICS['DIR']/<pid>-<start>.json at most every FLUSH_INTERVAL seconds.
+On exit, and when the endpoint finds the file of a process that is gone
+(killed before it could), the snapshot is added to archived.json and
+its file removed, so there is one file per live worker and counters
+only grow as workers come and go; clear the directory when deploying
+to start from zero.
+"""
+import atexit
+import contextlib
+import contextvars
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from pathlib import Path
+
+from django.conf import settings
+
+try:
+    import fcntl
+except ImportError:  # Windows: archiving is not serialized across processes
+    fcntl = None
+
+DEFAULTS = {
+    'DIR': None,  # BASE_DIR / 'metrics'
+    'FLUSH_INTERVAL': 10,
+    'BUCKETS': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+}
+
+
+def get_setting(name):
+    return getattr(settings, 'METRICS', {}).get(name, DEFAULTS[name])
+
+
+def metrics_dir():
+    return Path(get_setting('DIR') or Path(settings.BASE_DIR) / 'metrics')
+
+
+class RequestMetrics:
+    """Thread-safe request counters of this process."""
+
+    def __init__(self, buckets):
+        self.lock = threading.Lock()
+        self.buckets = tuple(buckets)
+        # (view, method) -> [non-cumulative bucket counts (last is +Inf), seconds, queries]
+        self.latency = {}
+        # (view, method, status) -> requests
+        self.statuses = {}
+        # (cache, 'hit' | 'miss') -> lookups
+        self.cache = {}
+
+    def observe(self, view, method, status, seconds, queries):
+        index = bisect_left(self.buckets, seconds)
+        with self.lock:
+            entry = self.latency.get((view, method))
+            if entry is None:
+                entry = self.latency[(view, method)] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += seconds
+            entry[2] += queries
+            key = (view, method, status)
+            self.statuses[key] = self.statuses.get(key, 0) + 1
+
+    def cache_lookup(self, name, hit):
+        key = (name, 'hit' if hit else 'miss')
+        with self.lock:
+            self.cache[key] = self.cache.get(key, 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'buckets': list(self.buckets),
+                'latency': [[view, method, list(counts), seconds, queries]
+                            for (view, method), (counts, seconds, queries) in self.latency.items()],
+                'statuses': [[*key, count] for key, count in self.statuses.items()],
+                'cache': [[*key, count] for key, count in self.cache.items()],
+            }
+
+
+# [count] of the current request; None outside requests (e.g. background tasks)
+request_queries = contextvars.ContextVar('request_queries', default=None)
+
+
+def count_query(execute, sql, params, many, context):
+    counter = request_queries.get()
+    if counter is not None:
+        counter[0] += 1
+    return execute(sql, params, many, context)
+
+
+def install_query_counter(connection):
+    """Add count_query to a connection's execute wrappers once (see signals.count_request_queries)."""
+    if count_query not in connection.execute_wrappers:
+        # First, so connection.execute_wrapper() blocks still pop their own wrapper
+        connection.execute_wrappers.insert(0, count_query)
+
+
+metrics = RequestMetrics(get_setting('BUCKETS'))
+_file_name = '%s-%s.json' % (os.getpid(), time.time_ns())
+_next_flush = 0.0
+_flush_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    # Workers forked from a preloaded parent (gunicorn --preload) start
+    # their own counters and file instead of sharing the parent's
+    global metrics, _file_name, _next_flush, _flush_lock
+    metrics = RequestMetrics(metrics.buckets)
+    _file_name = '%s-%s.json' % (os.getpid(), time.time_ns())
+    _next_flush = 0.0
+    _flush_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+# Counters of the processes that have exited
+ARCHIVE_NAME = 'archived.json'
+
+
+def cache_lookup(name, hit):
+    metrics.cache_lookup(name, hit)
+
+
+def write_json(path, data):
+    temporary = path.with_name(path.name + '.tmp')
+    temporary.write_text(json.dumps(data))
+    os.replace(temporary, path)
+
+
+def flush(force=False):
+    """Write this process's snapshot if FLUSH_INTERVAL has passed since the last write."""
+    global _next_flush
+    now = time.monotonic()
+    if not force and now < _next_flush:
+        return
+    if not _flush_lock.acquire(blocking=force):
+        return
+    try:
+        _next_flush = now + get_setting('FLUSH_INTERVAL')
+        directory = metrics_dir()
+        directory.mkdir(parents=True, exist_ok=True)
+        write_json(directory / _file_name, metrics.snapshot())
+    finally:
+        _flush_lock.release()
+
+
+def process_id(path):
+    """Pid of a process snapshot file, None for the archive"""
+    pid = path.name.partition('-')[0]
+    return int(pid) if pid.isdigit() else None
+
+
+def process_alive(pid):
+    if os.name != 'posix':
+        # os.kill() would terminate it
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+@contextlib.contextmanager
+def directory_lock(directory):
+    """Serialize reading and archiving the files across processes"""
+    with open(directory / '.lock', 'a') as handle:
+        if fcntl is not None:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+        yield
+
+
+def read_snapshot(path):
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def archive(directory, paths):
+    """Add the snapshots in paths to the archive and remove them; call under directory_lock()."""
+    buckets = list(metrics.buckets)
+    archived = read_snapshot(directory / ARCHIVE_NAME)
+    snapshots = [archived] if archived is not None else []
+    snapshots += filter(None, map(read_snapshot, paths))
+    write_json(directory / ARCHIVE_NAME, merge_snapshots(buckets, snapshots))
+    for path in paths:
+        path.unlink(missing_ok=True)
+
+
+@atexit.register
+def _archive_on_exit():
+    if metrics.latency or metrics.cache:
+        try:
+            flush(force=True)
+            directory = metrics_dir()
+            with directory_lock(directory):
+                archive(directory, [directory / _file_name])
+        except OSError:
+            pass
+
+
+def merge_snapshots(buckets, snapshots):
+    """
+    One snapshot summing those taken with these buckets; the others (written
+    before the buckets were changed) are not comparable and are dropped.
+    """
+    latency, statuses, cache = {}, {}, {}
+    for snapshot in snapshots:
+        if snapshot['buckets'] != buckets:
+            continue
+        for view, method, counts, seconds, queries in snapshot['latency']:
+            entry = latency.setdefault((view, method), [[0] * len(counts), 0.0, 0])
+            entry[0] = [total + count for total, count in zip(entry[0], counts)]
+            entry[1] += seconds
+            entry[2] += queries
+        for view, method, status, count in snapshot['statuses']:
+            statuses[(view, method, status)] = statuses.get((view, method, status), 0) + count
+        for name, result, count in snapshot['cache']:
+            cache[(name, result)] = cache.get((name, result), 0) + count
+    return {
+        'buckets': buckets,
+        'latency': [[view, method, counts, seconds, queries]
+                    for (view, method), (counts, seconds, queries) in latency.items()],
+        'statuses': [[*key, count] for key, count in statuses.items()],
+        'cache': [[*key, count] for key, count in cache.items()],
+    }
+
+
+def collect():
+    """
+    The snapshots of every process summed: this one live, the others from
+    their files, exited ones from the archive. Files of processes that are
+    gone are archived first.
+    """
+    buckets = list(metrics.buckets)
+    snapshots = [metrics.snapshot()]
+    directory = metrics_dir()
+    if directory.is_dir():
+        with directory_lock(directory):
+            dead = [
+                path for path in directory.glob('*.json')
+                if process_id(path) not in (None, os.getpid()) and not process_alive(process_id(path))
+            ]
+            if dead:
+                archive(directory, dead)
+            snapshots += filter(None, (
+                read_snapshot(path) for path in directory.glob('*.json') if path.name != _file_name
+            ))
+
+    merged = merge_snapshots(buckets, snapshots)
+    latency = {(view, method): [counts, seconds, queries] for view, method, counts, seconds, queries in merged['latency']}
+    statuses = {(view, method, status): count for view, method, status, count in merged['statuses']}
+    cache = {(name, result): count for name, result, count in merged['cache']}
+    return buckets, latency, statuses, cache
+
+
+def labels(**values):
+    return ','.join('%s="%s"' % (name, str(value).replace('\\', r'\\').replace('"', r'\"'))
+                    for name, value in values.items())
+
+
+def render_prometheus():
+    buckets, latency, statuses, cache = collect()
+    lines = [
+        '# HELP littlelemon_request_duration_seconds Request latency by view.',
+        '# TYPE littlelemon_request_duration_seconds histogram',
+    ]
+    for (view, method), (counts, seconds, queries) in sorted(latency.items()):
+        cumulative = 0
+        for bound, count in zip([*buckets, '+Inf'], counts):
+            cumulative += count
+            lines.append('littlelemon_request_duration_seconds_bucket{%s} %d'
+                         % (labels(view=view, method=method, le=bound), cumulative))
+        lines.append('littlelemon_request_duration_seconds_sum{%s} %r' % (labels(view=view, method=method), seconds))
+        lines.append('littlelemon_request_duration_seconds_count{%s} %d' % (labels(view=view, method=method), cumulative))
+
+    lines += [
+        '# HELP littlelemon_requests_total Responses by view and status code.',
+        '# TYPE littlelemon_requests_total counter',
+    ]
+    for (view, method, status), count in sorted(statuses.items()):
+        lines.append('littlelemon_requests_total{%s} %d' % (labels(view=view, method=method, status=status), count))
+
+    lines += [
+        '# HELP littlelemon_db_queries_total Database queries run by requests, by view.',
+        '# TYPE littlelemon_db_queries_total counter',
+    ]
+    for (view, method), (counts, seconds, queries) in sorted(latency.items()):
+        lines.append('littlelemon_db_queries_total{%s} %d' % (labels(view=view, method=method), queries))
+
+    lines += [
+        '# HELP littlelemon_cache_lookups_total Cache lookups by cache and result (hit or miss).',
+        '# TYPE littlelemon_cache_lookups_total counter',
+    ]
+    for (name, result), count in sorted(cache.items()):
+        lines.append('littlelemon_cache_lookups_total{%s} %d' % (labels(cache=name, result=result), count))
+    return '\n'.join(lines) + '\n'
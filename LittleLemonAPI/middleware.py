@@ -0,0 +1,141 @@
+import logging
+import time
+
+from django.utils.cache import patch_vary_headers
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from . import compression, metrics, profiling
+
+logger = logging.getLogger(__name__)
+
+
+class CompressionMiddleware:
+    """
+    Compress JSON response bodies with an encoding the client accepts.
+
+    Public catalog responses carrying a `precompressed` dict (see
+    cache.CachedCatalogMixin) are served in the best encoding (brotli,
+    zstd or gzip, depending on what is installed) from that dict. Other
+    JSON responses may mix secrets (tokens, user data) with request input,
+    so they are gzipped with random padding like Django's GZipMiddleware
+    (BREACH). HTML (admin, browsable API pages with CSRF tokens) and
+    responses smaller than COMPRESSION_MIN_SIZE are sent as-is.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+        if response.status_code != 200 or len(response.content) < compression.min_size():
+            return response
+        precompressed = getattr(response, 'precompressed', None)
+        if precompressed is None and not response.get('Content-Type', '').startswith('application/json'):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        accept_encoding = request.META.get('HTTP_ACCEPT_ENCODING', '')
+        if precompressed is None:
+            encoding = compression.negotiate(accept_encoding, ['gzip'])
+            if encoding is None:
+                return response
+            content = compression.compress_padded(response.content)
+        else:
+            encoding = compression.negotiate(accept_encoding)
+            if encoding is None:
+                return response
+            content = precompressed.get(encoding)
+            if content is None:
+                content = compression.compress(response.content, encoding)
+        if len(content) >= len(response.content):
+            return response
+
+        response.content = content
+        response['Content-Length'] = str(len(content))
+        response['Content-Encoding'] = encoding
+
+        # The encoded body is no longer byte-identical, so a strong ETag
+        # becomes weak (same as django.middleware.gzip.GZipMiddleware).
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
+
+
+def profiling_user(request):
+    """The superuser behind a request, authenticated the way API views do (token or session)."""
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        try:
+            user = Request(request, authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES]).user
+        except APIException:
+            return None
+    return user if user.is_superuser else None
+
+
+class ProfilingMiddleware:
+    """
+    Profile a request under cProfile, with SQL timings, when a superuser
+    asks for it with ?_profile or an `X-Profile` header. The capture is
+    saved to the profile store (see profiling.py) and its id returned in
+    `X-Profile-Id`; list captures at /api/profiles/.
+
+    Other requests only pay for checking the flag.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if 'HTTP_X_PROFILE' not in request.META and '_profile' not in request.GET:
+            return self.get_response(request)
+
+        user = profiling_user(request)
+        if user is None:
+            return self.get_response(request)
+
+        with profiling.Capture() as capture:
+            response = self.get_response(request)
+        try:
+            capture.save(request, response, user)
+        except OSError:
+            logger.exception('Could not save profile %s', capture.id)
+        else:
+            response['X-Profile-Id'] = capture.id
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Record the latency, status code and database queries of every request
+    per view (see metrics.py). Place it first so the time spent in the
+    other middleware counts too.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = [0]
+        token = metrics.request_queries.set(queries)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            metrics.request_queries.reset(token)
+        seconds = time.perf_counter() - started
+
+        match = request.resolver_match
+        view = match.view_name if match else 'unmatched'
+        metrics.metrics.observe(view, request.method, response.status_code, seconds, queries[0])
+        try:
+            metrics.flush()
+        except OSError:
+            logger.exception('Could not write request metrics')
+        return response
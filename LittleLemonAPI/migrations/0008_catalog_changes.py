@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:01
+
+from django.db import migrations, models
+
+
+def log_existing_catalog(apps, schema_editor):
+    """A first sync (cursor 0) has to see the catalog that predates the log."""
+    db = schema_editor.connection.alias
+    Category = apps.get_model('LittleLemonAPI', 'Category')
+    MenuItem = apps.get_model('LittleLemonAPI', 'MenuItem')
+    CatalogChange = apps.get_model('LittleLemonAPI', 'CatalogChange')
+    CatalogChange.objects.using(db).bulk_create(
+        [CatalogChange(kind='category', object_id=pk) for pk in Category.objects.using(db).values_list('pk', flat=True)]
+        + [CatalogChange(kind='menuitem', object_id=pk) for pk in MenuItem.objects.using(db).values_list('pk', flat=True)],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0007_recommendations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogChange',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('menuitem', 'Menu item'), ('category', 'Category'), ('reset', 'Reset')], max_length=10)),
+                ('object_id', models.BigIntegerField()),
+                ('deleted', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'object_id', 'id'], name='catalogchange_object_idx'), models.Index(fields=['deleted', 'created_at'], name='catalogchange_tombstone_idx')],
+            },
+        ),
+        migrations.RunPython(log_existing_catalog, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0009_order_filter_indexes'),
+        # After the auth migrations that rebuild auth_user on SQLite
+        ('auth', '0012_alter_user_first_name_max_length'),
+    ]
+
+    operations = [
+        # Email lookups and searches of filters.UserFilter; auth_user
+        # belongs to django.contrib.auth, so the index is created here
+        migrations.RunSQL(
+            'CREATE INDEX auth_user_email_lower_idx ON auth_user (LOWER(email))',
+            'DROP INDEX auth_user_email_lower_idx',
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0011_cart_updated_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='menuitem',
+            name='featured',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='menuitem',
+            index=models.Index(condition=models.Q(('featured', True)), fields=['title'], name='menuitem_featured_title_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-19 13:24
+
+from django.db import migrations, models
+
+
+def forget_counts(apps, schema_editor):
+    """Counts made with the order id watermark cannot be told apart; the next build recounts."""
+    db = schema_editor.connection.alias
+    apps.get_model('LittleLemonAPI', 'MenuItemPairCount').objects.using(db).delete()
+    apps.get_model('LittleLemonAPI', 'RecommendationState').objects.using(db).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('LittleLemonAPI', '0014_token_use'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='recommendationstate',
+            name='last_order_id',
+        ),
+        migrations.AddField(
+            model_name='recommendationstate',
+            name='counted_until',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='CountedOrder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('alias', models.CharField(max_length=100)),
+                ('order_id', models.BigIntegerField()),
+                ('date', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['alias', 'date'], name='countedorder_alias_date_idx')],
+                'unique_together': {('alias', 'order_id')},
+            },
+        ),
+        migrations.RunPython(forget_counts, migrations.RunPython.noop),
+    ]
@@ -2,9 +2,13 @@ from unicodedata import category
 from django.db import models
 from django.contrib.auth.models import User, Group
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
 from django.core.management.base import BaseCommand
 from decimal import Decimal
 
+from .cache import clear_cart_snapshot
+
 
 class Command(BaseCommand):
     help = 'Create sample data for Little Lemon API'
@@ -94,9 +98,21 @@ class Command(BaseCommand):
             )
         )
 
+class Location(models.Model):
+    """A restaurant location. Its orders and carts are stored in its shard (settings.LOCATION_SHARDS)."""
+    slug = models.SlugField(unique=True)
+    name = models.CharField(max_length=255)
+
+    class Meta:
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+
 class Category(models.Model):
     slug = models.SlugField(unique=True)
     title = models.CharField(max_length=255, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name_plural = "Categories"
@@ -108,33 +124,63 @@ class Category(models.Model):
 class MenuItem(models.Model):
     title = models.CharField(max_length=255, db_index=True)
     price = models.DecimalField(max_digits=6, decimal_places=2, db_index=True)
-    featured = models.BooleanField(db_index=True, default=False)
+    featured = models.BooleanField(default=False)
     category = models.ForeignKey(Category, on_delete=models.PROTECT)
     description = models.TextField(max_length=1000, blank=True, default='')
     inventory = models.SmallIntegerField(default=0)
     item_of_the_day = models.BooleanField(default=False, db_index=True)
+    # Locations serving this item; none means every location
+    locations = models.ManyToManyField(Location, blank=True, related_name='menu_items')
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['title']
+        indexes = [
+            # menu-items/?category=<id> ordered by title
+            models.Index(fields=['category', 'title'], name='menuitem_category_title_idx'),
+            # menu-items/?featured=true ordered by title. Partial, because the
+            # filter compiles to a bare `WHERE featured`, which SQLite cannot
+            # look up in an index on featured
+            models.Index(fields=['title'], condition=models.Q(featured=True), name='menuitem_featured_title_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
+# Cart, Order and OrderItem rows can live in their location's shard database
+# (settings.LOCATION_SHARDS), so their foreign keys into the shared database
+# never carry a database constraint, whether or not shards are configured:
+# the schema does not depend on the settings. Django applies on_delete within
+# a database and signals.delete_shard_rows applies it to the other shards.
+
 class Cart(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
-    menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_constraint=False)
+    menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE, db_constraint=False)
+    location = models.ForeignKey(
+        Location, on_delete=models.PROTECT, related_name='+', null=True, blank=True, db_constraint=False
+    )
     quantity = models.SmallIntegerField(validators=[MinValueValidator(1)], default=1)
     unit_price = models.DecimalField(max_digits=6, decimal_places=2, default=0.00)
     price = models.DecimalField(max_digits=6, decimal_places=2, default=0.00)
+    # Last change, for the abandoned cart retention policy (LittleLemonAPI.retention)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         unique_together = ('menuitem', 'user')
+        indexes = [models.Index(fields=['updated_at'], name='cart_updated_idx')]
 
     def save(self, *args, **kwargs):
         if self.menuitem:
             self.unit_price = self.menuitem.price
             self.price = self.unit_price * self.quantity
         super().save(*args, **kwargs)
+        clear_cart_snapshot(self.user_id, self._state.db)
+
+    def delete(self, *args, **kwargs):
+        using = self._state.db
+        result = super().delete(*args, **kwargs)
+        clear_cart_snapshot(self.user_id, using)
+        return result
 
     def __str__(self):
         return f"{self.user.username} - {self.menuitem.title}"
@@ -146,28 +192,50 @@ class Order(models.Model):
         ('out_for_delivery', 'Out for Delivery'),
         ('delivered', 'Delivered'),
     ]
+    # Status -> the status it may move to (enforced by the batch endpoints)
+    TRANSITIONS = {
+        'pending': 'preparing',
+        'preparing': 'out_for_delivery',
+        'out_for_delivery': 'delivered',
+    }
     
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='orders')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='orders', db_constraint=False)
     delivery_crew = models.ForeignKey(
         User, 
         on_delete=models.SET_NULL, 
         related_name='delivery_orders', 
         null=True, 
-        blank=True
+        blank=True,
+        db_constraint=False
+    )
+    location = models.ForeignKey(
+        Location, on_delete=models.PROTECT, related_name='+', null=True, blank=True, db_constraint=False
     )
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     total = models.DecimalField(max_digits=6, decimal_places=2, default=0.00)
     date = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['-date']
+        indexes = [
+            # Order history per role, newest first (see explain_endpoints)
+            models.Index(fields=['-date'], name='order_date_idx'),
+            models.Index(fields=['user', '-date'], name='order_user_date_idx'),
+            models.Index(fields=['delivery_crew', '-date'], name='order_crew_date_idx'),
+            # Filter combinations of filters.OrderFilter
+            models.Index(fields=['status', '-date'], name='order_status_date_idx'),
+            models.Index(fields=['delivery_crew', 'status', '-date'], name='order_crew_status_date_idx'),
+            models.Index(fields=['user', 'status', '-date'], name='order_user_status_date_idx'),
+            models.Index(fields=['total', 'id'], name='order_total_idx'),
+        ]
 
     def __str__(self):
         return f"Order #{self.id} - {self.user.username}"
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
-    menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE)
+    menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE, db_constraint=False)
     quantity = models.SmallIntegerField(validators=[MinValueValidator(1)], default=1)
     unit_price = models.DecimalField(max_digits=6, decimal_places=2, default=0.00)
     price = models.DecimalField(max_digits=6, decimal_places=2, default=0.00)
@@ -195,4 +263,128 @@ class Rating(models.Model):
         """Safe stars display"""
         rating_value = self.rating or 1
         rating_value = max(1, min(5, rating_value))
-        return '★' * rating_value + '☆' * (5 - rating_value)
\ No newline at end of file
+        return '★' * rating_value + '☆' * (5 - rating_value)
+
+class BackgroundTask(models.Model):
+    """Durable queue for LittleLemonAPI.background, drained by run_task_worker."""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+        (FAILED, 'Failed'),
+    ]
+
+    name = models.CharField(max_length=255)
+    args = models.JSONField(default=list)
+    kwargs = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='backgroundtask_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.id} ({self.status})"
+
+class CatalogChange(models.Model):
+    """
+    Append-only log of menu item and category changes; the id is the sync
+    cursor. A deleted=True row is a tombstone. compact_catalog_changes
+    drops superseded rows and old tombstones, leaving a RESET row whose
+    object_id is the lowest cursor that can still sync incrementally.
+    """
+    MENU_ITEM = 'menuitem'
+    CATEGORY = 'category'
+    RESET = 'reset'
+    KIND_CHOICES = [
+        (MENU_ITEM, 'Menu item'),
+        (CATEGORY, 'Category'),
+        (RESET, 'Reset'),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    deleted = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Compaction looks for later changes of the same object
+            models.Index(fields=['kind', 'object_id', 'id'], name='catalogchange_object_idx'),
+            models.Index(fields=['deleted', 'created_at'], name='catalogchange_tombstone_idx'),
+        ]
+
+    def __str__(self):
+        return f"#{self.id} {self.kind} {self.object_id}{' (deleted)' if self.deleted else ''}"
+
+class MenuItemPairCount(models.Model):
+    """
+    Sparse item x item co-occurrence matrix: the number of orders containing
+    both items. Only item <= other is stored; item == other is the number of
+    orders containing the item. Maintained by build_recommendations.
+    """
+    item = models.ForeignKey(MenuItem, on_delete=models.CASCADE, related_name='+')
+    other = models.ForeignKey(MenuItem, on_delete=models.CASCADE, related_name='+')
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('item', 'other')
+
+class MenuItemRecommendation(models.Model):
+    """Top-K items ordered together with a menu item, by cosine similarity."""
+    menuitem = models.ForeignKey(MenuItem, on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey(MenuItem, on_delete=models.CASCADE, related_name='+')
+    score = models.FloatField()
+    rank = models.PositiveSmallIntegerField()
+
+    class Meta:
+        ordering = ['menuitem', 'rank']
+        unique_together = ('menuitem', 'rank')
+
+class RecommendationState(models.Model):
+    """When orders were last read into MenuItemPairCount, per order database."""
+    alias = models.CharField(max_length=100, unique=True)
+    counted_until = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.alias}: {self.counted_until}"
+
+class CountedOrder(models.Model):
+    """
+    Orders already in MenuItemPairCount that the next build reads again
+    (placed within RECOMMENDATION_OVERLAP of its watermark), so they are
+    not counted twice.
+    """
+    alias = models.CharField(max_length=100)
+    order_id = models.BigIntegerField()
+    date = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('alias', 'order_id')
+        indexes = [models.Index(fields=['alias', 'date'], name='countedorder_alias_date_idx')]
+
+class TokenUse(models.Model):
+    """
+    When an auth token was last used (recorded at most every
+    RETENTION['TOKEN_USE_INTERVAL'] seconds by TrackedTokenAuthentication),
+    so the token retention policy keeps tokens of active API clients.
+    """
+    token = models.OneToOneField(Token, on_delete=models.CASCADE, primary_key=True, related_name='use')
+    last_used = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.token_id[:8]}...: {self.last_used}"
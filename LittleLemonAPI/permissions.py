@@ -1,41 +1,45 @@
 from rest_framework import permissions
-from django.contrib.auth.models import Group
+
+
+def get_roles(user):
+    """Names of the user's groups, read once per request and kept on the user object"""
+    if not user.is_authenticated:
+        return frozenset()
+    if not hasattr(user, '_roles'):
+        user._roles = frozenset(user.groups.values_list('name', flat=True))
+    return user._roles
+
+
+def clear_roles(user):
+    """Forget the roles cached by get_roles(), after changing the user's groups"""
+    user.__dict__.pop('_roles', None)
+
+
+def order_scope(user):
+    """Filter limiting orders to those the user may see"""
+    roles = get_roles(user)
+    if user.is_superuser or 'Manager' in roles:
+        # Managers see all orders
+        return {}
+    if 'Delivery crew' in roles:
+        # 9. Delivery crew can access orders assigned to them
+        return {'delivery_crew': user}
+    # 21. Customers can browse their own orders
+    return {'user': user}
 
 class IsManagerOrAdmin(permissions.BasePermission):
     """
     Custom permission for managers and admins only.
     """
     def has_permission(self, request, view):
-        if request.user.is_superuser:
-            return True
-        
-        if request.user.is_authenticated:
-            manager_group = Group.objects.filter(name='Manager').first()
-            if manager_group and manager_group in request.user.groups.all():
-                return True
-        
-        return False
+        return request.user.is_superuser or 'Manager' in get_roles(request.user)
 
 class IsDeliveryCrewOrManager(permissions.BasePermission):
     """
     Custom permission for delivery crew and managers.
     """
     def has_permission(self, request, view):
-        if request.user.is_superuser:
-            return True
-        
-        if request.user.is_authenticated:
-            manager_group = Group.objects.filter(name='Manager').first()
-            delivery_group = Group.objects.filter(name='Delivery crew').first()
-            
-            user_groups = request.user.groups.all()
-            
-            if manager_group and manager_group in user_groups:
-                return True
-            if delivery_group and delivery_group in user_groups:
-                return True
-        
-        return False
+        return request.user.is_superuser or bool({'Manager', 'Delivery crew'} & get_roles(request.user))
 
 class IsCustomerOrReadOnly(permissions.BasePermission):
     """
@@ -56,12 +60,11 @@ class IsOwnerOrManager(permissions.BasePermission):
             return True
         
         # Check if user is manager
-        manager_group = Group.objects.filter(name='Manager').first()
-        if manager_group and manager_group in request.user.groups.all():
+        if 'Manager' in get_roles(request.user):
             return True
         
         # Check if user owns the object
-        if hasattr(obj, 'user'):
-            return obj.user == request.user
+        if hasattr(obj, 'user_id'):
+            return obj.user_id == request.user.pk
         
         return False
@@ -0,0 +1,155 @@
+"""
+Per-request profiles, captured on demand by ProfilingMiddleware.
+
+Each capture is a cProfile dump (<id>.prof, readable with pstats or
+snakeviz) plus a JSON summary (<id>.json) with the request, the SQL
+statements run and their timings, and the top functions by cumulative
+time. Only the newest PROFILER['KEEP'] captures are kept.
+"""
+import cProfile
+import json
+import os
+import pstats
+import time
+import uuid
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+DEFAULTS = {
+    'DIR': None,  # BASE_DIR / 'profiles'
+    'KEEP': 50,
+    'TOP_FUNCTIONS': 30,
+    'TOP_QUERIES': 20,
+}
+
+
+def get_setting(name):
+    return getattr(settings, 'PROFILER', {}).get(name, DEFAULTS[name])
+
+
+def profile_dir():
+    return Path(get_setting('DIR') or Path(settings.BASE_DIR) / 'profiles')
+
+
+class QueryTimer:
+    """connection.execute_wrapper() recording every statement with its duration."""
+
+    def __init__(self, alias):
+        self.alias = alias
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'alias': self.alias,
+                'sql': sql,
+                'ms': round((time.perf_counter() - started) * 1000, 3),
+                'many': many,
+            })
+
+
+class Capture:
+    """Profile everything run inside `with Capture() as capture:`."""
+
+    def __init__(self):
+        self.id = '%s-%s' % (timezone.now().strftime('%Y%m%d-%H%M%S-%f'), uuid.uuid4().hex[:6])
+        self.profiler = cProfile.Profile()
+        self.timers = [QueryTimer(alias) for alias in connections]
+        self.seconds = None
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        for timer in self.timers:
+            self._stack.enter_context(connections[timer.alias].execute_wrapper(timer))
+        self._started = time.perf_counter()
+        self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler.disable()
+        self.seconds = time.perf_counter() - self._started
+        self._stack.close()
+
+    def top_functions(self, limit):
+        stats = pstats.Stats(self.profiler)
+        rows = sorted(stats.stats.items(), key=lambda row: row[1][3], reverse=True)[:limit]
+        return [
+            {
+                'function': '%s:%s(%s)' % (filename, line, name),
+                'calls': calls,
+                'total_ms': round(total * 1000, 3),
+                'cumulative_ms': round(cumulative * 1000, 3),
+            }
+            for (filename, line, name), (_, calls, total, cumulative, _) in rows
+        ]
+
+    def summary(self, request, response, user):
+        queries = [query for timer in self.timers for query in timer.queries]
+        return {
+            'id': self.id,
+            'created_at': timezone.now().isoformat(),
+            'method': request.method,
+            'path': request.get_full_path(),
+            'user': user.get_username(),
+            'status': response.status_code,
+            'duration_ms': round(self.seconds * 1000, 3),
+            'sql': {
+                'count': len(queries),
+                'ms': round(sum(query['ms'] for query in queries), 3),
+                'slowest': sorted(queries, key=lambda query: query['ms'], reverse=True)[:get_setting('TOP_QUERIES')],
+            },
+            'top_functions': self.top_functions(get_setting('TOP_FUNCTIONS')),
+        }
+
+    def save(self, request, response, user):
+        """Write the capture to the profile store and drop the oldest ones."""
+        directory = profile_dir()
+        directory.mkdir(parents=True, exist_ok=True)
+        self.profiler.dump_stats(directory / f'{self.id}.prof')
+        (directory / f'{self.id}.json').write_text(json.dumps(self.summary(request, response, user)))
+        rotate(directory, get_setting('KEEP'))
+
+
+def rotate(directory, keep):
+    # Ids start with a timestamp, so name order is capture order
+    for summary in sorted(directory.glob('*.json'), reverse=True)[keep:]:
+        for path in (summary, summary.with_suffix('.prof')):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+# Reading the store (views.profiles, views.profile_detail)
+
+def list_captures(limit=None):
+    directory = profile_dir()
+    if not directory.is_dir():
+        return []
+    captures = []
+    for path in sorted(directory.glob('*.json'), reverse=True)[:limit]:
+        try:
+            captures.append(json.loads(path.read_text()))
+        except (OSError, ValueError):
+            # Rotated away or half-written by another worker
+            continue
+    return captures
+
+
+def get_capture(capture_id):
+    try:
+        return json.loads((profile_dir() / f'{capture_id}.json').read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def capture_file(capture_id):
+    path = profile_dir() / f'{capture_id}.prof'
+    return path if path.is_file() else None
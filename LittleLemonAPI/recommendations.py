@@ -0,0 +1,282 @@
+"""
+"Frequently ordered together" recommendations.
+
+build() counts, for every pair of menu items, the orders containing both
+(a sparse item x item matrix, X.T @ X for the binary order x item matrix X)
+and keeps the top-K neighbours of each item by cosine similarity.
+Only orders placed since the previous build are read; `full=True`
+recounts everything (needed after orders are deleted).
+
+An order only becomes visible when its checkout commits, which can be
+after orders with later ids or dates were read, so each build re-reads
+the RECOMMENDATION_OVERLAP seconds before its watermark and skips the
+orders it already counted (CountedOrder).
+
+Requests are served from RecommendationIndex, a compact copy of the
+top-K table held by every worker and reloaded when a build finishes.
+"""
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils import timezone
+
+from .models import (
+    CountedOrder, MenuItem, MenuItemPairCount, MenuItemRecommendation, OrderItem, RecommendationState,
+)
+from .sharding import shard_aliases
+
+RECOMMENDATIONS_VERSION_KEY = 'recommendations:version'
+
+
+def top_k():
+    return getattr(settings, 'RECOMMENDATION_TOP_K', 10)
+
+
+def overlap():
+    return timedelta(seconds=getattr(settings, 'RECOMMENDATION_OVERLAP', 600))
+
+
+# Building (management command build_recommendations)
+
+def order_baskets(using, since=None, counted=(), chunk_size=10000):
+    """
+    (order_ids, menuitem_ids, {order id: date}) of the lines of orders placed
+    since a time (every order if None), leaving out the counted order ids.
+    """
+    import numpy as np
+
+    order_ids, item_ids, placed = array('q'), array('q'), {}
+    lines = OrderItem.objects.using(using).order_by()
+    if since is not None:
+        lines = lines.filter(order__date__gte=since)
+    for order_id, date, menuitem_id in lines.values_list('order_id', 'order__date', 'menuitem_id').iterator(
+        chunk_size=chunk_size,
+    ):
+        if order_id in counted:
+            continue
+        order_ids.append(order_id)
+        item_ids.append(menuitem_id)
+        placed[order_id] = date
+    order_ids = np.frombuffer(order_ids, dtype=np.int64) if order_ids else np.zeros(0, dtype=np.int64)
+    item_ids = np.frombuffer(item_ids, dtype=np.int64) if item_ids else np.zeros(0, dtype=np.int64)
+    return order_ids, item_ids, placed
+
+
+def read_new_orders(state, chunk_size):
+    """
+    order_baskets() of the orders of state.alias not counted yet; records
+    them in CountedOrder and moves the watermark to the time of the read.
+    """
+    read_at = timezone.now()
+    since = state.counted_until - overlap() if state.counted_until else None
+    counted = set()
+    if since is not None:
+        counted = set(
+            CountedOrder.objects.filter(alias=state.alias, date__gte=since).values_list('order_id', flat=True)
+        )
+    order_ids, item_ids, placed = order_baskets(state.alias, since, counted, chunk_size)
+    CountedOrder.objects.bulk_create(
+        [CountedOrder(alias=state.alias, order_id=pk, date=date) for pk, date in placed.items()],
+        batch_size=1000,
+    )
+    # Older orders are not read again
+    CountedOrder.objects.filter(alias=state.alias, date__lt=read_at - overlap()).delete()
+    state.counted_until = read_at
+    return order_ids, item_ids, placed
+
+
+def cooccurrence(order_ids, item_ids, size):
+    """Upper triangle (with diagonal) of X.T @ X as a scipy COO matrix of shape size x size."""
+    import numpy as np
+    from scipy import sparse
+
+    _, rows = np.unique(order_ids, return_inverse=True)
+    baskets = sparse.csr_matrix(
+        (np.ones(len(rows), dtype=np.int64), (rows, item_ids)),
+        shape=(rows.max() + 1 if len(rows) else 0, size),
+    )
+    # An item counts once per order, however many lines it has
+    baskets.data[:] = 1
+    return sparse.triu(baskets.T @ baskets).tocoo()
+
+
+def stored_counts(size):
+    import numpy as np
+    from scipy import sparse
+
+    rows = MenuItemPairCount.objects.values_list('item_id', 'other_id', 'count')
+    if not rows:
+        return sparse.coo_matrix((size, size), dtype=np.int64)
+    item, other, count = np.array(list(rows), dtype=np.int64).T
+    keep = (item < size) & (other < size)
+    return sparse.coo_matrix((count[keep], (item[keep], other[keep])), shape=(size, size))
+
+
+def neighbours(counts, k, min_count=1):
+    """
+    Top-k (item, other, score) rows of the cosine similarity
+    count(i, j) / sqrt(count(i) * count(j)), in (item, rank) order.
+    """
+    import numpy as np
+    from scipy import sparse
+
+    counts = counts.tocsr()
+    diagonal = counts.diagonal().astype(np.float64)
+    pairs = sparse.triu(counts, k=1).tocoo()
+    strong = pairs.data >= min_count
+    row, col, data = pairs.row[strong], pairs.col[strong], pairs.data[strong]
+    # Both directions of every pair
+    item = np.concatenate([row, col]).astype(np.int64)
+    other = np.concatenate([col, row]).astype(np.int64)
+    together = np.concatenate([data, data]).astype(np.float64)
+    score = together / np.sqrt(diagonal[item] * diagonal[other])
+
+    # Sort by item, then score descending (ties by id), and keep the first k of each item
+    order = np.lexsort((other, -score, item))
+    item, other, score = item[order], other[order], score[order]
+    rank = np.arange(len(item)) - np.searchsorted(item, item, side='left')
+    keep = rank < k
+    return item[keep], other[keep], score[keep], rank[keep]
+
+
+def build(full=False, k=None, min_count=1, chunk_size=10000):
+    """Update pair counts from new orders of every shard and rewrite the top-k table."""
+    import numpy as np
+    from scipy import sparse
+
+    k = k or top_k()
+    menu_ids = np.array(MenuItem.objects.order_by('pk').values_list('pk', flat=True), dtype=np.int64)
+    size = int(menu_ids.max()) + 1 if len(menu_ids) else 1
+
+    with transaction.atomic(using=DEFAULT_DB_ALIAS):
+        if full:
+            MenuItemPairCount.objects.all().delete()
+            RecommendationState.objects.all().delete()
+            CountedOrder.objects.all().delete()
+        states = {state.alias: state for state in RecommendationState.objects.select_for_update()}
+
+        delta = sparse.coo_matrix((size, size), dtype=np.int64)
+        orders_read = 0
+        for alias in shard_aliases():
+            state = states.get(alias) or RecommendationState(alias=alias)
+            order_ids, item_ids, placed = read_new_orders(state, chunk_size)
+            # Lines of menu items deleted since are dropped
+            known = np.isin(item_ids, menu_ids)
+            if known.any():
+                delta = delta + cooccurrence(order_ids[known], item_ids[known], size)
+            orders_read += len(placed)
+            state.save(using=DEFAULT_DB_ALIAS)
+
+        counts = (stored_counts(size) + delta).tocsr()
+        changed = delta.tocoo()
+        if changed.nnz:
+            totals = np.asarray(counts[changed.row, changed.col]).ravel()
+            MenuItemPairCount.objects.bulk_create(
+                [
+                    MenuItemPairCount(item_id=int(i), other_id=int(j), count=int(c))
+                    for i, j, c in zip(changed.row, changed.col, totals)
+                ],
+                batch_size=1000,
+                update_conflicts=True,
+                unique_fields=['item', 'other'],
+                update_fields=['count'],
+            )
+
+        item, other, score, rank = neighbours(counts, k, min_count)
+        MenuItemRecommendation.objects.all().delete()
+        MenuItemRecommendation.objects.bulk_create(
+            [
+                MenuItemRecommendation(menuitem_id=int(i), recommended_id=int(j), score=float(s), rank=int(r))
+                for i, j, s, r in zip(item, other, score, rank)
+            ],
+            batch_size=1000,
+        )
+        transaction.on_commit(bump_recommendations_version, using=DEFAULT_DB_ALIAS)
+
+    return {'orders': orders_read, 'pairs_changed': changed.nnz, 'recommendations': len(item)}
+
+
+def bump_recommendations_version():
+    try:
+        cache.incr(RECOMMENDATIONS_VERSION_KEY)
+    except ValueError:
+        cache.set(RECOMMENDATIONS_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+# Serving
+
+class RecommendationIndex:
+    """
+    The top-k table as flat arrays: item ids (sorted), the offset of each
+    item's neighbours, and the neighbour ids and scores, in rank order.
+    About 12 bytes per recommendation.
+    """
+
+    def __init__(self, rows):
+        self.items = array('q')
+        self.offsets = array('L', [0])
+        self.others = array('q')
+        self.scores = array('f')
+        for menuitem_id, recommended_id, score in rows:
+            if not self.items or self.items[-1] != menuitem_id:
+                if self.items:
+                    self.offsets.append(len(self.others))
+                self.items.append(menuitem_id)
+            self.others.append(recommended_id)
+            self.scores.append(score)
+        if self.items:
+            self.offsets.append(len(self.others))
+
+    @classmethod
+    def load(cls):
+        rows = MenuItemRecommendation.objects.order_by('menuitem_id', 'rank').values_list(
+            'menuitem_id', 'recommended_id', 'score',
+        )
+        return cls(rows.iterator(chunk_size=10000))
+
+    def __len__(self):
+        return len(self.others)
+
+    def neighbours(self, menuitem_id, limit=None):
+        """[(menu item id, score)] for one item, best first."""
+        position = bisect_left(self.items, menuitem_id)
+        if position == len(self.items) or self.items[position] != menuitem_id:
+            return []
+        start, stop = self.offsets[position], self.offsets[position + 1]
+        if limit is not None:
+            stop = min(stop, start + limit)
+        return list(zip(self.others[start:stop], self.scores[start:stop]))
+
+    def suggest(self, menuitem_ids, limit=None):
+        """Items most often ordered with any of menuitem_ids (summed scores), excluding them."""
+        menuitem_ids = set(menuitem_ids)
+        totals = {}
+        for menuitem_id in menuitem_ids:
+            for other, score in self.neighbours(menuitem_id):
+                if other not in menuitem_ids:
+                    totals[other] = totals.get(other, 0.0) + score
+        ranked = sorted(totals.items(), key=lambda pair: (-pair[1], pair[0]))
+        return ranked if limit is None else ranked[:limit]
+
+
+_index = None
+_index_version = None
+_index_lock = threading.Lock()
+
+
+def get_index():
+    """This worker's RecommendationIndex, reloaded after every build."""
+    global _index, _index_version
+    version = cache.get(RECOMMENDATIONS_VERSION_KEY)
+    if _index is None or version != _index_version:
+        with _index_lock:
+            if _index is None or version != _index_version:
+                _index = RecommendationIndex.load()
+                _index_version = version
+    return _index
@@ -0,0 +1,127 @@
+"""
+Retention policies: rows nobody will read again, deleted in batches.
+
+- carts: lines of carts not touched for CARTS days (a cart any line of
+  which changed since is kept whole), on every shard;
+- tokens: auth tokens neither used (see TokenUse) nor logged in with
+  for TOKENS days (logging in again issues a new one);
+- sessions: sessions expired more than SESSIONS days ago.
+
+A policy set to None is skipped. Each batch selects at most BATCH_SIZE
+primary keys and deletes them in its own short transaction, then sleeps
+PAUSE seconds, so writers are never locked out for long.
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from .cache import clear_cart_snapshot
+from .models import Cart
+from .sharding import shard_aliases
+
+DEFAULTS = {
+    'CARTS': 30,     # days
+    'TOKENS': 90,    # days
+    'SESSIONS': 0,   # days after expiry
+    'BATCH_SIZE': 500,
+    'PAUSE': 0.1,    # seconds between batches
+    'TOKEN_USE_INTERVAL': 3600,  # seconds between TokenUse updates of a token
+}
+
+POLICIES = ('carts', 'tokens', 'sessions')
+
+
+def get_setting(name):
+    return getattr(settings, 'RETENTION', {}).get(name, DEFAULTS[name])
+
+
+def abandoned_carts(using, cutoff):
+    touched = Cart.objects.using(using).filter(user=OuterRef('user'), updated_at__gte=cutoff)
+    return Cart.objects.using(using).filter(updated_at__lt=cutoff).exclude(Exists(touched))
+
+
+def stale_tokens(cutoff):
+    # Token authentication does not update last_login: API clients are kept by their TokenUse
+    return Token.objects.filter(created__lt=cutoff).exclude(use__last_used__gte=cutoff).filter(
+        Q(user__last_login__isnull=True) | Q(user__last_login__lt=cutoff)
+    )
+
+
+def expired_sessions(cutoff):
+    return Session.objects.filter(expire_date__lt=cutoff)
+
+
+def purge_batches(queryset, batch_size, pause, deleted=None):
+    """
+    Delete the rows of queryset batch_size at a time; returns (rows, batches).
+    deleted(user_ids) is called with the users of each deleted batch.
+    """
+    fields = ['pk', 'user_id'] if deleted else ['pk']
+    rows = batches = 0
+    while True:
+        with transaction.atomic(using=queryset.db):
+            batch = list(queryset.values_list(*fields)[:batch_size])
+            if not batch:
+                return rows, batches
+            # Rows cascaded to (a token's TokenUse) are not counted
+            _, counts = queryset.model.objects.using(queryset.db).filter(pk__in=[row[0] for row in batch]).delete()
+            if deleted:
+                deleted({row[1] for row in batch})
+        rows += counts.get(queryset.model._meta.label, 0)
+        batches += 1
+        if len(batch) < batch_size:
+            return rows, batches
+        time.sleep(pause)
+
+
+def cart_snapshot_clearer(using):
+    def clear(user_ids):
+        for user_id in user_ids:
+            clear_cart_snapshot(user_id, using)
+    return clear
+
+
+def querysets(policy, now):
+    """(queryset, deleted callback) per database the policy applies to"""
+    days = get_setting(policy.upper())
+    if days is None:
+        return []
+    cutoff = now - timedelta(days=days)
+    if policy == 'carts':
+        return [(abandoned_carts(using, cutoff), cart_snapshot_clearer(using)) for using in shard_aliases()]
+    if policy == 'tokens':
+        return [(stale_tokens(cutoff), None)]
+    return [(expired_sessions(cutoff), None)]
+
+
+def purge(policies=POLICIES, batch_size=None, pause=None, dry_run=False):
+    """
+    Apply the retention policies and report per policy and database:
+    [{'policy', 'database', 'rows', 'batches', 'seconds'}]. With dry_run,
+    rows counts what would be deleted.
+    """
+    batch_size = batch_size or get_setting('BATCH_SIZE')
+    pause = get_setting('PAUSE') if pause is None else pause
+    now = timezone.now()
+    report = []
+    for policy in policies:
+        for queryset, deleted in querysets(policy, now):
+            started = time.perf_counter()
+            if dry_run:
+                rows, batches = queryset.count(), 0
+            else:
+                rows, batches = purge_batches(queryset, batch_size, pause, deleted)
+            report.append({
+                'policy': policy,
+                'database': queryset.db or DEFAULT_DB_ALIAS,
+                'rows': rows,
+                'batches': batches,
+                'seconds': round(time.perf_counter() - started, 3),
+            })
+    return report
@@ -0,0 +1,43 @@
+from django.db import DEFAULT_DB_ALIAS
+
+from .sharding import is_sharded, shard_for_location_id
+
+
+class LocationShardRouter:
+    """
+    Orders, order items and carts are read from and written to the database
+    of their location (settings.LOCATION_SHARDS). The menu catalog, users and
+    everything else stay in the default database.
+
+    Querysets without an instance to go by use .using(alias) explicitly
+    (see sharding.shard_for); migrations run on every alias.
+    """
+
+    def db_for_read(self, model, **hints):
+        if not is_sharded(model):
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        if isinstance(instance, model):
+            if instance._state.adding:
+                return self.shard_for_new(instance)
+            return instance._state.db
+        if instance is not None and is_sharded(type(instance)):
+            # Related rows of a shard row, e.g. order.items
+            return instance._state.db
+        return None
+
+    def shard_for_new(self, instance):
+        # Assigning a related object stamps _state.db with that object's
+        # database, so an unsaved row is placed by its location instead.
+        if getattr(instance, 'location_id', None) is not None:
+            return shard_for_location_id(instance.location_id)
+        order = instance._state.fields_cache.get('order')
+        if order is not None:
+            return order._state.db
+        return None
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Shard rows point at users and menu items in the default database
+        return True
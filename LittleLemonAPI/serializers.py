@@ -1,15 +1,117 @@
-from rest_framework import serializers
-from .models import Category, MenuItem, Cart, Order, OrderItem, Rating
+from rest_framework import permissions, serializers
+from .models import Category, MenuItem, Cart, Order, OrderItem, Rating, Location
+from .sharding import location_slug
 from django.contrib.auth.models import User, Group
-from django.core.exceptions import ValidationError
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Prefetch
 
 
+def split_param(value):
+    return {name.strip() for name in (value or '').split(',') if name.strip()}
+
+class SparseFieldsetMixin:
+    """
+    On GET, ?fields=a,b keeps only those fields and ?exclude=c drops some.
+    prune_queryset() then loads only the columns and relations the kept
+    fields read.
+    """
+    # Attributes read by SerializerMethodFields, which have no source
+    method_field_sources = {}
+
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        if request is None or request.method not in permissions.SAFE_METHODS:
+            return fields
+        wanted = split_param(request.query_params.get('fields'))
+        excluded = split_param(request.query_params.get('exclude'))
+        unknown = (wanted | excluded) - fields.keys()
+        if unknown:
+            raise serializers.ValidationError({'fields': f"Unknown field(s): {', '.join(sorted(unknown))}"})
+        return {
+            name: field for name, field in fields.items()
+            if (not wanted or name in wanted) and name not in excluded
+        }
+
+    def prune_queryset(self, queryset, keep=()):
+        """only() the columns the fields (and `keep`) read; join or prefetch only the relations they use"""
+        meta = queryset.model._meta
+        columns, joins, prefetches = {meta.pk.name, *keep}, {}, {}
+        # Rows are ordered (and merged across shards) by these
+        for ordering in queryset.query.order_by or meta.ordering:
+            if isinstance(ordering, str) and '__' not in ordering:
+                columns.add(ordering.lstrip('-'))
+
+        for name, field in self.fields.items():
+            sources = self.method_field_sources.get(name, []) if field.source == '*' else [field.source]
+            for source in sources:
+                attr, _, rest = source.partition('.')
+                if attr in queryset.query.annotations:
+                    continue
+                try:
+                    model_field = meta.get_field(attr)
+                except FieldDoesNotExist:
+                    # A property or method: no telling what it reads
+                    return queryset
+                if model_field.many_to_one or (model_field.one_to_one and model_field.concrete):
+                    columns.add(attr)
+                    if rest:
+                        joins.setdefault(attr, set()).add(rest.replace('.', '__'))
+                elif model_field.is_relation:
+                    prefetches.setdefault(attr, None)
+                    # Relations of a nested serializer, e.g. items -> menuitem.title
+                    child = getattr(field, 'child', None)
+                    for child_field in getattr(child, 'fields', {}).values():
+                        if '.' in child_field.source:
+                            relation, column = child_field.source.split('.', 1)
+                            related_model = model_field.related_model._meta.get_field(relation).related_model
+                            prefetch = prefetches.setdefault(f'{attr}__{relation}', (related_model, set()))
+                            prefetch[1].add(column.replace('.', '__'))
+                else:
+                    columns.add(attr)
+
+        for relation, related_columns in joins.items():
+            if queryset.db == DEFAULT_DB_ALIAS:
+                queryset = queryset.select_related(relation)
+                columns.update(f'{relation}__{column}' for column in related_columns)
+            else:
+                # Users and menu items are not in the shard databases
+                related_model = meta.get_field(relation).related_model
+                queryset = queryset.prefetch_related(
+                    Prefetch(relation, queryset=related_model.objects.only(*related_columns))
+                )
+        for lookup, related in sorted(prefetches.items()):
+            if related is None:
+                queryset = queryset.prefetch_related(lookup)
+            else:
+                related_model, related_columns = related
+                queryset = queryset.prefetch_related(
+                    Prefetch(lookup, queryset=related_model.objects.only(*related_columns))
+                )
+        return queryset.only(*columns)
+
+class ShardedModelSerializer(serializers.ModelSerializer):
+    """
+    Creates through Model.save() rather than the default manager, so the
+    database router can place the row in its location's shard.
+    """
+    def create(self, validated_data):
+        instance = self.Meta.model(**validated_data)
+        instance.save()
+        return instance
+
+class LocationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Location
+        fields = ['id', 'slug', 'name']
+
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = ['id', 'title', 'slug']
 
-class MenuItemSerializer(serializers.ModelSerializer):
+class MenuItemSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     category_name = serializers.CharField(source='category.title', read_only=True)
     
     class Meta:
@@ -17,6 +119,15 @@ class MenuItemSerializer(serializers.ModelSerializer):
         fields = ['id', 'title', 'price', 'featured', 'category', 'category_name', 
                  'description', 'inventory', 'item_of_the_day']
 
+class MenuItemListSerializer(MenuItemSerializer):
+    """
+    Menu items in cached catalog responses (listings, bootstrap): without
+    inventory, which every order changes. The detail view has it.
+    """
+
+    class Meta(MenuItemSerializer.Meta):
+        fields = [field for field in MenuItemSerializer.Meta.fields if field != 'inventory']
+
 class ManagerListSerializer(serializers.ModelSerializer):
     class Meta():
         model = User
@@ -27,14 +138,19 @@ class CartHelpSerializer(serializers.ModelSerializer):
         model = MenuItem
         fields = ['id','title','price']
 
-class CartSerializer(serializers.ModelSerializer):
+class CartSerializer(SparseFieldsetMixin, ShardedModelSerializer):
+    method_field_sources = {'location': ['location']}
     menuitem_name = serializers.CharField(source='menuitem.title', read_only=True)
     menuitem_price = serializers.DecimalField(source='menuitem.price', max_digits=6, decimal_places=2, read_only=True)
+    location = serializers.SerializerMethodField()
     
     class Meta:
         model = Cart
-        fields = ['id', 'menuitem', 'menuitem_name', 'menuitem_price', 'quantity', 'unit_price', 'price']
+        fields = ['id', 'menuitem', 'menuitem_name', 'menuitem_price', 'quantity', 'unit_price', 'price', 'location']
         read_only_fields = ['unit_price', 'price']
+
+    def get_location(self, obj):
+        return location_slug(obj.location_id)
         
 class CartAddSerializer(serializers.ModelSerializer):
     class Meta():
@@ -88,21 +204,40 @@ class OrderItemSerializer(serializers.ModelSerializer):
         model = OrderItem
         fields = ['id', 'menuitem', 'menuitem_name', 'quantity', 'unit_price', 'price']
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(SparseFieldsetMixin, ShardedModelSerializer):
+    method_field_sources = {'items_count': ['items'], 'location': ['location']}
     user = serializers.CharField(source='user.username', read_only=True)
     delivery_crew_name = serializers.CharField(source='delivery_crew.username', read_only=True)
     items = OrderItemSerializer(many=True, read_only=True)
     items_count = serializers.SerializerMethodField()
+    location = serializers.SerializerMethodField()
     
     class Meta:
         model = Order
         fields = ['id', 'user', 'delivery_crew', 'delivery_crew_name', 'status', 
-                 'total', 'date', 'items', 'items_count']
+                 'total', 'date', 'items', 'items_count', 'location']
         read_only_fields = ['user', 'total', 'date']
     
     def get_items_count(self, obj):
         return obj.items.count()
 
+    def get_location(self, obj):
+        # Order ids are per shard; clients pass this back as ?location=
+        return location_slug(obj.location_id)
+
+class OrderListSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    """Order history rows: no nested items, items_count is annotated on the queryset"""
+    method_field_sources = {'location': ['location']}
+    items_count = serializers.IntegerField(read_only=True)
+    location = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Order
+        fields = ['id', 'date', 'status', 'total', 'items_count', 'location']
+
+    def get_location(self, obj):
+        return location_slug(obj.location_id)
+
 class SingleHelperSerializer(serializers.ModelSerializer):
     class Meta():
         model = MenuItem
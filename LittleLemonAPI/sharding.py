@@ -0,0 +1,107 @@
+import heapq
+from itertools import islice
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework.exceptions import ValidationError
+
+# Models stored in the shard of their location; everything else is shared.
+SHARDED_MODELS = {'cart', 'order', 'orderitem'}
+
+_location_slugs = {}
+
+
+def is_sharded(model):
+    return model._meta.app_label == 'LittleLemonAPI' and model._meta.model_name in SHARDED_MODELS
+
+
+def shard_aliases():
+    """Every database holding orders and carts, 'default' first."""
+    return list(dict.fromkeys([DEFAULT_DB_ALIAS, *getattr(settings, 'LOCATION_SHARDS', {}).values()]))
+
+
+def shard_for(location):
+    """Database alias for a Location (or None, the default location)."""
+    if location is None:
+        return DEFAULT_DB_ALIAS
+    return getattr(settings, 'LOCATION_SHARDS', {}).get(location.slug, DEFAULT_DB_ALIAS)
+
+
+def location_slug(location_id):
+    """Slug of a location id, cached per process since locations rarely change."""
+    if location_id is None:
+        return None
+    if location_id not in _location_slugs:
+        from .models import Location
+        _location_slugs[location_id] = (
+            Location.objects.using(DEFAULT_DB_ALIAS).filter(pk=location_id).values_list('slug', flat=True).first()
+        )
+    return _location_slugs[location_id]
+
+
+def clear_location_cache(**kwargs):
+    _location_slugs.clear()
+
+
+def shard_for_location_id(location_id):
+    slug = location_slug(location_id)
+    if slug is None:
+        return DEFAULT_DB_ALIAS
+    return getattr(settings, 'LOCATION_SHARDS', {}).get(slug, DEFAULT_DB_ALIAS)
+
+
+def with_related(queryset, *fields):
+    """
+    select_related() on the default database, prefetch_related() on a shard:
+    a JOIN cannot reach users and menu items from a shard database.
+    """
+    if queryset.db == DEFAULT_DB_ALIAS:
+        return queryset.select_related(*fields)
+    return queryset.prefetch_related(*fields)
+
+
+def get_request_location(request):
+    """
+    The Location a request is about, from the `location` query parameter or
+    the X-Location header, or None when the client did not pick one.
+    """
+    from .models import Location
+
+    slug = request.query_params.get('location') or request.META.get('HTTP_X_LOCATION')
+    if not slug:
+        return None
+    location = Location.objects.filter(slug=slug).first()
+    if location is None:
+        raise ValidationError({'location': f'Unknown location {slug!r}'})
+    return location
+
+
+class MergedQuerySet:
+    """
+    Read-only union of one queryset per shard, each ordered by `key`
+    descending, that a paginator can count and slice. A page is built by
+    fetching at most `stop` rows from every shard and merging them.
+    """
+    ordered = True
+
+    def __init__(self, querysets, key):
+        self.querysets = querysets
+        self.key = key
+
+    def count(self):
+        return sum(queryset.count() for queryset in self.querysets)
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        return heapq.merge(*self.querysets, key=self.key, reverse=True)
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start, stop = index.start or 0, index.stop
+        if stop is None:
+            return list(islice(iter(self), start, None))
+        rows = heapq.merge(*(queryset[:stop] for queryset in self.querysets), key=self.key, reverse=True)
+        return list(islice(rows, start, stop))
@@ -0,0 +1,90 @@
+from django.contrib.auth.models import User
+from django.db import models, transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import autocomplete, metrics
+from .cache import bump_catalog_version
+from .catalog_sync import record_changes
+from .models import Category, Location, MenuItem
+from .sharding import clear_location_cache, is_sharded, shard_aliases
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=MenuItem)
+@receiver(post_delete, sender=MenuItem)
+@receiver(m2m_changed, sender=MenuItem.locations.through)
+def catalog_changed(sender, using=None, **kwargs):
+    # Once the change commits: a request rebuilding before then would cache
+    # the old data under the new version
+    transaction.on_commit(bump_catalog_version, using=using)
+    autocomplete.invalidate()
+
+
+@receiver(post_save, sender=Location)
+@receiver(post_delete, sender=Location)
+def location_changed(sender, using=None, **kwargs):
+    transaction.on_commit(clear_location_cache, using=using)
+    transaction.on_commit(bump_catalog_version, using=using)
+    autocomplete.invalidate()
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=MenuItem)
+def log_catalog_save(sender, instance, **kwargs):
+    record_changes(sender, [instance.pk])
+
+
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=MenuItem)
+def log_catalog_delete(sender, instance, **kwargs):
+    record_changes(sender, [instance.pk], deleted=True)
+
+
+@receiver(pre_delete, sender=User)
+@receiver(pre_delete, sender=MenuItem)
+@receiver(pre_delete, sender=Location)
+def delete_shard_rows(sender, instance, using, **kwargs):
+    """
+    Apply on_delete to the carts and orders of the other shards, which the
+    deletion (of `using` only) does not see and no constraint protects:
+    PROTECT is checked now, CASCADE and SET_NULL run once it commits.
+    """
+    # Hidden too: Cart.location and Order.location have no reverse accessor
+    relations = [
+        relation for relation in sender._meta.get_fields(include_hidden=True)
+        if relation.one_to_many and is_sharded(relation.related_model)
+    ]
+    aliases = [alias for alias in shard_aliases() if alias != using]
+    pk = instance.pk
+
+    def rows(alias, relation):
+        return relation.related_model._base_manager.using(alias).filter(**{relation.field.attname: pk})
+
+    for alias in aliases:
+        for relation in relations:
+            if relation.on_delete is models.PROTECT and rows(alias, relation).exists():
+                raise models.ProtectedError(
+                    f"Cannot delete {instance} because {relation.related_model.__name__} rows in {alias} "
+                    f"reference it through '{relation.field.name}'",
+                    set(rows(alias, relation)),
+                )
+
+    def cleanup():
+        for alias in aliases:
+            with transaction.atomic(using=alias):
+                for relation in relations:
+                    if relation.on_delete is models.CASCADE:
+                        rows(alias, relation).delete()
+                    elif relation.on_delete is models.SET_NULL:
+                        rows(alias, relation).update(**{relation.field.name: None})
+
+    if aliases and relations:
+        transaction.on_commit(cleanup, using=using)
+
+
+@receiver(connection_created)
+def count_request_queries(sender, connection, **kwargs):
+    metrics.install_query_counter(connection)
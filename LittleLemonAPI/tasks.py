@@ -0,0 +1,48 @@
+import logging
+
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from . import retention
+from .background import task
+from .catalog_sync import record_changes
+from .models import MenuItem, Order, OrderItem
+
+logger = logging.getLogger(__name__)
+
+
+@task
+def update_inventory(order_id, using=DEFAULT_DB_ALIAS):
+    """Take the ordered quantities off MenuItem.inventory."""
+    quantities = {}
+    for menuitem_id, quantity in OrderItem.objects.using(using).filter(order_id=order_id).values_list('menuitem_id', 'quantity'):
+        quantities[menuitem_id] = quantities.get(menuitem_id, 0) + quantity
+    if not quantities:
+        return
+    ordered = Case(*[When(pk=menuitem_id, then=Value(quantity)) for menuitem_id, quantity in quantities.items()])
+    with transaction.atomic():
+        MenuItem.objects.filter(pk__in=quantities).update(
+            inventory=Greatest(F('inventory') - ordered, Value(0)),
+            # The menu item's ETag (conditional GET) is read from updated_at
+            updated_at=timezone.now(),
+        )
+        # update() bypasses the post_save signals that log and invalidate the
+        # catalog. Only the sync log needs the change: cached catalog
+        # responses leave inventory out (MenuItemListSerializer), so every
+        # order does not have to throw them away.
+        record_changes(MenuItem, quantities)
+
+
+@task
+def notify_order_placed(order_id, using=DEFAULT_DB_ALIAS):
+    order = Order.objects.using(using).get(pk=order_id)
+    logger.info('Order #%s placed by %s: %s', order.id, order.user.username, order.total)
+
+
+@task(max_attempts=1)
+def purge_retention(policies=retention.POLICIES):
+    """Apply the retention policies (enqueue it durably from cron: purge_retention --enqueue)."""
+    for entry in retention.purge(policies):
+        logger.info('Retention %(policy)s on %(database)s: %(rows)s row(s) in %(batches)s batch(es), %(seconds)ss', entry)
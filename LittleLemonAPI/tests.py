@@ -1,7 +1,1490 @@
-from django.urls import path
-from . import views
+import gzip
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
 
-urlpatterns = [
-    path('category/', views.CategoryView.as_view(), name='category-list'),
-    path('menu-items/', views.MenuItemsView.as_view(), name='menu-items-list'),
-]
\ No newline at end of file
+from django.conf import settings
+from django.contrib.auth.models import Group, User
+from django.core.cache import cache
+from django.contrib.sessions.models import Session
+from django.core.management import call_command
+from django.db import connection, connections, models, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from . import admin as api_admin, autocomplete, catalog_sync, compression, forecasting, metrics, recommendations, retention
+from .filters import ORDER_FILTER_INDEXES, OrderFilter
+from .cache import bump_catalog_version, catalog_cache_key, catalog_flights, get_catalog_version
+from .models import (
+    BackgroundTask, Cart, CatalogChange, Category, Location, MenuItem, MenuItemPairCount, Order, OrderItem, TokenUse,
+)
+from .tasks import notify_order_placed
+from .views import MenuItemListCreateView
+
+
+def setUpModule():
+    # Request metrics go to a throwaway directory, not the project's METRICS['DIR']
+    global metrics_settings, metrics_directory
+    metrics_directory = tempfile.TemporaryDirectory()
+    metrics_settings = override_settings(METRICS={**settings.METRICS, 'DIR': Path(metrics_directory.name)})
+    metrics_settings.enable()
+
+
+def tearDownModule():
+    # Nothing left for the exit flush to write once the settings are restored
+    metrics.metrics = metrics.RequestMetrics(metrics.get_setting('BUCKETS'))
+    metrics_settings.disable()
+    metrics_directory.cleanup()
+
+
+class APITestCase(TestCase):
+    """Menu, users by role and an API client per user; the cache is cleared for every test."""
+    # Order lists and forecasts read every shard
+    databases = {'default', *settings.LOCATION_SHARDS.values()}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.mains = Category.objects.create(slug='mains', title='Mains')
+        cls.desserts = Category.objects.create(slug='desserts', title='Desserts')
+        cls.pasta = MenuItem.objects.create(title='Pasta', price=Decimal('12.50'), category=cls.mains, inventory=10)
+        cls.tiramisu = MenuItem.objects.create(title='Tiramisu', price=Decimal('6.00'), category=cls.desserts)
+        cls.manager = cls.make_user('manager', 'Manager')
+        cls.crew = cls.make_user('crew', 'Delivery crew')
+        cls.customer = cls.make_user('customer')
+        cls.other_customer = cls.make_user('other')
+
+    @classmethod
+    def make_user(cls, username, *groups):
+        user = User.objects.create_user(username, f'{username}@example.com', 'lemon-pass-123')
+        for name in groups:
+            user.groups.add(Group.objects.get_or_create(name=name)[0])
+        return user
+
+    def setUp(self):
+        cache.clear()
+
+    def client_for(self, user=None):
+        client = APIClient()
+        if user is not None:
+            client.force_authenticate(user)
+        return client
+
+
+class ConditionalGetTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.order = Order.objects.create(user=cls.customer, delivery_crew=cls.crew, total=Decimal('12.50'))
+
+    def revalidate(self, client, url, etag, queries):
+        with self.assertNumQueries(queries):
+            return client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_menu_item_not_modified_reads_only_the_validators(self):
+        client = self.client_for()
+        url = reverse('menu_item_detail', args=[self.pasta.pk])
+        etag = client.get(url)['ETag']
+
+        response = self.revalidate(client, url, etag, 1)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(response.content)
+
+    def test_menu_item_etag_changes_with_its_category(self):
+        client = self.client_for()
+        url = reverse('menu_item_detail', args=[self.pasta.pk])
+        etag = client.get(url)['ETag']
+
+        self.mains.title = 'Main courses'
+        self.mains.save()
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['category_name'], 'Main courses')
+
+    def test_order_not_modified_for_its_owner(self):
+        client = self.client_for(self.customer)
+        url = reverse('order_detail', args=[self.order.pk])
+        etag = client.get(url)['ETag']
+
+        # The roles are cached on the authenticated user: the validators only
+        response = self.revalidate(client, url, etag, 1)
+        self.assertEqual(response.status_code, 304)
+
+    def test_not_modified_is_refused_without_object_permission(self):
+        # Delivery crew can list the order assigned to them, but not read it
+        url = reverse('order_detail', args=[self.order.pk])
+        etag = self.client_for(self.customer).get(url)['ETag']
+
+        client = self.client_for(self.crew)
+        self.assertEqual(client.get(url).status_code, 403)
+        self.assertEqual(client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 403)
+
+    def test_missing_object_is_not_found(self):
+        client = self.client_for()
+        url = reverse('menu_item_detail', args=[self.tiramisu.pk + 100])
+        self.assertEqual(client.get(url, HTTP_IF_NONE_MATCH='"stale"').status_code, 404)
+
+    def test_category_list_not_modified(self):
+        client = self.client_for()
+        url = reverse('categories')
+        etag = client.get(url)['ETag']
+
+        response = self.revalidate(client, url, etag, 1)
+        self.assertEqual(response.status_code, 304)
+        Category.objects.create(slug='drinks', title='Drinks')
+        self.assertEqual(client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+
+class SparseFieldsetTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.order = Order.objects.create(user=cls.customer, total=Decimal('12.50'))
+        OrderItem.objects.create(order=cls.order, menuitem=cls.pasta, unit_price=Decimal('12.50'), price=Decimal('12.50'))
+
+    def page_query(self, params):
+        with CaptureQueriesContext(connection) as captured:
+            self.assertEqual(self.client_for().get(reverse('menu_items'), params).status_code, 200)
+        cache.clear()
+        return next(query['sql'] for query in captured if 'LIMIT' in query['sql'])
+
+    def test_menu_items_read_only_the_requested_columns(self):
+        full = self.page_query({})
+        self.assertIn('"LittleLemonAPI_menuitem"."price"', full)
+        self.assertIn('JOIN "LittleLemonAPI_category"', full)
+
+        sparse = self.page_query({'fields': 'id,title'})
+        self.assertTrue(sparse.startswith(
+            'SELECT "LittleLemonAPI_menuitem"."id", "LittleLemonAPI_menuitem"."title" FROM'
+        ), sparse)
+        self.assertNotIn('JOIN', sparse)
+
+    def test_order_without_items_skips_their_queries(self):
+        client = self.client_for(self.customer)
+        url = reverse('order_detail', args=[self.order.pk])
+        client.get(url)  # caches the roles
+
+        # validators, order (joined to its users), items, their menu items
+        with self.assertNumQueries(4):
+            client.get(url)
+        with self.assertNumQueries(3):  # items_count still counts the lines
+            self.assertNotIn('items', client.get(url, {'exclude': 'items'}).json())
+        with self.assertNumQueries(2):
+            self.assertEqual(client.get(url, {'fields': 'id,status'}).json(), {'id': self.order.pk, 'status': 'pending'})
+
+    def test_unknown_field_is_rejected(self):
+        response = self.client_for().get(reverse('menu_items'), {'fields': 'title,secret'})
+        self.assertEqual(response.status_code, 400)
+
+
+class OrderFilterPlanTests(APITestCase):
+    def params(self, dimensions):
+        values = {
+            'status': {'status': 'pending'},
+            'date': {'date_after': '2024-01-01', 'date_before': '2024-01-31'},
+            'delivery_crew': {'delivery_crew': self.crew.pk},
+            'customer': {'customer': self.customer.pk},
+            'total': {'total_min': 50},
+        }
+        return {key: value for dimension in dimensions for key, value in values[dimension].items()}
+
+    @skipUnless(connection.vendor == 'sqlite', 'reads SQLite query plans')
+    def test_every_filter_combination_is_served_by_its_index(self):
+        request = mock.Mock(user=self.manager)
+        for dimensions, index in ORDER_FILTER_INDEXES.items():
+            with self.subTest(filters='+'.join(sorted(dimensions))):
+                filterset = OrderFilter(self.params(dimensions), queryset=Order.objects.all(), request=request)
+                self.assertTrue(filterset.is_valid(), filterset.errors)
+                plan = filterset.qs[:10].explain()
+                self.assertIn(f'INDEX {index}', plan)
+                self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_unsupported_combination_is_rejected(self):
+        client = self.client_for(self.manager)
+        response = client.get(reverse('orders'), self.params({'total', 'status'}))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Unsupported filter combination', response.json()['filters'])
+
+    def test_endpoints_have_no_new_full_scans(self):
+        call_command('explain_endpoints', '--check', stdout=StringIO())
+
+
+class UserListingTests(APITestCase):
+    """Group member listings among 10,000 users"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        User.objects.bulk_create(
+            User(username=f'user{number:05}', email=f'User{number:05}@Example.com', password='!')
+            for number in range(10_000)
+        )
+        crew_group = Group.objects.get(name='Delivery crew')
+        managers = Group.objects.get(name='Manager')
+        Membership = User.groups.through
+        Membership.objects.bulk_create(
+            Membership(user=user, group=group)
+            for number, user in enumerate(User.objects.filter(username__startswith='user').order_by('username'))
+            if number % 250 == 0
+            for group in ([crew_group, managers] if number % 1000 == 0 else [crew_group])
+        )
+
+    def setUp(self):
+        super().setUp()
+        self.client = self.client_for(self.manager)
+        self.client.get(reverse('delivery_crew_list'))  # caches the roles
+
+    def test_crew_pages_take_the_same_queries(self):
+        url = reverse('delivery_crew_list')
+        for params in ({}, {'page': 2}, {'page_size': 100}):
+            # count, page, groups of the page
+            with self.subTest(**params), self.assertNumQueries(3):
+                response = self.client.get(url, params)
+            self.assertEqual(response.json()['count'], 41)
+        self.assertEqual(len(response.json()['results']), 41)
+        groups = {user['username']: user['groups'] for user in response.json()['results']}
+        self.assertCountEqual(groups['user00000'], ['Delivery crew', 'Manager'])
+        self.assertEqual(groups['user00250'], ['Delivery crew'])
+
+    def test_crew_filters(self):
+        url = reverse('delivery_crew_list')
+        for params, usernames in (
+            ({'username': 'user00250'}, ['user00250']),
+            ({'email': 'user00500@example.com'}, ['user00500']),
+            ({'search': 'user002'}, ['user00250']),
+            ({'username': 'user00001'}, []),
+        ):
+            with self.subTest(**params), self.assertNumQueries(3 if usernames else 1):
+                results = self.client.get(url, params).json()['results']
+            self.assertEqual([user['username'] for user in results], usernames)
+
+    def test_managers_take_the_same_queries(self):
+        # group, count, page, groups of the page
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('manager_group_access'))
+        self.assertEqual(response.json()['count'], 11)
+        self.assertEqual(len(response.json()['managers']), 10)
+
+
+class BatchAssignTests(APITestCase):
+    url = reverse('assign_orders_delivery')
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.order = Order.objects.create(user=cls.customer, total=Decimal('12.50'))
+
+    def assign(self, delivery_crew_id):
+        return self.client_for(self.manager).patch(
+            self.url, {'orders': [self.order.pk], 'delivery_crew_id': delivery_crew_id}, format='json'
+        )
+
+    def test_crew_id_must_be_a_whole_number(self):
+        for value in ('abc', '1.5', [1], -3):
+            with self.subTest(value=value):
+                response = self.assign(value)
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('delivery_crew_id', response.json())
+        self.assertEqual(self.assign(None).json(), {'error': 'delivery_crew_id is required'})
+
+    def test_numeric_string_is_accepted(self):
+        response = self.assign(str(self.crew.pk))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['updated'], 1)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.delivery_crew, self.crew)
+
+
+class CatalogCacheTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.uptown = Location.objects.create(slug='uptown', name='Uptown')
+        Location.objects.create(slug='midtown', name='Midtown')
+        cls.tiramisu.locations.add(cls.uptown)
+
+    def titles(self, response):
+        return [item['title'] for item in response.json()['results']]
+
+    def test_location_header_is_part_of_the_key(self):
+        client = self.client_for()
+        url = reverse('menu_items')
+        self.assertEqual(self.titles(client.get(url, HTTP_X_LOCATION='midtown')), ['Pasta'])
+
+        response = client.get(url, HTTP_X_LOCATION='uptown')
+        self.assertEqual(self.titles(response), ['Pasta', 'Tiramisu'])
+        self.assertIn('X-Location', response['Vary'])
+        self.assertEqual(self.titles(client.get(url, {'location': 'midtown'}, HTTP_X_LOCATION='uptown')), ['Pasta'])
+
+    def test_catalog_version_moves_once_the_change_commits(self):
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pasta.price = Decimal('13.00')
+            self.pasta.save()
+            self.assertEqual(get_catalog_version(), version)
+        self.assertNotEqual(get_catalog_version(), version)
+
+    def test_rolled_back_change_keeps_the_catalog_version(self):
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                Category.objects.create(slug='drinks', title='Drinks')
+                raise RuntimeError
+        self.assertEqual(callbacks, [])
+        self.assertEqual(get_catalog_version(), version)
+
+    def test_cached_response_varies_on_location(self):
+        client = self.client_for()
+        client.get(reverse('categories'))
+        with self.assertNumQueries(1):  # the list validators
+            response = client.get(reverse('categories'))
+        self.assertIn('X-Location', response['Vary'])
+
+
+@override_settings(COMPRESSION_MIN_SIZE=200)
+class CompressionTests(APITestCase):
+    def decode(self, response):
+        encoding = response.get('Content-Encoding')
+        if encoding is None:
+            return response.content
+        if encoding == 'gzip':
+            return gzip.decompress(response.content)
+        if encoding == 'zstd':
+            return compression.zstd.decompress(response.content)
+        return compression.brotli.decompress(response.content)
+
+    def test_negotiation(self):
+        best = compression.available_encodings()[0]
+        self.assertIsNone(compression.negotiate(''))
+        self.assertIsNone(compression.negotiate('identity'))
+        self.assertIsNone(compression.negotiate('gzip;q=0'))
+        self.assertEqual(compression.negotiate('gzip'), 'gzip')
+        self.assertEqual(compression.negotiate('*'), best)
+        self.assertEqual(compression.negotiate('gzip;q=1, *;q=0.5'), 'gzip')
+        self.assertIsNone(compression.negotiate('br', ['gzip']))
+
+    def test_catalog_is_served_precompressed(self):
+        client = self.client_for()
+        url = reverse('menu_items')
+        plain = client.get(url).content
+        self.assertGreaterEqual(len(plain), 200)
+
+        best = compression.available_encodings()[0]
+        with mock.patch.object(compression, 'compress', side_effect=AssertionError('compressed again')), \
+                mock.patch.object(compression, 'compress_padded', side_effect=AssertionError('compressed again')):
+            response = client.get(url, HTTP_ACCEPT_ENCODING='gzip, br, zstd')
+        self.assertEqual(response['Content-Encoding'], best)
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertEqual(self.decode(response), plain)
+        self.assertEqual(response['Content-Length'], str(len(response.content)))
+
+    def test_other_json_is_gzipped_with_padding(self):
+        for number in range(5):
+            Order.objects.create(user=self.customer, total=Decimal(number))
+        client = self.client_for(self.customer)
+        url = reverse('orders')
+        plain = client.get(url).content
+
+        self.assertNotIn('Content-Encoding', client.get(url, HTTP_ACCEPT_ENCODING='br'))
+        sizes = set()
+        for _ in range(10):
+            response = client.get(url, HTTP_ACCEPT_ENCODING='gzip, br')
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            self.assertIn('Accept-Encoding', response['Vary'])
+            self.assertEqual(self.decode(response), plain)
+            sizes.add(len(response.content))
+        self.assertGreater(len(sizes), 1)
+
+    def test_html_is_not_compressed(self):
+        response = self.client_for(self.customer).get(
+            reverse('orders'), HTTP_ACCEPT='text/html', HTTP_ACCEPT_ENCODING='gzip, br'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('csrfmiddlewaretoken', response.content.decode())
+        self.assertNotIn('Content-Encoding', response)
+
+    @override_settings(COMPRESSION_MIN_SIZE=1_000_000)
+    def test_small_bodies_are_sent_as_is(self):
+        response = self.client_for().get(reverse('menu_items'), HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertNotIn('Content-Encoding', response)
+        self.assertNotIn('Accept-Encoding', response.get('Vary', ''))
+
+
+class CatalogStampedeTests(APITestCase):
+    url = reverse('menu_items')
+
+    def test_failed_rebuild_releases_the_flight_and_the_lock(self):
+        client = self.client_for()
+        with mock.patch.object(MenuItemListCreateView, 'list', side_effect=RuntimeError), \
+                self.assertRaises(RuntimeError):
+            client.get(self.url)
+        self.assertEqual(catalog_flights.flights, {})
+
+        # A leaked lock would have the next request wait for another process
+        with mock.patch('LittleLemonAPI.cache.wait_for_entry', side_effect=AssertionError('lock left behind')):
+            self.assertEqual(client.get(self.url).status_code, 200)
+
+    def test_stale_body_is_sent_without_an_etag(self):
+        client = self.client_for()
+        url = reverse('categories')
+        keys = []
+        with mock.patch('LittleLemonAPI.cache.catalog_cache_key',
+                        side_effect=lambda request: keys.append(catalog_cache_key(request)) or keys[-1]):
+            etag = client.get(url)['ETag']
+
+        # Another worker rebuilds while a category is added
+        cache.add('%s:lock' % keys[0], 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(slug='drinks', title='Drinks')
+        for headers in ({}, {'HTTP_IF_NONE_MATCH': etag}):
+            response = client.get(url, **headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.json()['results']), 2)
+            self.assertFalse(response.has_header('ETag'))
+
+        cache.delete('%s:lock' % keys[0])
+        response = client.get(url)
+        self.assertEqual(len(response.json()['results']), 3)
+        self.assertEqual(client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_concurrent_requests_during_a_catalog_change_rebuild_once(self):
+        stale = self.client_for().get(self.url).json()
+        bump_catalog_version()
+        self.pasta.title = 'Penne'
+        self.pasta.save(update_fields=['title'])
+        responses, queries = [], []
+
+        def follower():
+            try:
+                with CaptureQueriesContext(connection) as captured:
+                    response = self.client_for().get(self.url)
+                responses.append((response.status_code, response.json()))
+                queries.append(len(captured))
+            finally:
+                connections.close_all()
+
+        rebuild = MenuItemListCreateView.list
+
+        def list_while_others_arrive(view, request, *args, **kwargs):
+            threads = [threading.Thread(target=follower) for _ in range(20)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            return rebuild(view, request, *args, **kwargs)
+
+        with mock.patch.object(MenuItemListCreateView, 'list', autospec=True,
+                               side_effect=list_while_others_arrive) as rebuilds:
+            fresh = self.client_for().get(self.url).json()
+
+        self.assertEqual(rebuilds.call_count, 1)
+        self.assertEqual(responses, [(200, stale)] * 20)
+        self.assertEqual(queries, [0] * 20)
+        self.assertEqual(fresh['results'][0]['title'], 'Penne')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client_for().get(self.url).json(), fresh)
+
+
+@override_settings(BACKGROUND_TASKS={'EAGER': True})
+class InventoryTests(APITestCase):
+    def checkout(self, user, menuitem, quantity):
+        client = self.client_for(user)
+        client.post(reverse('cart'), {'menuitem': menuitem.pk, 'quantity': quantity})
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post(reverse('orders'))
+        self.assertEqual(response.status_code, 201)
+
+    def test_checkout_takes_inventory_and_changes_the_etag(self):
+        client = self.client_for()
+        url = reverse('menu_item_detail', args=[self.pasta.pk])
+        etag = client.get(url)['ETag']
+
+        self.checkout(self.customer, self.pasta, 3)
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['inventory'], 7)
+
+    def test_checkout_keeps_the_catalog_cache(self):
+        client = self.client_for()
+        client.get(reverse('menu_items'))
+        version = get_catalog_version()
+
+        self.checkout(self.customer, self.pasta, 1)
+        self.assertEqual(get_catalog_version(), version)
+        with self.assertNumQueries(0):
+            response = client.get(reverse('menu_items'))
+        self.assertNotIn('inventory', response.json()['results'][0])
+
+
+class ForecastTests(APITestCase):
+    url = reverse('demand_forecasts')
+
+    def test_ids_must_be_whole_numbers(self):
+        client = self.client_for(self.manager)
+        for params in ({'category': 'abc'}, {'menuitem': 'xyz'}, {'menuitem': '1.5'}):
+            response = client.get(self.url, params)
+            self.assertEqual(response.status_code, 400, params)
+            self.assertIn(next(iter(params)), response.json())
+        self.assertIsNone(cache.get(forecasting.FORECASTS_CACHE_KEY))
+
+    def test_filtered_by_category(self):
+        response = self.client_for(self.manager).get(self.url, {'category': self.desserts.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['menuitem'] for result in response.json()['results']], [self.tiramisu.pk])
+
+    def test_concurrent_requests_build_once(self):
+        building, release = threading.Event(), threading.Event()
+
+        def slow_fit():
+            building.set()
+            release.wait(5)
+            return {'weeks': 1}
+
+        with mock.patch.object(forecasting, 'fit', side_effect=slow_fit) as fit:
+            results = []
+            threads = [threading.Thread(target=lambda: results.append(forecasting.get_forecast())) for _ in range(10)]
+            for thread in threads:
+                thread.start()
+            building.wait(5)
+            release.set()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(fit.call_count, 1)
+        self.assertEqual(len(results), 10)
+        self.assertTrue(all(result['weeks'] == 1 for result in results))
+
+    def test_waits_for_a_build_in_another_process(self):
+        cache.add(forecasting.FORECASTS_LOCK_KEY, 1)
+        with mock.patch.object(forecasting, 'fit') as fit, \
+                mock.patch.object(forecasting, 'wait_for_entry', return_value={'weeks': 2}):
+            self.assertEqual(forecasting.get_forecast(), {'weeks': 2})
+        fit.assert_not_called()
+        self.assertEqual(forecasting.forecast_flights.flights, {})
+
+
+@skipUnless('downtown' in settings.LOCATION_SHARDS, 'run with LITTLELEMON_SHARDS=downtown')
+@override_settings(BACKGROUND_TASKS={'EAGER': True})
+class ShardCheckoutTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.downtown = Location.objects.create(slug='downtown', name='Downtown')
+
+    def test_tasks_run_once_the_shard_commits(self):
+        client = self.client_for(self.customer)
+        client.post(reverse('cart') + '?location=downtown', {'menuitem': self.pasta.pk, 'quantity': 2})
+        with self.captureOnCommitCallbacks(using='shard_downtown') as callbacks:
+            response = client.post(reverse('orders') + '?location=downtown')
+        self.assertEqual(response.status_code, 201)
+        self.pasta.refresh_from_db()
+        self.assertEqual(self.pasta.inventory, 10)
+
+        with self.assertNoLogs('LittleLemonAPI.background'):
+            for callback in callbacks:
+                callback()
+        self.pasta.refresh_from_db()
+        self.assertEqual(self.pasta.inventory, 8)
+        self.assertTrue(Order.objects.using('shard_downtown').filter(pk=response.json()['id']).exists())
+
+    @override_settings(BACKGROUND_TASKS={'DURABLE': True})
+    def test_durable_task_is_not_stored_when_the_shard_rolls_back(self):
+        with self.assertRaises(RuntimeError), transaction.atomic(using='shard_downtown'):
+            notify_order_placed.delay(1, using='shard_downtown', commit_using='shard_downtown')
+            raise RuntimeError
+        self.assertFalse(BackgroundTask.objects.exists())
+
+        with self.captureOnCommitCallbacks(using='shard_downtown', execute=True):
+            notify_order_placed.delay(1, using='shard_downtown', commit_using='shard_downtown')
+        self.assertEqual(BackgroundTask.objects.count(), 1)
+
+
+class SharedConstraintTests(APITestCase):
+    def foreign_keys(self, model):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, model._meta.db_table)
+        return {column for constraint in constraints.values() if constraint['foreign_key'] for column in constraint['columns']}
+
+    def test_only_shard_rows_are_linked(self):
+        # The same schema with and without shards
+        self.assertEqual(self.foreign_keys(Cart), set())
+        self.assertEqual(self.foreign_keys(Order), set())
+        self.assertEqual(self.foreign_keys(OrderItem), {'order_id'})
+
+    def test_deletion_cascades_without_constraints(self):
+        order = Order(user=self.customer, delivery_crew=self.crew)
+        for row in (Cart(user=self.customer, menuitem=self.pasta), order, OrderItem(order=order, menuitem=self.tiramisu)):
+            row.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.crew.delete()
+            self.tiramisu.delete()
+        self.assertIsNone(Order.objects.get(pk=order.pk).delivery_crew_id)
+        self.assertFalse(OrderItem.objects.exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.customer.delete()
+        self.assertFalse(Cart.objects.exists())
+        self.assertFalse(Order.objects.exists())
+
+
+@skipUnless('downtown' in settings.LOCATION_SHARDS, 'run with LITTLELEMON_SHARDS=downtown')
+class ShardCleanupTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.downtown = Location.objects.create(slug='downtown', name='Downtown')
+
+    def setUp(self):
+        super().setUp()
+        # save() lets the router place the rows (the manager's create() does not)
+        self.order = Order(user=self.customer, delivery_crew=self.crew, location=self.downtown)
+        for row in (Cart(user=self.customer, menuitem=self.pasta, location=self.downtown),
+                    self.order, OrderItem(order=self.order, menuitem=self.tiramisu)):
+            row.save()
+            self.assertEqual(row._state.db, 'shard_downtown')
+
+    def shard(self, model):
+        return model.objects.using('shard_downtown')
+
+    def test_deleted_crew_member_is_unassigned(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.crew.delete()
+        self.assertIsNone(self.shard(Order).get(pk=self.order.pk).delivery_crew_id)
+
+    def test_deleted_customer_takes_their_carts_and_orders(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.customer.delete()
+        self.assertFalse(self.shard(Cart).exists())
+        self.assertFalse(self.shard(Order).exists())
+        self.assertFalse(self.shard(OrderItem).exists())
+
+    def test_deleted_menu_item_takes_its_lines(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tiramisu.delete()
+        self.assertFalse(self.shard(OrderItem).exists())
+        self.assertTrue(self.shard(Cart).exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pasta.delete()
+        self.assertFalse(self.shard(Cart).exists())
+
+    def test_location_with_orders_is_protected(self):
+        with self.assertRaises(models.ProtectedError), transaction.atomic():
+            self.downtown.delete()
+        self.assertTrue(Location.objects.filter(pk=self.downtown.pk).exists())
+
+    def test_nothing_changes_before_the_deletion_commits(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.customer.delete()
+        self.assertEqual(len(callbacks), 1)
+        self.assertTrue(self.shard(Order).exists())
+
+
+class MetricsFileTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        settings_override = override_settings(METRICS={'DIR': self.directory})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        live = mock.patch.object(metrics, 'metrics', metrics.RequestMetrics(metrics.get_setting('BUCKETS')))
+        live.start()
+        self.addCleanup(live.stop)
+
+    def write_process_file(self, pid, hits):
+        other = metrics.RequestMetrics(metrics.get_setting('BUCKETS'))
+        for _ in range(hits):
+            other.cache_lookup('catalog', True)
+        path = self.directory / f'{pid}-1.json'
+        path.write_text(json.dumps(other.snapshot()))
+        return path
+
+    def hits(self):
+        return metrics.collect()[3].get(('catalog', 'hit'), 0)
+
+    def exited_pid(self):
+        process = subprocess.Popen([sys.executable, '-c', ''])
+        process.wait()
+        return process.pid
+
+    def test_files_of_exited_processes_are_archived_once(self):
+        dead = self.write_process_file(self.exited_pid(), 3)
+        alive = self.write_process_file(os.getppid(), 2)
+        metrics.cache_lookup('catalog', True)
+
+        self.assertEqual(self.hits(), 6)
+        self.assertFalse(dead.exists())
+        self.assertTrue(alive.exists())
+        self.assertEqual(self.hits(), 6)
+
+        self.write_process_file(self.exited_pid(), 4)
+        self.assertEqual(self.hits(), 10)
+        self.assertEqual(sorted(path.name for path in self.directory.glob('*.json')), [alive.name, 'archived.json'])
+
+    @skipUnless(hasattr(os, 'fork'), 'needs os.fork')
+    def test_forked_worker_gets_its_own_file_and_counters(self):
+        metrics.cache_lookup('catalog', True)
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                os.write(write, json.dumps([metrics._file_name, metrics.metrics.snapshot()['cache']]).encode())
+            finally:
+                os._exit(0)
+        os.close(write)
+        os.waitpid(pid, 0)
+        with os.fdopen(read) as pipe:
+            file_name, cache_counts = json.loads(pipe.read())
+        self.assertNotEqual(file_name, metrics._file_name)
+        self.assertTrue(file_name.startswith(f'{pid}-'))
+        self.assertEqual(cache_counts, [])
+
+    def test_exiting_process_archives_its_file(self):
+        metrics.cache_lookup('catalog', True)
+        metrics.flush(force=True)
+        self.assertTrue((self.directory / metrics._file_name).exists())
+
+        metrics._archive_on_exit()
+        self.assertEqual([path.name for path in self.directory.glob('*.json')], ['archived.json'])
+        with mock.patch.object(metrics, 'metrics', metrics.RequestMetrics(metrics.get_setting('BUCKETS'))):
+            self.assertEqual(self.hits(), 1)
+
+
+class RetentionTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.long_ago = timezone.now() - timedelta(days=365)
+
+    def purge(self, policy, **kwargs):
+        [entry] = [entry for entry in retention.purge([policy], batch_size=1, pause=0, **kwargs)
+                   if entry['database'] == 'default']
+        return entry
+
+    def add_to_cart(self, user, menuitem, touched):
+        line = Cart(user=user, menuitem=menuitem)
+        line.save()
+        Cart.objects.filter(pk=line.pk).update(updated_at=touched)
+
+    def test_abandoned_carts_are_deleted_whole(self):
+        self.add_to_cart(self.customer, self.pasta, self.long_ago)
+        self.add_to_cart(self.customer, self.tiramisu, self.long_ago)
+        # One line changed recently keeps the whole cart
+        self.add_to_cart(self.other_customer, self.pasta, self.long_ago)
+        self.add_to_cart(self.other_customer, self.tiramisu, timezone.now())
+
+        self.assertEqual(self.purge('carts', dry_run=True)['rows'], 2)
+        self.assertEqual(Cart.objects.count(), 4)
+        entry = self.purge('carts')
+        self.assertEqual((entry['rows'], entry['batches']), (2, 2))
+        self.assertEqual(set(Cart.objects.values_list('user', flat=True)), {self.other_customer.pk})
+
+    def test_only_unused_tokens_are_deleted(self):
+        idle, active, returning = (Token.objects.create(user=user) for user in (self.customer, self.crew, self.manager))
+        Token.objects.update(created=self.long_ago)
+        User.objects.filter(pk=self.manager.pk).update(last_login=timezone.now())
+
+        # Token authentication records the use; it does not update last_login
+        response = APIClient().get(reverse('cart'), HTTP_AUTHORIZATION=f'Token {active.key}')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(TokenUse.objects.filter(token=active).exists())
+        with self.assertNumQueries(1):  # the token; its use is recorded once per interval
+            APIClient().get(reverse('cart'), HTTP_AUTHORIZATION=f'Token {active.key}')
+
+        self.assertEqual(self.purge('tokens')['rows'], 1)
+        self.assertEqual(set(Token.objects.values_list('key', flat=True)), {active.key, returning.key})
+        self.assertFalse(Token.objects.filter(key=idle.key).exists())
+
+    def test_token_used_long_ago_is_deleted(self):
+        token = Token.objects.create(user=self.customer)
+        Token.objects.update(created=self.long_ago)
+        TokenUse.objects.create(token=token, last_used=self.long_ago)
+        self.assertEqual(self.purge('tokens')['rows'], 1)
+        self.assertFalse(TokenUse.objects.exists())
+
+    def test_expired_sessions_are_deleted(self):
+        Session.objects.create(session_key='expired', session_data='', expire_date=timezone.now() - timedelta(days=1))
+        Session.objects.create(session_key='live', session_data='', expire_date=timezone.now() + timedelta(days=1))
+        self.assertEqual(self.purge('sessions')['rows'], 1)
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), ['live'])
+
+    @override_settings(RETENTION={'TOKENS': None})
+    def test_policy_set_to_none_is_skipped(self):
+        Token.objects.create(user=self.customer)
+        Token.objects.update(created=self.long_ago)
+        self.assertEqual(retention.purge(['tokens'], pause=0), [])
+        self.assertTrue(Token.objects.exists())
+
+
+class RecommendationTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.salad = MenuItem.objects.create(title='Salad', price=Decimal('8.00'), category=cls.mains)
+
+    def place_order(self, *items, placed=None, pk=None):
+        order = Order(pk=pk, user=self.customer)
+        order.save()
+        for item in items:
+            OrderItem(order=order, menuitem=item, unit_price=item.price, price=item.price).save()
+        if placed is not None:
+            Order.objects.filter(pk=order.pk).update(date=placed)
+        return order
+
+    def build(self, **kwargs):
+        # The index reloads once the build commits
+        with self.captureOnCommitCallbacks(execute=True):
+            return recommendations.build(**kwargs)
+
+    def pair_count(self, item, other):
+        item, other = sorted([item, other], key=lambda menuitem: menuitem.pk)
+        return MenuItemPairCount.objects.filter(item=item, other=other).values_list('count', flat=True).first()
+
+    def test_orders_are_counted_once(self):
+        self.place_order(self.pasta, self.tiramisu)
+        self.place_order(self.pasta, self.tiramisu, self.salad)
+        self.assertEqual(recommendations.build()['orders'], 2)
+        self.assertEqual(self.pair_count(self.pasta, self.tiramisu), 2)
+
+        self.assertEqual(recommendations.build()['orders'], 0)
+        self.place_order(self.pasta, self.tiramisu)
+        self.assertEqual(recommendations.build()['orders'], 1)
+        self.assertEqual(self.pair_count(self.pasta, self.tiramisu), 3)
+        self.assertEqual(self.pair_count(self.pasta, self.salad), 1)
+
+    def test_late_commit_is_counted(self):
+        self.place_order(self.pasta, self.salad, pk=50)
+        recommendations.build()
+        # A checkout that began (and took its id) before the build but committed after it
+        self.place_order(self.pasta, self.tiramisu, placed=timezone.now() - timedelta(minutes=1), pk=49)
+        self.assertEqual(recommendations.build()['orders'], 1)
+        self.assertEqual(self.pair_count(self.pasta, self.tiramisu), 1)
+
+    def test_full_build_recounts(self):
+        self.place_order(self.pasta, self.tiramisu)
+        recommendations.build()
+        recommendations.build(full=True)
+        self.assertEqual(self.pair_count(self.pasta, self.tiramisu), 1)
+
+    def test_endpoints(self):
+        for _ in range(2):
+            self.place_order(self.pasta, self.tiramisu)
+        self.place_order(self.pasta, self.salad)
+        self.build()
+
+        response = APIClient().get(reverse('menu_item_recommendations', args=[self.pasta.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['id'] for item in response.json()['results']], [self.tiramisu.pk, self.salad.pk])
+        response = APIClient().get(reverse('menu_item_recommendations', args=[self.pasta.pk]), {'limit': 1})
+        self.assertEqual([item['id'] for item in response.json()['results']], [self.tiramisu.pk])
+        self.assertEqual(APIClient().get(reverse('menu_item_recommendations', args=[0])).status_code, 404)
+
+        client = self.client_for(self.customer)
+        client.post(reverse('cart'), {'menuitem': self.tiramisu.pk, 'quantity': 1})
+        response = client.get(reverse('cart_suggestions'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['id'] for item in response.json()['results']], [self.pasta.pk])
+
+
+class OrderAdminTests(APITestCase):
+    changelist = reverse('admin:LittleLemonAPI_order_changelist')
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'lemon-pass-123')
+        cls.other_crew = cls.make_user('crew2', 'Delivery crew')
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.admin)
+
+    def place_orders(self, count, **fields):
+        orders = [Order(user=self.customer, **fields) for _ in range(count)]
+        for order in orders:
+            order.save()
+        return orders
+
+    def changelist_queries(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.changelist, params)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def formset_data(self, orders, changes=None):
+        data = {
+            'form-TOTAL_FORMS': len(orders), 'form-INITIAL_FORMS': len(orders), 'form-MAX_NUM_FORMS': '',
+            '_save': 'Save',
+        }
+        for index, order in enumerate(orders):
+            row = {'id': order.pk, 'status': order.status, 'delivery_crew': order.delivery_crew_id or ''}
+            row.update((changes or {}).get(order.pk, {}))
+            data.update({f'form-{index}-{name}': value for name, value in row.items()})
+        return data
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        self.place_orders(3, delivery_crew=self.crew)
+        queries = self.changelist_queries()
+        self.place_orders(12, delivery_crew=self.other_crew)
+        with self.assertNumQueries(queries):
+            self.client.get(self.changelist)
+
+    def test_list_editable_save_queries_do_not_grow_with_rows(self):
+        orders = self.place_orders(3)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(self.changelist, self.formset_data(orders))
+        self.assertEqual(response.status_code, 302)
+        orders += self.place_orders(12)
+        orders.sort(key=lambda order: order.date, reverse=True)
+        with self.assertNumQueries(len(queries)):
+            self.client.post(self.changelist, self.formset_data(orders))
+
+    def test_list_editable_assigns_crew_members_only(self):
+        [order] = self.place_orders(1)
+        response = self.client.post(self.changelist, self.formset_data([order], {order.pk: {'delivery_crew': self.customer.pk}}))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['cl'].formset.errors[0]['delivery_crew'])
+
+        response = self.client.post(self.changelist, self.formset_data([order], {
+            order.pk: {'delivery_crew': self.crew.pk, 'status': 'preparing'},
+        }))
+        self.assertEqual(response.status_code, 302)
+        order.refresh_from_db()
+        self.assertEqual((order.delivery_crew, order.status), (self.crew, 'preparing'))
+
+    def test_changeform_keeps_a_former_crew_member(self):
+        [order] = self.place_orders(1, delivery_crew=self.crew)
+        self.crew.groups.clear()
+        with self.assertNumQueries(8):
+            response = self.client.get(reverse('admin:LittleLemonAPI_order_change', args=[order.pk]))
+        choices = [pk for pk, label in response.context['adminform'].form.fields['delivery_crew'].choices]
+        self.assertEqual(choices, ['', self.other_crew.pk, self.crew.pk])
+
+    def test_username_filter(self):
+        self.place_orders(2, delivery_crew=self.crew)
+        self.place_orders(1, delivery_crew=self.other_crew)
+        response = self.client.get(self.changelist, {'delivery_crew__username': 'crew2', 'status': 'pending'})
+        self.assertEqual(response.context['cl'].result_count, 1)
+        # "All" drops the username and keeps the other filters
+        self.assertContains(response, 'href="?status=pending"')
+        self.assertContains(response, '<input type="hidden" name="status" value="pending">', html=True)
+
+    def test_estimated_count(self):
+        self.place_orders(3)
+        paginator = api_admin.EstimatedCountPaginator
+        with mock.patch.object(paginator, 'exact_count_limit', 1), \
+                mock.patch.object(api_admin, 'estimate_row_count', return_value=1000) as estimate:
+            self.assertEqual(paginator(Order.objects.all(), 100).count, 1000)
+            # Filtered: the estimate does not apply
+            self.assertEqual(paginator(Order.objects.filter(status='pending'), 100).count, 3)
+            estimate.return_value = None
+            self.assertEqual(paginator(Order.objects.all(), 100).count, 3)
+        # Below the limit the count is exact
+        self.assertEqual(paginator(Order.objects.all(), 100).count, 3)
+        self.assertGreaterEqual(api_admin.estimate_row_count(Order.objects.all()), 3)
+
+
+class BootstrapTests(APITestCase):
+    url = reverse('bootstrap')
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.uptown = Location.objects.create(slug='uptown', name='Uptown')
+        cls.salad = MenuItem.objects.create(title='Salad', price=Decimal('8.00'), category=cls.mains)
+        # Not served uptown
+        cls.tiramisu.locations.add(Location.objects.create(slug='riverside', name='Riverside'))
+
+    def test_next_page_keeps_location_and_page_size(self):
+        menu = APIClient().get(self.url, {'location': 'uptown', 'page_size': 1}).json()['menu']
+        self.assertEqual(menu['count'], 2)
+        self.assertEqual([item['title'] for item in menu['results']], ['Pasta'])
+        self.assertEqual(menu['next'], 'http://testserver/api/menu-items/?location=uptown&page=2&page_size=1')
+
+        page = APIClient().get(menu['next']).json()
+        self.assertEqual([item['title'] for item in page['results']], ['Salad'])
+        self.assertIsNone(page['next'])
+
+    def test_single_page_has_no_next(self):
+        menu = APIClient().get(self.url).json()['menu']
+        self.assertEqual((menu['count'], menu['next']), (3, None))
+        # The cached menu fragment is kept per page size
+        menu = APIClient().get(self.url, {'page_size': 2}).json()['menu']
+        self.assertEqual(len(menu['results']), 2)
+        self.assertEqual(menu['next'], 'http://testserver/api/menu-items/?page=2&page_size=2')
+
+    def test_cart_matches_the_cart_endpoint(self):
+        client = self.client_for(self.customer)
+        client.post(reverse('cart'), {'menuitem': self.pasta.pk, 'quantity': 2})
+        cart = client.get(self.url).json()['cart']
+        self.assertEqual(set(cart), {'items', 'summary'})
+        listing = client.get(reverse('cart')).json()
+        self.assertEqual(cart['items'], listing['results'])
+        self.assertEqual(cart['summary'], {'lines': 1, 'items': 2, 'subtotal': '25.00'})
+
+    def test_anonymous(self):
+        data = APIClient().get(self.url).json()
+        self.assertEqual(data['user'], {'username': 'Anonymous', 'groups': []})
+        self.assertIsNone(data['cart'])
+        self.assertEqual(data['recent_orders'], [])
+
+    def test_queries_once_cached(self):
+        client = self.client_for(self.customer)
+        client.get(self.url)
+        # Only the recent orders (of the default database); roles, catalog and cart are cached
+        with self.assertNumQueries(1):
+            data = client.get(self.url).json()
+        self.assertEqual(len(data['menu']['results']), 3)
+
+
+class MenuSyncTests(APITestCase):
+    url = reverse('menu_sync')
+
+    def sync(self, since, **params):
+        response = APIClient().get(self.url, {'since': since, **params})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def ids(self, data, key):
+        return sorted(row['id'] for row in data[key])
+
+    def test_first_sync_has_the_whole_catalog(self):
+        data = self.sync(0)
+        self.assertEqual(self.ids(data, 'menu_items'), [self.pasta.pk, self.tiramisu.pk])
+        self.assertEqual(self.ids(data, 'categories'), [self.mains.pk, self.desserts.pk])
+        self.assertEqual((data['more'], data['reset']), (False, False))
+        self.assertEqual(data['cursor'], CatalogChange.objects.latest('pk').pk)
+
+    def test_unchanged_catalog_is_one_query(self):
+        cursor = self.sync(0)['cursor']
+        with self.assertNumQueries(1):
+            data = self.sync(cursor)
+        self.assertEqual(data['cursor'], cursor)
+        self.assertEqual((data['menu_items'], data['deleted']['menu_items']), ([], []))
+
+    def test_changes_and_tombstones_after_the_cursor(self):
+        cursor = self.sync(0)['cursor']
+        self.pasta.price = Decimal('13.00')
+        self.pasta.save()
+        tiramisu_id = self.tiramisu.pk
+        self.tiramisu.delete()
+        data = self.sync(cursor)
+        self.assertEqual([(row['id'], row['price']) for row in data['menu_items']], [(self.pasta.pk, '13.00')])
+        self.assertEqual(data['deleted'], {'menu_items': [tiramisu_id], 'categories': []})
+        self.assertEqual(data['categories'], [])
+
+    def test_changed_then_deleted_is_a_tombstone(self):
+        cursor = self.sync(0)['cursor']
+        salad = MenuItem.objects.create(title='Salad', price=Decimal('8.00'), category=self.mains)
+        salad_id = salad.pk
+        salad.delete()
+        data = self.sync(cursor)
+        self.assertEqual(data['menu_items'], [])
+        self.assertEqual(data['deleted']['menu_items'], [salad_id])
+
+    def test_pages(self):
+        data = self.sync(0, limit=3)
+        self.assertTrue(data['more'])
+        self.assertEqual(len(data['menu_items']) + len(data['categories']), 3)
+        data = self.sync(data['cursor'], limit=3)
+        self.assertFalse(data['more'])
+        self.assertEqual(len(data['menu_items']) + len(data['categories']), 1)
+
+    def test_purged_tombstones_reset_older_cursors(self):
+        old_cursor = self.sync(0)['cursor']
+        self.pasta.save()
+        self.tiramisu.delete()
+        CatalogChange.objects.filter(deleted=True).update(created_at=timezone.now() - timedelta(days=60))
+        current = self.sync(old_cursor)['cursor']
+
+        # Superseded: the first changes of both items; purged: the tombstone
+        self.assertEqual(catalog_sync.compact(tombstone_days=30), (2, 1))
+        data = self.sync(old_cursor)
+        self.assertEqual((data['reset'], data['cursor'], data['menu_items']), (True, 0, []))
+        # A client that saw the tombstone is not reset, only moved past the marker
+        data = self.sync(current)
+        self.assertFalse(data['reset'])
+        self.assertGreater(data['cursor'], current)
+        self.assertEqual((data['menu_items'], data['deleted']['menu_items']), ([], []))
+        # Starting over still gets the whole catalog
+        self.assertEqual(self.ids(self.sync(0), 'menu_items'), [self.pasta.pk])
+
+    def test_cursor_must_be_a_number(self):
+        self.assertEqual(APIClient().get(self.url, {'since': 'abc'}).status_code, 400)
+
+
+class CartSummaryTests(APITestCase):
+    url = reverse('cart')
+
+    def setUp(self):
+        super().setUp()
+        self.client = self.client_for(self.customer)
+
+    def add(self, menuitem, quantity):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url, {'menuitem': menuitem.pk, 'quantity': quantity})
+        self.assertEqual(response.status_code, 201)
+
+    def test_empty_cart(self):
+        self.assertEqual(self.client.get(self.url).json()['summary'], {'lines': 0, 'items': 0, 'subtotal': '0.00'})
+
+    def test_summary_follows_the_cart(self):
+        self.add(self.pasta, 2)
+        self.assertEqual(self.client.get(self.url).json()['summary'], {'lines': 1, 'items': 2, 'subtotal': '25.00'})
+        self.add(self.tiramisu, 1)
+        data = self.client.get(self.url).json()
+        self.assertEqual(data['summary'], {'lines': 2, 'items': 3, 'subtotal': '31.00'})
+        self.assertEqual(data['count'], 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(reverse('clear_cart'))
+        self.assertEqual(self.client.get(self.url).json()['summary']['lines'], 0)
+
+    def test_served_from_the_snapshot(self):
+        self.add(self.pasta, 2)
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            data = self.client.get(self.url).json()
+        self.assertEqual(data['summary']['items'], 2)
+        # Another user's cart is their own
+        self.assertEqual(self.client_for(self.other_customer).get(self.url).json()['summary']['lines'], 0)
+
+    def test_catalog_change_retires_the_snapshot(self):
+        self.add(self.pasta, 1)
+        self.client.get(self.url)
+        self.pasta.title = 'Penne'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pasta.save()
+        self.assertEqual(self.client.get(self.url).json()['results'][0]['menuitem_name'], 'Penne')
+
+    def test_summary_with_sparse_fields(self):
+        self.add(self.pasta, 2)
+        data = self.client.get(self.url, {'fields': 'id,quantity'}).json()
+        self.assertEqual(set(data['results'][0]), {'id', 'quantity'})
+        self.assertEqual(data['summary']['subtotal'], '25.00')
+
+
+class OrderListTests(APITestCase):
+    url = reverse('orders')
+
+    def place_order(self, *lines, user=None):
+        order = Order(user=user or self.customer, total=Decimal('10.00'))
+        order.save()
+        for menuitem, quantity in lines:
+            OrderItem(order=order, menuitem=menuitem, quantity=quantity, unit_price=menuitem.price,
+                      price=menuitem.price * quantity).save()
+        return order
+
+    def test_compact_rows(self):
+        order = self.place_order((self.pasta, 2), (self.tiramisu, 1))
+        self.place_order((self.pasta, 1), user=self.other_customer)
+        data = self.client_for(self.customer).get(self.url).json()
+        self.assertEqual(data['results'], [{
+            'id': order.pk, 'date': data['results'][0]['date'], 'status': 'pending', 'total': '10.00',
+            'items_count': 2, 'location': None,
+        }])
+
+    def test_order_without_lines_counts_zero(self):
+        self.place_order()
+        self.assertEqual(self.client_for(self.customer).get(self.url).json()['results'][0]['items_count'], 0)
+
+    def test_expand_items(self):
+        order = self.place_order((self.pasta, 2))
+        client = self.client_for(self.customer)
+        row = client.get(self.url, {'expand': 'items'}).json()['results'][0]
+        detail = client.get(reverse('order_detail', args=[order.pk])).json()
+        self.assertEqual(set(row), set(detail))
+        self.assertEqual(len(row['items']), 1)
+        self.assertEqual(client.get(self.url, {'expand': 'items,menu'}).status_code, 400)
+
+    def test_queries_do_not_grow_with_orders(self):
+        client = self.client_for(self.manager)
+        self.place_order((self.pasta, 1))
+        client.get(self.url)  # caches the roles
+        with CaptureQueriesContext(connection) as queries:
+            client.get(self.url)
+        for _ in range(9):
+            self.place_order((self.pasta, 1), (self.tiramisu, 1))
+        with self.assertNumQueries(len(queries)):
+            data = client.get(self.url).json()
+        self.assertEqual(len(data['results']), 10)
+
+
+class GroupMembershipTests(APITestCase):
+    url = reverse('group_members', args=['delivery-crew'])
+
+    def post(self, data, user=None, url=None):
+        return self.client_for(user or self.manager).post(url or self.url, data, format='json')
+
+    def crew_ids(self):
+        return set(User.objects.filter(groups__name='Delivery crew').values_list('pk', flat=True))
+
+    def test_add_and_remove(self):
+        response = self.post({
+            'add': [self.customer.pk, self.crew.pk, 99999, self.customer.pk],
+            'remove': [self.other_customer.pk],
+        })
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual((data['added'], data['removed']), (1, 0))
+        self.assertEqual(data['results'], [
+            {'id': self.customer.pk, 'result': 'added'},
+            {'id': self.crew.pk, 'result': 'already_member'},
+            {'id': 99999, 'result': 'not_found'},
+            {'id': self.other_customer.pk, 'result': 'not_member'},
+        ])
+        self.assertEqual(self.crew_ids(), {self.crew.pk, self.customer.pk})
+
+        data = self.post({'remove': [self.crew.pk, self.customer.pk]}).json()
+        self.assertEqual((data['added'], data['removed']), (0, 2))
+        self.assertEqual(self.crew_ids(), set())
+
+    def test_repeating_a_request_changes_nothing(self):
+        self.post({'add': [self.customer.pk]})
+        data = self.post({'add': [self.customer.pk]}).json()
+        self.assertEqual((data['added'], data['results'][0]['result']), (0, 'already_member'))
+
+    def test_invalid_ids(self):
+        for data in ({}, {'add': []}, {'add': 'abc'}, {'add': ['1']}, {'add': [True]}, {'remove': [1.5]},
+                     {'add': list(range(1, 1002))}, {'add': [self.customer.pk], 'remove': [self.customer.pk]}):
+            self.assertEqual(self.post(data).status_code, 400, data)
+        self.assertEqual(self.crew_ids(), {self.crew.pk})
+
+    def test_permissions(self):
+        self.assertEqual(self.post({'add': [self.customer.pk]}, user=self.customer).status_code, 403)
+        managers = reverse('group_members', args=['manager'])
+        self.assertEqual(self.post({'add': [self.customer.pk]}, url=managers).status_code, 403)
+        self.assertEqual(self.post({'add': [self.customer.pk]}, url=reverse('group_members', args=['chefs'])).status_code, 404)
+
+    def test_queries_do_not_grow_with_users(self):
+        users = User.objects.bulk_create([User(username=f'user{index}') for index in range(30)])
+        self.post({'add': [self.customer.pk]})  # caches the manager's roles
+        with CaptureQueriesContext(connection) as queries:
+            self.post({'add': [users[0].pk], 'remove': [self.customer.pk]})
+        with self.assertNumQueries(len(queries)):
+            data = self.post({'add': [user.pk for user in users[1:]], 'remove': [users[0].pk]}).json()
+        self.assertEqual((data['added'], data['removed']), (29, 1))
+
+
+class AutocompleteTests(APITestCase):
+    url = reverse('menu_autocomplete')
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for title in ('Marinara Pasta', 'Pasta Marinara', 'Margherita'):
+            MenuItem.objects.create(title=title, price=Decimal('9.00'), category=cls.mains)
+        cls.riverside = Location.objects.create(slug='riverside', name='Riverside')
+        Location.objects.create(slug='uptown', name='Uptown')
+        cls.tiramisu.locations.add(cls.riverside)
+
+    def setUp(self):
+        super().setUp()
+        # Every test builds its own index from its own catalog
+        for name, value in (('_index', None), ('_stale', False), ('_next_check', 0.0)):
+            patcher = mock.patch.object(autocomplete, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def titles(self, **params):
+        response = APIClient().get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return [result['title'] for result in response.json()['results']]
+
+    def test_ranking(self):
+        # Categories first, then titles starting with the query, then shorter titles
+        self.assertEqual(self.titles(q='ma'), ['Mains', 'Margherita', 'Marinara Pasta', 'Pasta Marinara'])
+        self.assertEqual(self.titles(q='pasta mar'), ['Pasta Marinara', 'Marinara Pasta'])
+        self.assertEqual(self.titles(q='ma', limit=2), ['Mains', 'Margherita'])
+
+    def test_typos(self):
+        self.assertEqual(self.titles(q='tiramsu'), ['Tiramisu'])
+        # Case and accents are folded
+        self.assertEqual(self.titles(q='TIRAMISÙ'), ['Tiramisu'])
+        # An exact match ranks before typos, however long its title
+        MenuItem.objects.create(title='Pastoral Salad', price=Decimal('9.00'), category=self.mains)
+        autocomplete._index = None
+        self.assertEqual(self.titles(q='pasto'), ['Pastoral Salad', 'Pasta', 'Marinara Pasta', 'Pasta Marinara'])
+
+    def test_answered_without_queries(self):
+        self.titles(q='pa')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.titles(q='pas'), ['Pasta', 'Pasta Marinara', 'Marinara Pasta'])
+
+    def test_location_filter(self):
+        self.assertEqual(self.titles(q='tira', location='riverside'), ['Tiramisu'])
+        self.assertEqual(self.titles(q='tira', location='uptown'), [])
+        # Items without locations are served everywhere
+        self.assertEqual(self.titles(q='margh', location='uptown'), ['Margherita'])
+        self.assertEqual(APIClient().get(self.url, {'q': 'tira', 'location': 'nowhere'}).status_code, 400)
+
+    def test_catalog_changes_apply_once_committed(self):
+        self.assertEqual(self.titles(q='lasagne'), [])
+        with self.captureOnCommitCallbacks() as callbacks:
+            MenuItem.objects.create(title='Lasagne', price=Decimal('11.00'), category=self.mains)
+            self.assertEqual(self.titles(q='lasagne'), [])
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.titles(q='lasagne'), ['Lasagne'])
+
+
+@override_settings(MENU_PRICE_BUCKETS=[5, 10, 20])
+class MenuFacetTests(APITestCase):
+    url = reverse('menu_items')
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.salad = MenuItem.objects.create(title='Pasta Salad', price=Decimal('4.00'), category=cls.mains, featured=True)
+        cls.tiramisu.locations.add(Location.objects.create(slug='riverside', name='Riverside'))
+        Location.objects.create(slug='uptown', name='Uptown')
+
+    def facets(self, **params):
+        response = APIClient().get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['count'], sum(category['count'] for category in data['facets']['category']))
+        return data['facets']
+
+    def category_counts(self, facets):
+        return [(category['title'], category['count']) for category in facets['category']]
+
+    def test_whole_menu(self):
+        facets = self.facets()
+        self.assertEqual(self.category_counts(facets), [('Desserts', 1), ('Mains', 2)])
+        self.assertEqual(facets['featured'], {'true': 1, 'false': 2})
+        self.assertEqual(facets['item_of_the_day'], {'true': 0, 'false': 3})
+        self.assertEqual(facets['price'], [
+            {'min': None, 'max': '5.00', 'count': 1},
+            {'min': '5.00', 'max': '10.00', 'count': 1},
+            {'min': '10.00', 'max': '20.00', 'count': 1},
+            {'min': '20.00', 'max': None, 'count': 0},
+        ])
+
+    def test_counts_follow_search_and_filters(self):
+        facets = self.facets(search='pasta')
+        self.assertEqual(self.category_counts(facets), [('Mains', 2)])
+        self.assertEqual([band['count'] for band in facets['price']], [1, 0, 1, 0])
+
+        facets = self.facets(search='pasta', featured='true')
+        self.assertEqual(self.category_counts(facets), [('Mains', 1)])
+        self.assertEqual(facets['featured'], {'true': 1, 'false': 0})
+
+        facets = self.facets(category=self.desserts.pk)
+        self.assertEqual(self.category_counts(facets), [('Desserts', 1)])
+
+        facets = self.facets(location='uptown')
+        self.assertEqual(self.category_counts(facets), [('Mains', 2)])
+
+    def test_facets_are_one_query(self):
+        # The page count, the page and the facets
+        with self.assertNumQueries(3):
+            self.facets(search='pasta')
+
+
+class ProfilingTests(APITestCase):
+    url = reverse('menu_items')
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'lemon-pass-123')
+        cls.staff = cls.make_user('staff')
+        cls.staff.is_staff = True
+        cls.staff.save()
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        settings_override = override_settings(PROFILER={**settings.PROFILER, 'DIR': self.directory, 'KEEP': 2})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def captures(self):
+        return sorted(path.name for path in self.directory.glob('*'))
+
+    def test_off_unless_asked_for(self):
+        self.client.force_login(self.admin)
+        response = self.client.get(self.url)
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(self.captures(), [])
+
+    def test_only_superusers_are_profiled(self):
+        for user in (None, self.customer, self.staff):
+            client = self.client_class()
+            if user is not None:
+                client.force_login(user)
+            response = client.get(self.url, {'_profile': 1})
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('X-Profile-Id', response, user)
+        self.assertEqual(self.captures(), [])
+
+    def test_superuser_capture(self):
+        token = Token.objects.create(user=self.admin)
+        response = self.client.get(self.url, HTTP_X_PROFILE='1', HTTP_AUTHORIZATION=f'Token {token.key}')
+        capture_id = response['X-Profile-Id']
+        self.assertEqual(self.captures(), [f'{capture_id}.json', f'{capture_id}.prof'])
+
+        self.client.force_login(self.admin)
+        capture = self.client.get(reverse('profile_detail', args=[capture_id])).json()
+        self.assertEqual((capture['user'], capture['status']), ('admin', 200))
+        self.assertGreater(capture['sql']['count'], 0)
+        self.assertTrue(capture['top_functions'])
+
+    def test_only_the_newest_are_kept(self):
+        self.client.force_login(self.admin)
+        ids = [self.client.get(self.url, {'_profile': 1})['X-Profile-Id'] for _ in range(3)]
+        listed = self.client.get(reverse('profiles')).json()['results']
+        self.assertEqual([capture['id'] for capture in listed], ids[:0:-1])
+        self.assertEqual(len(self.captures()), 4)
+
+    def test_store_is_admin_only(self):
+        self.client.force_login(self.customer)
+        self.assertEqual(self.client.get(reverse('profiles')).status_code, 403)
+        self.client.force_login(self.admin)
+        self.assertEqual(self.client.get(reverse('profile_detail', args=['missing'])).status_code, 404)
+
+
+@skipUnless(connection.vendor == 'postgresql', 'needs row locks (LITTLELEMON_DB_ENGINE=postgresql)')
+class ConcurrentCheckoutTests(TransactionTestCase):
+    databases = {'default', *settings.LOCATION_SHARDS.values()}
+
+    def test_cart_is_ordered_once(self):
+        customer = User.objects.create_user('customer', 'customer@example.com', 'lemon-pass-123')
+        category = Category.objects.create(slug='mains', title='Mains')
+        for title in ('Pasta', 'Salad'):
+            menuitem = MenuItem.objects.create(title=title, price=Decimal('10.00'), category=category)
+            Cart(user=customer, menuitem=menuitem, quantity=1, unit_price=menuitem.price, price=menuitem.price).save()
+
+        start, statuses = threading.Barrier(2), []
+
+        def checkout():
+            client = APIClient()
+            client.force_authenticate(customer)
+            try:
+                start.wait(5)
+                statuses.append(client.post(reverse('orders')).status_code)
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=checkout) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(statuses), [201, 400])
+        self.assertEqual(Order.objects.count(), 1)
+        self.assertEqual(OrderItem.objects.count(), 2)
@@ -4,21 +4,29 @@ from . import views
 urlpatterns = [
     # API Root
     path('', views.api_root, name='api_root'),
+    path('bootstrap/', views.bootstrap, name='bootstrap'),
     
     # User Registration (11)
     path('register/', views.register, name='register'),
     
     # Groups Management (1, 2)
     path('groups/', views.GroupListView.as_view(), name='groups'),
-    path('groups/manager/access/', views.manager_group_access, name='manager_group_access'),
+    path('groups/manager/access/', views.ManagerGroupView.as_view(), name='manager_group_access'),
     path('users/<int:user_id>/assign-manager/', views.assign_user_to_manager, name='assign_manager'),
+    path('groups/<slug:group>/members/', views.group_members, name='group_members'),
+    
+    # Locations
+    path('locations/', views.LocationListView.as_view(), name='locations'),
     
     # Categories (4, 13)
     path('categories/', views.CategoryListCreateView.as_view(), name='categories'),
     
     # Menu Items (3, 14, 15, 16, 17)
     path('menu-items/', views.MenuItemListCreateView.as_view(), name='menu_items'),
+    path('menu-items/sync/', views.menu_sync, name='menu_sync'),
+    path('menu-items/autocomplete/', views.menu_autocomplete, name='menu_autocomplete'),
     path('menu-items/<int:pk>/', views.MenuItemDetailView.as_view(), name='menu_item_detail'),
+    path('menu-items/<int:pk>/recommendations/', views.menu_item_recommendations, name='menu_item_recommendations'),
     
     # Delivery Crew Management (7)
     path('groups/delivery-crew/users/', views.DeliveryCrewListView.as_view(), name='delivery_crew_list'),
@@ -28,10 +36,26 @@ urlpatterns = [
     # Cart (18, 19)
     path('cart/', views.CartView.as_view(), name='cart'),
     path('cart/clear/', views.clear_cart, name='clear_cart'),
+    path('cart/suggestions/', views.cart_suggestions, name='cart_suggestions'),
     
     # Orders (8, 9, 10, 20, 21)
     path('orders/', views.OrderListCreateView.as_view(), name='orders'),
+    path('orders/assign-delivery/', views.assign_orders_to_delivery_crew, name='assign_orders_delivery'),
+    path('orders/status/', views.update_orders_status, name='update_orders_status'),
     path('orders/<int:pk>/', views.OrderDetailView.as_view(), name='order_detail'),
     path('orders/<int:order_id>/assign-delivery/', views.assign_order_to_delivery_crew, name='assign_order_delivery'),
     path('orders/<int:order_id>/status/', views.update_order_status, name='update_order_status'),
+
+    # Demand forecasts
+    path('forecasts/', views.demand_forecasts, name='demand_forecasts'),
+
+    # Background tasks
+    path('tasks/metrics/', views.task_metrics, name='task_metrics'),
+
+    # Request metrics (Prometheus)
+    path('metrics/', views.request_metrics, name='request_metrics'),
+
+    # Request profiles
+    path('profiles/', views.profiles, name='profiles'),
+    path('profiles/<slug:capture_id>/', views.profile_detail, name='profile_detail'),
 ]
@@ -1,18 +1,38 @@
-from rest_framework import generics, status, filters
-from rest_framework.decorators import api_view, permission_classes
-from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser
+from rest_framework import generics, serializers, status, filters
+from rest_framework.decorators import api_view, authentication_classes, permission_classes
+from rest_framework.permissions import IsAuthenticated, AllowAny, IsAdminUser, SAFE_METHODS
 from rest_framework.response import Response
+from rest_framework.exceptions import NotFound, PermissionDenied, ValidationError
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.utils.urls import replace_query_param
 from django.contrib.auth.models import User, Group
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.http import FileResponse, HttpResponse
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, Count, DecimalField, Exists, Min, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+import math
+from decimal import Decimal
+from operator import attrgetter
+from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
 
-from .models import Category, MenuItem, Cart, Order, OrderItem
+from .models import Category, MenuItem, Cart, Order, OrderItem, BackgroundTask, Location, CatalogChange
 from .serializers import (
-    CategorySerializer, MenuItemSerializer, CartSerializer, 
-    OrderSerializer, UserSerializer, GroupSerializer, UserRegistrationSerializer
+    CategorySerializer, MenuItemSerializer, MenuItemListSerializer, CartSerializer, 
+    OrderSerializer, OrderListSerializer, UserSerializer, GroupSerializer, UserRegistrationSerializer,
+    LocationSerializer, split_param
 )
-from .permissions import IsManagerOrAdmin, IsDeliveryCrewOrManager, IsCustomerOrReadOnly, IsOwnerOrManager
+from .permissions import IsManagerOrAdmin, IsDeliveryCrewOrManager, IsCustomerOrReadOnly, IsOwnerOrManager, clear_roles, get_roles, order_scope
+from .conditional import ConditionalListMixin, ConditionalRetrieveMixin
+from .cache import (
+    CachedCatalogMixin, cached_catalog_fragments, clear_cart_snapshot, get_cart_snapshot, set_cart_snapshot,
+)
+from .filters import ForecastFilter, OrderFilter, UserFilter
+from . import autocomplete, background, catalog_sync, forecasting, metrics, profiling, recommendations, tasks
+from .sharding import MergedQuerySet, get_request_location, shard_aliases, shard_for, with_related
 
 
 # Custom pagination class
@@ -21,6 +41,34 @@ class StandardResultsSetPagination(PageNumberPagination):
     page_size_query_param = 'page_size'
     max_page_size = 100
 
+class SparseFieldsetViewMixin:
+    """Load only what ?fields= / ?exclude= asks for (see SparseFieldsetMixin)"""
+    # Columns read by the view itself, e.g. by object permissions
+    sparse_keep_fields = ()
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.request.method in SAFE_METHODS:
+            queryset = self.get_serializer().prune_queryset(queryset, keep=self.sparse_keep_fields)
+        return queryset
+
+API_ENDPOINTS = {
+    'auth': {
+        'register': '/auth/users/',
+        'login': '/auth/token/login/',
+        'logout': '/auth/token/logout/',
+    },
+    'api': {
+        'bootstrap': '/api/bootstrap/',
+        'locations': '/api/locations/',
+        'categories': '/api/categories/',
+        'menu-items': '/api/menu-items/',
+        'cart': '/api/cart/',
+        'orders': '/api/orders/',
+        'groups': '/api/groups/',
+    }
+}
+
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def api_root(request):
@@ -28,21 +76,8 @@ def api_root(request):
         'message': 'Little Lemon API',
         'version': '1.0',
         'user': request.user.username if request.user.is_authenticated else 'Anonymous',
-        'user_groups': [group.name for group in request.user.groups.all()] if request.user.is_authenticated else [],
-        'endpoints': {
-            'auth': {
-                'register': '/auth/users/',
-                'login': '/auth/token/login/',
-                'logout': '/auth/token/logout/',
-            },
-            'api': {
-                'categories': '/api/categories/',
-                'menu-items': '/api/menu-items/',
-                'cart': '/api/cart/',
-                'orders': '/api/orders/',
-                'groups': '/api/groups/',
-            }
-        }
+        'user_groups': sorted(get_roles(request.user)),
+        'endpoints': API_ENDPOINTS,
     })
 
 # 11, 12: User Registration and Authentication (handled by Djoser)
@@ -80,20 +115,46 @@ def assign_user_to_manager(request, user_id):
         'user': UserSerializer(user).data
     })
 
-@api_view(['GET'])
-@permission_classes([IsManagerOrAdmin])
-def manager_group_access(request):
+class GroupMemberListView(generics.ListAPIView):
+    """Members of group_name by username, a page at a time, filtered with UserFilter"""
+    serializer_class = UserSerializer
+    pagination_class = StandardResultsSetPagination
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = UserFilter
+    group_name = None
+
+    def get_queryset(self):
+        # Members are looked up through the group and then sorted: walking the
+        # username index instead would read every user to find a few members
+        members = User.groups.through.objects.filter(group__name=self.group_name).values('user_id')
+        return User.objects.filter(pk__in=members).prefetch_related('groups').order_by('username')
+
+class ManagerGroupView(GroupMemberListView):
     """2. Access manager group with admin token"""
-    manager_group = get_object_or_404(Group, name='Manager')
-    managers = User.objects.filter(groups=manager_group)
-    
-    return Response({
-        'group': GroupSerializer(manager_group).data,
-        'managers': UserSerializer(managers, many=True).data
-    })
+    permission_classes = [IsManagerOrAdmin]
+    group_name = 'Manager'
+
+    def list(self, request, *args, **kwargs):
+        self.group = get_object_or_404(Group, name=self.group_name)
+        return super().list(request, *args, **kwargs)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'group': GroupSerializer(self.group).data,
+            'count': self.paginator.page.paginator.count,
+            'next': self.paginator.get_next_link(),
+            'previous': self.paginator.get_previous_link(),
+            'managers': data,
+        })
+
+class LocationListView(generics.ListAPIView):
+    """Restaurant locations; pass a slug as ?location= (or X-Location) to cart, order and menu endpoints"""
+    queryset = Location.objects.all()
+    serializer_class = LocationSerializer
+    permission_classes = [AllowAny]
 
 # 3, 4: Admin can add menu items and categories
-class CategoryListCreateView(generics.ListCreateAPIView):
+class CategoryListCreateView(ConditionalListMixin, CachedCatalogMixin, generics.ListCreateAPIView):
     """13. Customers can browse all categories / 4. Admin can add categories"""
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
@@ -104,8 +165,62 @@ class CategoryListCreateView(generics.ListCreateAPIView):
         return [AllowAny()]
     
 # Menu Items
-class MenuItemListCreateView(generics.ListCreateAPIView):
-    """14, 15, 16, 17. Customers can browse, filter, paginate, sort menu items / 3. Admin can add menu items"""
+def available_at(queryset, location):
+    """Menu items served at a location (items without locations are served everywhere)"""
+    if location is None:
+        return queryset
+    availability = MenuItem.locations.through.objects.filter(menuitem=OuterRef('pk'))
+    return queryset.filter(~Exists(availability) | Exists(availability.filter(location=location)))
+
+def price_label(amount):
+    return None if amount is None else str(Decimal(amount).quantize(Decimal('0.01')))
+
+def menu_facet_counts(queryset, bounds):
+    """Items per combination of category, featured, item of the day and price band, in one GROUP BY"""
+    band = Case(
+        *[When(price__lt=bound, then=Value(number)) for number, bound in enumerate(bounds)],
+        default=Value(len(bounds)),
+    )
+    return (
+        queryset.prefetch_related(None).order_by()
+        .annotate(band=band)
+        .values('category_id', 'category__title', 'featured', 'item_of_the_day', 'band')
+        .annotate(count=Count('pk'))
+    )
+
+def menu_facets(queryset):
+    """Item counts per category, featured, item of the day and price band (MENU_PRICE_BUCKETS) of a filtered menu"""
+    bounds = sorted(getattr(settings, 'MENU_PRICE_BUCKETS', [5, 10, 20]))
+    rows = menu_facet_counts(queryset, bounds)
+    categories = {}
+    featured = {'true': 0, 'false': 0}
+    item_of_the_day = {'true': 0, 'false': 0}
+    bands = [0] * (len(bounds) + 1)
+    for row in rows:
+        count = row['count']
+        category = categories.setdefault(row['category_id'], {
+            'id': row['category_id'], 'title': row['category__title'], 'count': 0,
+        })
+        category['count'] += count
+        featured['true' if row['featured'] else 'false'] += count
+        item_of_the_day['true' if row['item_of_the_day'] else 'false'] += count
+        bands[row['band']] += count
+    edges = [None, *bounds, None]
+    return {
+        'category': sorted(categories.values(), key=lambda category: category['title']),
+        'featured': featured,
+        'item_of_the_day': item_of_the_day,
+        'price': [
+            {'min': price_label(edges[number]), 'max': price_label(edges[number + 1]), 'count': count}
+            for number, count in enumerate(bands)
+        ],
+    }
+
+class MenuItemListCreateView(CachedCatalogMixin, SparseFieldsetViewMixin, generics.ListCreateAPIView):
+    """
+    14, 15, 16, 17. Customers can browse, filter, paginate, sort menu items / 3. Admin can add menu items.
+    The list comes with facet counts of everything the filters and search matched.
+    """
     queryset = MenuItem.objects.all()
     serializer_class = MenuItemSerializer
     pagination_class = StandardResultsSetPagination
@@ -119,6 +234,9 @@ class MenuItemListCreateView(generics.ListCreateAPIView):
         if self.request.method == 'POST':
             return [IsAdminUser()]
         return [AllowAny()]
+
+    def get_serializer_class(self):
+        return MenuItemListSerializer if self.request.method in SAFE_METHODS else MenuItemSerializer
     
     def get_queryset(self):
         queryset = MenuItem.objects.all()
@@ -132,99 +250,304 @@ class MenuItemListCreateView(generics.ListCreateAPIView):
         ordering = self.request.query_params.get('ordering', None)
         if ordering in ['price', '-price']:
             queryset = queryset.order_by(ordering)
-        
-        return queryset
 
-class MenuItemDetailView(generics.RetrieveUpdateDestroyAPIView):
+        return available_at(queryset, get_request_location(self.request))
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        response = self.get_paginated_response(self.get_serializer(page, many=True).data)
+        response.data['facets'] = menu_facets(queryset)
+        return response
+
+class MenuItemDetailView(ConditionalRetrieveMixin, SparseFieldsetViewMixin, generics.RetrieveUpdateDestroyAPIView):
     queryset = MenuItem.objects.all()
     serializer_class = MenuItemSerializer
+    # category_name is part of the payload, so a renamed category is a change too
+    validator_fields = ('updated_at', 'category__updated_at')
     
     def get_permissions(self):
         if self.request.method in ['PUT', 'PATCH', 'DELETE']:
             return [IsManagerOrAdmin()]
         return [AllowAny()]
     
+# Search-as-you-type
+@api_view(['GET'])
+@authentication_classes([])
+@permission_classes([AllowAny])
+def menu_autocomplete(request):
+    """
+    Categories and menu items whose titles match ?q= as it is typed,
+    allowing a typo per word. Answered from this worker's in-memory index
+    (see autocomplete.py) without a database query; no authentication,
+    which would need one.
+    """
+    index = autocomplete.get_index()
+    location = request.query_params.get('location') or request.META.get('HTTP_X_LOCATION')
+    if location and location not in index.location_slugs:
+        raise ValidationError({'location': f'Unknown location {location!r}'})
+    limit = get_limit(request, autocomplete.get_setting('LIMIT'), maximum=autocomplete.get_setting('MAX_LIMIT'))
+    query = request.query_params.get('q', '')[:100]
+    return Response({'query': query, 'results': index.search(query, limit, location or None)})
+
+# Catalog delta sync
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def menu_sync(request):
+    """
+    Menu items and categories changed since ?since=<cursor> (0 for the whole
+    catalog), and the ids of deleted ones. Send the returned cursor next
+    time; while more is true there are further pages. When reset is true
+    the client drops its copy and syncs again from 0.
+    """
+    try:
+        since = max(int(request.query_params.get('since', 0)), 0)
+    except ValueError:
+        raise ValidationError({'since': 'Must be a number'})
+    limit = get_limit(request, 500, maximum=1000)
+
+    rows, more = catalog_sync.changes_since(since, limit)
+    data = {
+        'cursor': since,
+        'more': more,
+        'reset': False,
+        'menu_items': [],
+        'categories': [],
+        'deleted': {'menu_items': [], 'categories': []},
+    }
+    if not rows:
+        return Response(data)
+    if catalog_sync.needs_reset(since):
+        data.update(cursor=0, more=False, reset=True)
+        return Response(data)
+
+    # Only the latest change of each object in the window matters
+    latest = {(kind, object_id): deleted for _, kind, object_id, deleted in rows if kind != CatalogChange.RESET}
+    for kind, model, serializer_class, key in [
+        (CatalogChange.MENU_ITEM, MenuItem.objects.select_related('category'), MenuItemSerializer, 'menu_items'),
+        (CatalogChange.CATEGORY, Category.objects.all(), CategorySerializer, 'categories'),
+    ]:
+        changed = [object_id for (change_kind, object_id), deleted in latest.items() if change_kind == kind and not deleted]
+        objects = list(model.filter(pk__in=changed)) if changed else []
+        data[key] = serializer_class(objects, many=True).data
+        # Changed, then deleted in a later window
+        found = {obj.pk for obj in objects}
+        data['deleted'][key] = sorted(
+            object_id for (change_kind, object_id), deleted in latest.items()
+            if change_kind == kind and (deleted or object_id not in found)
+        )
+    data['cursor'] = rows[-1][0]
+    return Response(data)
+
+# Recommendations (python manage.py build_recommendations)
+def get_limit(request, default, name='limit', maximum=None):
+    try:
+        return max(1, min(int(request.query_params.get(name, default)), maximum or default))
+    except ValueError:
+        raise ValidationError({name: 'Must be a number'})
+
+def recommended_items(request, pairs, limit):
+    """Serialized menu items for [(id, score)], best first, leaving out items not served at the location"""
+    queryset = available_at(MenuItem.objects.select_related('category'), get_request_location(request))
+    items = queryset.in_bulk([pk for pk, score in pairs])
+    results = []
+    for pk, score in pairs:
+        if pk in items and len(results) < limit:
+            data = MenuItemSerializer(items[pk]).data
+            data['score'] = round(score, 4)
+            results.append(data)
+    return results
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def menu_item_recommendations(request, pk):
+    """Menu items frequently ordered together with this one"""
+    if not MenuItem.objects.filter(pk=pk).exists():
+        return Response({'error': 'Menu item not found'}, status=status.HTTP_404_NOT_FOUND)
+    limit = get_limit(request, recommendations.top_k())
+    pairs = recommendations.get_index().neighbours(pk)
+    return Response({'menuitem': pk, 'results': recommended_items(request, pairs, limit)})
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def cart_suggestions(request):
+    """Menu items frequently ordered together with what is in the cart"""
+    location = get_request_location(request)
+    in_cart = [line['menuitem'] for line in cart_snapshot(request.user, shard_for(location))['items']]
+    limit = get_limit(request, recommendations.top_k())
+    pairs = recommendations.get_index().suggest(in_cart)
+    return Response({'results': recommended_items(request, pairs, limit)})
+
 # Cart
+def cart_summary(cart_items):
+    """Line count, item count and subtotal of a Cart queryset, in one aggregate query"""
+    summary = cart_items.order_by().aggregate(
+        lines=Count('id'),
+        items=Coalesce(Sum('quantity'), 0),
+        subtotal=Coalesce(
+            Sum('price'), Value(Decimal('0.00')),
+            output_field=DecimalField(max_digits=10, decimal_places=2),
+        ),
+    )
+    summary['subtotal'] = str(summary['subtotal'].quantize(Decimal('0.01')))
+    return summary
+
+def cart_snapshot(user, using):
+    """A user's serialized cart lines and summary, cached until the cart or the catalog changes"""
+    snapshot = get_cart_snapshot(user.pk, using)
+    if snapshot is None:
+        cart_items = Cart.objects.using(using).filter(user=user)
+        snapshot = {
+            'items': CartSerializer(with_related(cart_items.order_by('id'), 'menuitem'), many=True).data,
+            'summary': cart_summary(cart_items),
+        }
+        set_cart_snapshot(user.pk, using, snapshot)
+    return snapshot
+
 # 18, 19. Cart Management
-class CartView(generics.ListCreateAPIView):
+class CartView(SparseFieldsetViewMixin, generics.ListCreateAPIView):
     """18, 19. Customers can add menu items to cart and access cart items"""
     serializer_class = CartSerializer
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
-        return Cart.objects.filter(user=self.request.user)
+        location = get_request_location(self.request)
+        return Cart.objects.using(shard_for(location)).filter(user=self.request.user).order_by('id')
+
+    def list(self, request, *args, **kwargs):
+        """Cart lines plus a `summary` (lines, items, subtotal), served from the cart snapshot"""
+        snapshot = cart_snapshot(request.user, shard_for(get_request_location(request)))
+        if 'fields' in request.query_params or 'exclude' in request.query_params:
+            response = super().list(request, *args, **kwargs)
+        else:
+            page = self.paginate_queryset(snapshot['items'])
+            response = self.get_paginated_response(page) if page is not None else Response(snapshot['items'])
+        if isinstance(response.data, dict):
+            response.data['summary'] = snapshot['summary']
+        return response
     
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        serializer.save(user=self.request.user, location=get_request_location(self.request))
 
 @api_view(['DELETE'])
 @permission_classes([IsAuthenticated])
 def clear_cart(request):
     """Clear user's cart"""
-    Cart.objects.filter(user=request.user).delete()
+    using = shard_for(get_request_location(request))
+    Cart.objects.using(using).filter(user=request.user).delete()
+    clear_cart_snapshot(request.user.pk, using)
     return Response({'message': 'Cart cleared successfully'})
 
 # Orders
 # 8, 9, 10, 20, 21. Order Management
-class OrderListCreateView(generics.ListCreateAPIView):
-    """20, 21. Customers can place orders and browse their own orders"""
+class OrderQuerysetMixin:
+    """Role-scoped orders, read from the shard of the requested location"""
+
+    def get_location(self):
+        if not hasattr(self, '_location'):
+            self._location = get_request_location(self.request)
+        return self._location
+
+    def get_order_queryset(self, using):
+        return Order.objects.using(using).filter(**order_scope(self.request.user))
+
+    def get_queryset(self):
+        return self.get_order_queryset(shard_for(self.get_location()))
+
+def with_items_count(orders):
+    """Annotate items_count (order lines) with a correlated subquery, computed only for the rows returned"""
+    lines = (
+        OrderItem.objects.filter(order=OuterRef('pk')).order_by()
+        .values('order').annotate(count=Count('*')).values('count')
+    )
+    return orders.annotate(items_count=Coalesce(Subquery(lines), 0))
+
+class OrderListCreateView(OrderQuerysetMixin, SparseFieldsetViewMixin, generics.ListCreateAPIView):
+    """
+    20, 21. Customers can place orders and browse their own orders.
+    The list is compact (OrderListSerializer); ?expand=items nests the
+    order lines as the detail view does.
+    """
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
     pagination_class = StandardResultsSetPagination
-    
-    def get_queryset(self):
-        user = self.request.user
-        
-        if user.is_superuser or user.groups.filter(name='Manager').exists():
-            # Managers see all orders
-            return Order.objects.all()
-        elif user.groups.filter(name='Delivery crew').exists():
-            # 9. Delivery crew can access orders assigned to them
-            return Order.objects.filter(delivery_crew=user)
-        else:
-            # 21. Customers can browse their own orders
-            return Order.objects.filter(user=user)
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = OrderFilter
+
+    def expand_items(self):
+        expand = split_param(self.request.query_params.get('expand'))
+        if expand - {'items'}:
+            raise ValidationError({'expand': f"Unknown expansion(s): {', '.join(sorted(expand - {'items'}))}"})
+        return 'items' in expand
+
+    def compact(self):
+        return self.request.method in SAFE_METHODS and not self.expand_items()
+
+    def get_serializer_class(self):
+        return OrderListSerializer if self.compact() else OrderSerializer
+
+    def get_order_queryset(self, using):
+        queryset = super().get_order_queryset(using)
+        return with_items_count(queryset) if self.compact() else queryset
+
+    def list(self, request, *args, **kwargs):
+        aliases = shard_aliases()
+        if self.get_location() is not None or len(aliases) == 1:
+            return super().list(request, *args, **kwargs)
+
+        # No location given: merge the orders of every shard (newest first,
+        # or largest total first when filtering on total)
+        querysets = [self.filter_queryset(self.get_order_queryset(alias)) for alias in aliases]
+        ordering = querysets[0].query.order_by or Order._meta.ordering
+        orders = MergedQuerySet(querysets, key=attrgetter(ordering[0].lstrip('-')))
+        page = self.paginate_queryset(orders)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
     
     def perform_create(self, serializer):
         """20. Customers can place orders"""
         user = self.request.user
-        cart_items = Cart.objects.filter(user=user)
-        
-        if not cart_items.exists():
-            return Response({'error': 'Cart is empty'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Calculate total
-        total = sum(item.price for item in cart_items)
+        location = self.get_location()
+        using = shard_for(location)
+        cart_items = Cart.objects.using(using).filter(user=user)
         
-        # Create order
-        order = serializer.save(user=user, total=total)
-        
-        # Create order items from cart
-        for cart_item in cart_items:
-            OrderItem.objects.create(
-                order=order,
-                menuitem=cart_item.menuitem,
-                quantity=cart_item.quantity,
-                unit_price=cart_item.unit_price,
-                price=cart_item.price
-            )
-        
-        # Clear cart
-        cart_items.delete()
+        with transaction.atomic(using=using):
+            # Lock the lines: a concurrent checkout of the same cart waits,
+            # then finds them gone instead of ordering them twice
+            cart_items = list(cart_items.select_for_update().order_by('id'))
+            if not cart_items:
+                raise ValidationError({'error': 'Cart is empty'})
+            # Calculate total
+            summary = cart_summary(Cart.objects.using(using).filter(pk__in=[item.pk for item in cart_items]))
+
+            # Create order
+            order = serializer.save(user=user, total=Decimal(summary['subtotal']), location=location)
+
+            # Create order items from cart
+            OrderItem.objects.using(using).bulk_create([
+                OrderItem(
+                    order=order,
+                    menuitem_id=cart_item.menuitem_id,
+                    quantity=cart_item.quantity,
+                    unit_price=cart_item.unit_price,
+                    price=cart_item.price
+                )
+                for cart_item in cart_items
+            ])
 
-class OrderDetailView(generics.RetrieveUpdateAPIView):
+            # Clear cart
+            Cart.objects.using(using).filter(pk__in=[item.pk for item in cart_items]).delete()
+            clear_cart_snapshot(user.pk, using)
+
+            # Side work runs in the background once the order is committed
+            tasks.update_inventory.delay(order.id, using=using, commit_using=using)
+            tasks.notify_order_placed.delay(order.id, using=using, commit_using=using)
+
+class OrderDetailView(OrderQuerysetMixin, ConditionalRetrieveMixin, SparseFieldsetViewMixin, generics.RetrieveUpdateAPIView):
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated, IsOwnerOrManager]
-    
-    def get_queryset(self):
-        user = self.request.user
-        
-        if user.is_superuser or user.groups.filter(name='Manager').exists():
-            return Order.objects.all()
-        elif user.groups.filter(name='Delivery crew').exists():
-            return Order.objects.filter(delivery_crew=user)
-        else:
-            return Order.objects.filter(user=user)
+    # IsOwnerOrManager compares user_id
+    sparse_keep_fields = permission_fields = ('user',)
 
 # 7. Managers can assign users to delivery crew
 @api_view(['POST'])
@@ -246,7 +569,7 @@ def assign_to_delivery_crew(request, user_id):
 @permission_classes([IsManagerOrAdmin])
 def assign_order_to_delivery_crew(request, order_id):
     """8. Managers can assign orders to the delivery crew"""
-    order = get_object_or_404(Order, pk=order_id)
+    order = get_object_or_404(Order.objects.using(shard_for(get_request_location(request))), pk=order_id)
     delivery_crew_id = request.data.get('delivery_crew_id')
     
     if delivery_crew_id:
@@ -280,22 +603,80 @@ def remove_from_delivery_crew(request, user_id):
         'message': f'{user.username} removed from delivery crew'
     })
 
+# Bulk versions of 1 and 7: the group, then one query over the users and one write
+MEMBERSHIP_GROUPS = {
+    # URL name -> (group, who may change it)
+    'manager': ('Manager', IsAdminUser),
+    'delivery-crew': ('Delivery crew', IsManagerOrAdmin),
+}
+MEMBERSHIP_BATCH_LIMIT = 1000
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def group_members(request, group):
+    """
+    Add the users in "add" to the group and remove those in "remove".
+    Safe to repeat: users already in (or out of) the group are reported
+    and left alone.
+    """
+    if group not in MEMBERSHIP_GROUPS:
+        raise NotFound(f"Unknown group. Use: {', '.join(MEMBERSHIP_GROUPS)}")
+    group_name, permission = MEMBERSHIP_GROUPS[group]
+    if not permission().has_permission(request, None):
+        raise PermissionDenied()
+    add = requested_ids(request, 'add', MEMBERSHIP_BATCH_LIMIT, required=False)
+    remove = requested_ids(request, 'remove', MEMBERSHIP_BATCH_LIMIT, required=False)
+    if not add and not remove:
+        raise ValidationError({'error': 'Give the user ids to "add" and/or "remove"'})
+    if set(add) & set(remove):
+        raise ValidationError({'error': 'A user cannot be both added and removed'})
+
+    group_obj, created = Group.objects.get_or_create(name=group_name)
+    Membership = User.groups.through
+    members = dict(
+        User.objects.filter(pk__in=add + remove)
+        .annotate(member=Exists(Membership.objects.filter(user=OuterRef('pk'), group=group_obj)))
+        .values_list('pk', 'member')
+    )
+    to_add = [pk for pk in add if members.get(pk) is False]
+    to_remove = [pk for pk in remove if members.get(pk)]
+    with transaction.atomic():
+        if to_add:
+            # ignore_conflicts: a concurrent request may have added some since
+            Membership.objects.bulk_create(
+                [Membership(user_id=pk, group=group_obj) for pk in to_add], ignore_conflicts=True
+            )
+        if to_remove:
+            Membership.objects.filter(group=group_obj, user_id__in=to_remove).delete()
+    if request.user.pk in members:
+        clear_roles(request.user)
+
+    results = []
+    for pk in add:
+        result = 'not_found' if pk not in members else 'added' if pk in to_add else 'already_member'
+        results.append({'id': pk, 'result': result})
+    for pk in remove:
+        result = 'not_found' if pk not in members else 'removed' if pk in to_remove else 'not_member'
+        results.append({'id': pk, 'result': result})
+    return Response({
+        'group': GroupSerializer(group_obj).data,
+        'added': len(to_add),
+        'removed': len(to_remove),
+        'results': results,
+    })
+
 # Delivery crew management views
-class DeliveryCrewListView(generics.ListAPIView):
+class DeliveryCrewListView(GroupMemberListView):
     """List all delivery crew members"""
-    serializer_class = UserSerializer
     permission_classes = [IsManagerOrAdmin]
-    
-    def get_queryset(self):
-        delivery_group = Group.objects.get(name='Delivery crew')
-        return User.objects.filter(groups=delivery_group)
+    group_name = 'Delivery crew'
 
 # 10. Delivery crew can update order as delivered
 @api_view(['PATCH'])
 @permission_classes([IsDeliveryCrewOrManager])
 def update_order_status(request, order_id):
     """10. Delivery crew can update an order as delivered"""
-    order = get_object_or_404(Order, pk=order_id)
+    order = get_object_or_404(Order.objects.using(shard_for(get_request_location(request))), pk=order_id)
     
     # Check if delivery crew can only update their assigned orders
     if (request.user.groups.filter(name='Delivery crew').exists() and 
@@ -316,3 +697,268 @@ def update_order_status(request, order_id):
     
     return Response({'error': 'Invalid status. Use: preparing, out_for_delivery, delivered'}, 
                    status=status.HTTP_400_BAD_REQUEST)
+
+# Batch versions of 8 and 10: one permission query, one conditional UPDATE
+ORDER_BATCH_LIMIT = 100
+
+def requested_ids(request, name, limit, required=True):
+    """The list of ids in request.data[name], without duplicates"""
+    ids = request.data.get(name)
+    if ids is None and not required:
+        return []
+    if not isinstance(ids, list) or not ids or not all(isinstance(pk, int) and not isinstance(pk, bool) for pk in ids):
+        raise ValidationError({name: 'A list of ids is required'})
+    if len(ids) > limit:
+        raise ValidationError({name: f'At most {limit} ids per request'})
+    return list(dict.fromkeys(ids))
+
+def requested_id(request, name):
+    """The id in request.data[name] (a number or numeric string), or None when missing"""
+    value = request.data.get(name)
+    if value in (None, ''):
+        return None
+    try:
+        return serializers.IntegerField(min_value=1).run_validation(value)
+    except ValidationError as exc:
+        raise ValidationError({name: exc.detail})
+
+def apply_order_batch(request, ids, check, changes, allowed_from):
+    """
+    Lock the orders, sort each into a result with check(order) (an error
+    message or None) and UPDATE the accepted ones in one statement,
+    still conditional on their status.
+    """
+    using = shard_for(get_request_location(request))
+    with transaction.atomic(using=using):
+        orders = {
+            order.pk: order for order in
+            Order.objects.using(using).select_for_update().filter(pk__in=ids).only('id', 'status', 'delivery_crew_id')
+        }
+        results, accepted = [], []
+        for pk in ids:
+            order = orders.get(pk)
+            error = 'Not found' if order is None else check(order)
+            if error:
+                results.append({'id': pk, 'updated': False, 'error': error})
+            else:
+                accepted.append(pk)
+                results.append({'id': pk, 'updated': True})
+        updated = 0
+        if accepted:
+            updated = Order.objects.using(using).filter(pk__in=accepted, status__in=allowed_from).update(
+                **changes, updated_at=timezone.now()
+            )
+    for result in results:
+        order = orders.get(result['id'])
+        if order is not None:
+            result['status'] = changes['status'] if result['updated'] else order.status
+    return Response({'updated': updated, 'results': results})
+
+@api_view(['PATCH'])
+@permission_classes([IsManagerOrAdmin])
+def assign_orders_to_delivery_crew(request):
+    """8. Managers can assign pending (or reassign preparing) orders to the delivery crew, many at once"""
+    ids = requested_ids(request, 'orders', ORDER_BATCH_LIMIT)
+    delivery_crew_id = requested_id(request, 'delivery_crew_id')
+    if not delivery_crew_id:
+        return Response({'error': 'delivery_crew_id is required'}, status=status.HTTP_400_BAD_REQUEST)
+    delivery_crew = User.objects.filter(pk=delivery_crew_id, groups__name='Delivery crew').only('id').first()
+    if delivery_crew is None:
+        return Response({'error': 'User is not in delivery crew'}, status=status.HTTP_400_BAD_REQUEST)
+
+    allowed_from = ('pending', 'preparing')
+
+    def check(order):
+        if order.status not in allowed_from:
+            return f'Cannot assign an order that is {order.status}'
+
+    return apply_order_batch(
+        request, ids, check, {'delivery_crew_id': delivery_crew.pk, 'status': 'preparing'}, allowed_from
+    )
+
+@api_view(['PATCH'])
+@permission_classes([IsDeliveryCrewOrManager])
+def update_orders_status(request):
+    """10. Delivery crew can move many of their orders to the next status at once"""
+    ids = requested_ids(request, 'orders', ORDER_BATCH_LIMIT)
+    new_status = request.data.get('status')
+    allowed_from = [current for current, following in Order.TRANSITIONS.items() if following == new_status]
+    if not allowed_from:
+        return Response({'error': 'Invalid status. Use: preparing, out_for_delivery, delivered'},
+                        status=status.HTTP_400_BAD_REQUEST)
+    user = request.user
+    own_only = not user.is_superuser and 'Manager' not in get_roles(user)
+
+    def check(order):
+        if own_only and order.delivery_crew_id != user.pk:
+            return 'You can only update orders assigned to you'
+        if order.status not in allowed_from:
+            return f'Cannot move an order from {order.status} to {new_status}'
+
+    return apply_order_batch(request, ids, check, {'status': new_status}, allowed_from)
+
+# Bootstrap: everything a client loads on launch, in one request
+RECENT_ORDERS = 5
+
+def first_menu_page(location, page_size):
+    menu = available_at(MenuItem.objects.select_related('category'), location)
+    return {
+        'count': menu.count(),
+        'results': MenuItemListSerializer(menu[:page_size], many=True).data,
+    }
+
+def menu_page_url(request, location, page_size, page):
+    """menu-items/ link to a page of the same location and page size (not cached: it names the host)"""
+    url = request.build_absolute_uri(reverse('menu_items'))
+    if location is not None:
+        url = replace_query_param(url, 'location', location.slug)
+    if page_size != StandardResultsSetPagination.page_size:
+        url = replace_query_param(url, 'page_size', page_size)
+    return replace_query_param(url, 'page', page)
+
+def menu_highlights(location):
+    menu = available_at(MenuItem.objects.select_related('category'), location)
+    items = MenuItemListSerializer(menu.filter(Q(featured=True) | Q(item_of_the_day=True)), many=True).data
+    return {
+        'featured': [item for item in items if item['featured']],
+        'item_of_the_day': [item for item in items if item['item_of_the_day']],
+    }
+
+def recent_orders(user, location):
+    aliases = [shard_for(location)] if location is not None else shard_aliases()
+    querysets = [
+        with_items_count(Order.objects.using(alias).filter(**order_scope(user))).order_by('-date')
+        for alias in aliases
+    ]
+    orders = MergedQuerySet(querysets, key=attrgetter('date'))[:RECENT_ORDERS]
+    return OrderListSerializer(orders, many=True).data
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def bootstrap(request):
+    """
+    Replaces the api_root, categories/, menu-items/, cart/ and orders/ calls
+    a client makes on launch. Location and roles are resolved once, the
+    catalog parts come from the catalog cache in one round trip, the cart
+    from the cart snapshot, and recent orders in their compact list form.
+    """
+    user = request.user
+    location = get_request_location(request)
+    roles = get_roles(user)
+    page_size = StandardResultsSetPagination().get_page_size(request)
+
+    catalog = cached_catalog_fragments({
+        'categories': lambda: CategorySerializer(Category.objects.all(), many=True).data,
+        'menu': lambda: first_menu_page(location, page_size),
+        'highlights': lambda: menu_highlights(location),
+    }, variant=f"{location.slug if location else ''}:{page_size}")
+    menu = catalog['menu']
+
+    data = {
+        'user': {
+            'username': user.username if user.is_authenticated else 'Anonymous',
+            'groups': sorted(roles),
+        },
+        'location': location.slug if location else None,
+        'endpoints': API_ENDPOINTS,
+        'categories': catalog['categories'],
+        'menu': {
+            'count': menu['count'],
+            'next': menu_page_url(request, location, page_size, 2) if menu['count'] > page_size else None,
+            'results': menu['results'],
+        },
+        'featured': catalog['highlights']['featured'],
+        'item_of_the_day': catalog['highlights']['item_of_the_day'],
+        'cart': None,
+        'recent_orders': [],
+    }
+    if user.is_authenticated:
+        # The lines and summary of GET cart/
+        data['cart'] = cart_snapshot(user, shard_for(location))
+        data['recent_orders'] = recent_orders(user, location)
+    return Response(data)
+
+# Demand forecasts (python manage.py build_forecasts)
+@api_view(['GET'])
+@permission_classes([IsManagerOrAdmin])
+def demand_forecasts(request):
+    """Managers can see the expected demand per menu item for the coming hours"""
+    hours = get_limit(request, 24, name='hours', maximum=forecasting.HOURS_PER_WEEK)
+    filterset = ForecastFilter(request.query_params, queryset=MenuItem.objects.values('id', 'title', 'inventory'))
+    if not filterset.is_valid():
+        raise ValidationError(filterset.errors)
+    forecast = forecasting.get_forecast()
+    start = timezone.localtime().replace(minute=0, second=0, microsecond=0)
+    upcoming = forecasting.upcoming(forecast, hours, start)
+
+    menu_items = {item['id']: item for item in filterset.qs}
+
+    results = []
+    for menuitem_id, hourly in zip(forecast['menu_ids'].tolist(), upcoming.round(2).tolist()):
+        if menuitem_id in menu_items:
+            item = menu_items[menuitem_id]
+            total = round(sum(hourly), 2)
+            results.append({
+                'menuitem': menuitem_id,
+                'title': item['title'],
+                'inventory': item['inventory'],
+                'hourly': hourly,
+                'total': total,
+                'suggested_inventory': math.ceil(total),
+            })
+    results.sort(key=lambda result: -result['total'])
+    return Response({
+        'start': start,
+        'hours': hours,
+        'built_at': forecast['built_at'],
+        'weeks': forecast['weeks'],
+        'results': results,
+    })
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def task_metrics(request):
+    """Background task counters for this process and the durable queue"""
+    pending = BackgroundTask.objects.filter(status=BackgroundTask.PENDING)
+    oldest = pending.aggregate(oldest=Min('created_at'))['oldest']
+    return Response({
+        'executor': background.metrics.snapshot(),
+        'durable_queue': {
+            'pending': pending.count(),
+            'failed': BackgroundTask.objects.filter(status=BackgroundTask.FAILED).count(),
+            'oldest_pending_seconds': (timezone.now() - oldest).total_seconds() if oldest else 0,
+        },
+    })
+
+# Request metrics (middleware.MetricsMiddleware)
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def request_metrics(request):
+    """Latency histograms, status codes, query and cache counters of every worker, in Prometheus text format"""
+    return HttpResponse(metrics.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+# Request profiles (?_profile / X-Profile, see middleware.ProfilingMiddleware)
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def profiles(request):
+    """Recent profile captures, newest first, with their top functions"""
+    top = get_limit(request, 10, name='top', maximum=profiling.get_setting('TOP_FUNCTIONS'))
+    captures = profiling.list_captures(get_limit(request, 20, maximum=profiling.get_setting('KEEP')))
+    for capture in captures:
+        capture['top_functions'] = capture['top_functions'][:top]
+        capture['sql'].pop('slowest')
+    return Response({'results': captures})
+
+@api_view(['GET'])
+@permission_classes([IsAdminUser])
+def profile_detail(request, capture_id):
+    """One capture: top functions and slowest SQL; ?download returns the cProfile dump"""
+    if 'download' in request.query_params:
+        path = profiling.capture_file(capture_id)
+        if path is None:
+            return Response({'error': 'Profile not found'}, status=status.HTTP_404_NOT_FOUND)
+        return FileResponse(open(path, 'rb'), as_attachment=True, filename=path.name)
+    capture = profiling.get_capture(capture_id)
+    if capture is None:
+        return Response({'error': 'Profile not found'}, status=status.HTTP_404_NOT_FOUND)
+    return Response(capture)